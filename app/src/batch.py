@@ -0,0 +1,302 @@
+"""
+Command-line batch calculation of many entities' portfolios in parallel.
+
+Run from the app directory:
+    python -m src.batch ENTITIES --output OUT_DIR [--workers N] [--snapshot DIR] [--rates FILE] [--stream]
+
+ENTITIES is either a manifest CSV with 'entity', 'transactions' and optional
+'opening_balance' columns (paths relative to the manifest), or a directory
+with one subdirectory per entity holding a transactions file and optionally an
+opening balance file. An opening balance may be the closing_lots.npz written
+for the entity by a previous year's run, which chains the years lot by lot.
+
+Each entity's results are written to OUT_DIR/<entity>/, and one row per entity
+to OUT_DIR/summary.csv. A failing entity is reported in the summary and does
+not stop the others.
+
+With --stream, transactions files must be CSVs already sorted by date. They
+are read in chunks and the detail rows go straight to the entity's CSV files,
+so memory is bounded by the open lots rather than the size of the file.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from src.utils.file_processor import process_opening_balance, process_trade_transactions
+from src.utils.rba_rates import RBAExchangeRates, compile_rate_snapshot
+from src.utils.lot_snapshot import write_lot_snapshot, LOT_COLUMNS
+from src.models.calculation import TaxCalculator
+
+# Headline figures copied from the calculation results into the summary
+HEADLINE_KEYS = ['sales_aud', 'cost_of_shares_sold', 'gross_trading_income', 'opening_stock_value',
+                 'closing_stock_value', 'purchases_value']
+
+SUMMARY_COLUMNS = ['entity', 'status', 'error', 'transactions'] + HEADLINE_KEYS + ['seconds']
+
+# Detail elements of the results written as CSV files per entity
+DETAIL_FILES = ['sales_details', 'purchases_details', 'opening_balance', 'closing_balance', 'sale_matches']
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.npz')
+
+# Rate provider of a worker process, mapped from the shared snapshot once per worker
+_worker_rates: Optional[RBAExchangeRates] = None
+
+
+def find_entities(source: str) -> List[Dict[str, Optional[str]]]:
+    """
+    List the entities to calculate from a manifest CSV or an entities directory.
+    
+    Args:
+        source: Manifest CSV path, or directory with one subdirectory per entity
+    
+    Returns:
+        List of dictionaries with 'entity', 'transactions' and 'opening_balance' paths
+    
+    Raises:
+        ValueError: If the manifest is missing required columns
+    """
+    if os.path.isdir(source):
+        entities = []
+        for name in sorted(os.listdir(source)):
+            entity_dir = os.path.join(source, name)
+            if not os.path.isdir(entity_dir):
+                continue
+            files = sorted(f for f in os.listdir(entity_dir) if f.lower().endswith(SUPPORTED_EXTENSIONS))
+            transactions = [f for f in files if 'transaction' in f.lower()]
+            opening = [f for f in files if 'opening' in f.lower()]
+            entities.append({
+                'entity': name,
+                'transactions': os.path.join(entity_dir, transactions[0]) if transactions else None,
+                'opening_balance': os.path.join(entity_dir, opening[0]) if opening else None,
+            })
+        return entities
+    
+    manifest = pd.read_csv(source, dtype=str, keep_default_na=False)
+    missing = [col for col in ('entity', 'transactions') if col not in manifest.columns]
+    if missing:
+        raise ValueError(f"Manifest is missing required columns: {', '.join(missing)}")
+    
+    base_dir = os.path.dirname(os.path.abspath(source))
+    
+    def resolve(path):
+        return os.path.join(base_dir, path) if path else None
+    
+    return [{
+        'entity': row['entity'],
+        'transactions': resolve(row['transactions']),
+        'opening_balance': resolve(row.get('opening_balance', '')),
+    } for row in manifest.to_dict('records')]
+
+
+def _init_worker(snapshot_dir: str, rates_file: Optional[str]) -> None:
+    """
+    Map the shared rate snapshot into a worker process.
+    """
+    global _worker_rates
+    _worker_rates = RBAExchangeRates(snapshot_dir=snapshot_dir)
+    if rates_file:
+        _worker_rates.local_file = rates_file
+    _worker_rates.fetch_rates()
+
+
+def _entity_dir_name(entity: str) -> str:
+    """
+    Make an entity name safe to use as a directory name.
+    """
+    return re.sub(r'[^\w.-]', '_', entity) or '_'
+
+
+def write_entity_results(results: Dict[str, Any], entity_dir: str) -> None:
+    """
+    Write one entity's calculation results.
+    
+    Args:
+        results: Results dictionary produced by TaxCalculator.calculate_tax
+        entity_dir: Directory to write results.json, the detail CSV files and closing_lots.npz into
+    """
+    os.makedirs(entity_dir, exist_ok=True)
+    
+    for element in DETAIL_FILES:
+        # Streamed calculations have already written their detail files
+        if f"{element}_path" in results:
+            continue
+        pd.DataFrame(results.get(element, [])).to_csv(os.path.join(entity_dir, f"{element}.csv"), index=False)
+    
+    # Lot-level closing balance, to use as the entity's next opening balance
+    write_lot_snapshot(os.path.join(entity_dir, 'closing_lots.npz'),
+                       pd.DataFrame(results.get('closing_lots', []), columns=LOT_COLUMNS))
+    
+    headline = {key: float(results[key]) for key in HEADLINE_KEYS}
+    headline['calculation_date'] = results['calculation_date']
+    with open(os.path.join(entity_dir, 'results.json'), 'w') as f:
+        json.dump(headline, f, indent=2)
+
+
+def calculate_entity(entity: Dict[str, Optional[str]], output_dir: str, stream: bool = False) -> Dict[str, Any]:
+    """
+    Calculate one entity and write its results, capturing any failure.
+    
+    Args:
+        entity: Dictionary with 'entity', 'transactions' and 'opening_balance' paths
+        output_dir: Batch output directory
+        stream: Read the date-sorted transactions CSV in chunks instead of loading it whole
+    
+    Returns:
+        Summary row for the entity
+    """
+    start = time.perf_counter()
+    summary = {col: None for col in SUMMARY_COLUMNS}
+    summary['entity'] = entity['entity']
+    
+    try:
+        error = _calculate_entity(entity, output_dir, summary, stream)
+    except Exception as e:
+        error = f"Unexpected error: {str(e)}"
+    
+    summary['status'] = 'error' if error else 'ok'
+    summary['error'] = error or ''
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def _calculate_entity(entity: Dict[str, Optional[str]], output_dir: str, summary: Dict[str, Any],
+                      stream: bool = False) -> str:
+    """
+    Calculate one entity, filling in its summary row.
+    
+    Returns:
+        Error message, or an empty string on success
+    """
+    if not entity['transactions']:
+        return "No transactions file found"
+    
+    entity_dir = os.path.join(output_dir, _entity_dir_name(entity['entity']))
+    rates = _worker_rates if _worker_rates is not None else RBAExchangeRates()
+    calculator = TaxCalculator(rates)
+    
+    if entity['opening_balance']:
+        success, error_msg, opening_balance = process_opening_balance(entity['opening_balance'])
+        if not success:
+            return f"Opening balance file error: {error_msg}"
+        calculator.set_opening_balance(opening_balance)
+    
+    if stream:
+        success, error_msg, results = calculator.calculate_tax_streaming(entity['transactions'], entity_dir)
+        if not success:
+            return error_msg
+        summary['transactions'] = calculator.timer.rows.get('parse', 0)
+    else:
+        success, error_msg, transactions = process_trade_transactions(entity['transactions'])
+        if not success:
+            return f"Transactions file error: {error_msg}"
+        summary['transactions'] = len(transactions)
+        
+        calculator.set_transactions(transactions)
+        success, error_msg, results = calculator.calculate_tax()
+        if not success:
+            return error_msg
+    
+    write_entity_results(results, entity_dir)
+    summary.update({key: float(results[key]) for key in HEADLINE_KEYS})
+    return ""
+
+
+def run_batch(entities: List[Dict[str, Optional[str]]], output_dir: str, workers: Optional[int] = None,
+              snapshot_dir: Optional[str] = None, rates_file: Optional[str] = None,
+              progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None,
+              stream: bool = False) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Calculate many entities across a process pool.
+    
+    Every worker maps the same binary rate snapshot, so the rate table is
+    parsed once for the whole batch and its pages are shared between workers.
+    
+    Args:
+        entities: Entities as returned by find_entities
+        output_dir: Directory for per-entity results and the summary
+        workers: Number of worker processes (defaults to the CPU count)
+        snapshot_dir: Existing rate snapshot to use (compiled for the run if omitted)
+        rates_file: RBA rates CSV to use instead of the default local file
+        progress: Optional callback invoked as progress(done, total, summary_row)
+        stream: Read each date-sorted transactions CSV in chunks instead of loading it whole
+    
+    Returns:
+        Tuple of (summary rows in entity order, batch totals including entities per second)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    
+    with tempfile.TemporaryDirectory() as scratch:
+        if snapshot_dir is None:
+            snapshot_dir = os.path.join(scratch, 'rates')
+            compile_rate_snapshot([rates_file or RBAExchangeRates().local_file], snapshot_dir)
+        
+        rows: List[Optional[Dict[str, Any]]] = [None] * len(entities)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(snapshot_dir, rates_file)) as pool:
+            futures = {pool.submit(calculate_entity, entity, output_dir, stream): i for i, entity in enumerate(entities)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                try:
+                    rows[i] = future.result()
+                except Exception as e:
+                    # The worker itself failed (e.g. it was killed), not just the calculation
+                    rows[i] = {col: None for col in SUMMARY_COLUMNS}
+                    rows[i].update({'entity': entities[i]['entity'], 'status': 'error',
+                                    'error': f"Worker failed: {str(e)}"})
+                if progress is not None:
+                    progress(done, len(entities), rows[i])
+    
+    elapsed = time.perf_counter() - start
+    succeeded = sum(1 for row in rows if row['status'] == 'ok')
+    totals = {
+        'entities': len(entities),
+        'succeeded': succeeded,
+        'failed': len(entities) - succeeded,
+        'seconds': elapsed,
+        'entities_per_second': len(entities) / elapsed if elapsed > 0 else 0.0,
+    }
+    
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS).astype({'transactions': 'Int64'})
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(totals, f, indent=2)
+    
+    return rows, totals
+
+
+def _print_progress(done: int, total: int, row: Dict[str, Any]) -> None:
+    status = row['status'] if row['status'] == 'ok' else f"error: {row['error']}"
+    print(f"[{done}/{total}] {row['entity']}: {status}", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Calculate many entities' portfolios in parallel.")
+    parser.add_argument('entities', help='Manifest CSV or directory with one subdirectory per entity')
+    parser.add_argument('--output', required=True, help='Directory for per-entity results and the summary')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--snapshot', default=os.environ.get('RATE_SNAPSHOT_DIR'),
+                        help='Existing rate snapshot directory to share between workers')
+    parser.add_argument('--rates', default=None, help='RBA rates CSV to use instead of the default')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read date-sorted transactions CSVs in chunks, for files too large to load whole')
+    args = parser.parse_args(argv)
+    
+    entities = find_entities(args.entities)
+    _, totals = run_batch(entities, args.output, args.workers, args.snapshot, args.rates, _print_progress,
+                          args.stream)
+    
+    print(f"{totals['succeeded']}/{totals['entities']} entities calculated in {totals['seconds']:.2f}s "
+          f"({totals['entities_per_second']:.1f} entities/s)")
+    return 0 if totals['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,144 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import (Flask, Request, Response, render_template, stream_template, request, jsonify, session, redirect,
+                   current_app, send_file, g, make_response)
 import os
 import sys
+import json
+import shutil
+import functools
+import tracemalloc
 import pandas as pd
+import io
 import tempfile
-import uuid
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
 
 # Import custom modules
-from src.utils.file_processor import process_opening_balance, process_trade_transactions
-from src.utils.rba_rates import RBAExchangeRates
+from src.utils.file_processor import process_opening_balance, process_trade_transactions, open_upload
+from src.utils.rba_rates import RBAExchangeRates, get_rate_store
+from src.utils.result_store import ResultStore
+from src.utils.detail_tables import build_detail_tables, display_rows, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.utils.lot_snapshot import write_lot_snapshot, LOT_COLUMNS
+from src.utils.calculation_cache import CalculationCache
+from src.utils.excel_reader import get_excel_cache
+from src.utils.response_encoding import (response_formats, content_encodings, iter_json, iter_arrow, compress,
+                                         ARROW_MIME_TYPE)
+from src.utils.job_queue import JobQueue, FINISHED
+from src.utils.stage_timer import StageTimer
+from src.utils.instrumentation import StageMetrics, server_timing, timed_stream, profiled, profilers
 from src.models.calculation import TaxCalculator
+from src.models.symbol_state import SymbolStateCache
 
 # Required configuration for deployment
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+
+class UploadRequest(Request):
+    """Request that keeps uploaded files in memory until they pass the spool threshold."""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_THRESHOLD'],
+                                             mode='w+b', dir=current_app.config['UPLOAD_FOLDER'])
+
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.secret_key = os.urandom(24)  # For session management
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit upload size to 16MB
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()  # Use temp directory for uploads
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # Limit upload size to 64MB
+app.config['UPLOAD_SPOOL_THRESHOLD'] = 4 * 1024 * 1024  # Uploads larger than 4MB spool to disk
+app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()  # Use temp directory for spooled uploads
+app.config['RESULT_CACHE_SIZE'] = 32  # Calculation results kept in memory
+app.config['RESULT_CACHE_TTL'] = 60 * 60  # Seconds a calculation result stays available
+app.config['RESULT_CACHE_SPILL_DIR'] = os.environ.get('RESULT_CACHE_SPILL_DIR')  # Optional on-disk tier
+app.config['RATE_SNAPSHOT_DIR'] = os.environ.get('RATE_SNAPSHOT_DIR')  # Optional compiled rate snapshot
+app.config['RATE_SOURCE'] = os.environ.get('RATE_SOURCE')  # URL or directory rate refreshes fetch from
+app.config['RATE_REFRESH_ENABLED'] = os.environ.get('RATE_REFRESH_ENABLED', '') == '1'  # Allow POST /rates/refresh (rewrites the local rates file)
+app.config['RATE_HISTORY_FILES'] = [f for f in os.environ.get('RATE_HISTORY_FILES', '').split(os.pathsep) if f]
+app.config['RATE_PERIOD_CACHE_SIZE'] = int(os.environ.get('RATE_PERIOD_CACHE_SIZE', 2))  # History periods kept parsed
+app.config['CALCULATION_CACHE_SIZE'] = int(os.environ.get('CALCULATION_CACHE_SIZE', 64))  # Whole results kept for identical uploads (0: off)
+app.config['CALCULATION_CACHE_DIR'] = os.environ.get('CALCULATION_CACHE_DIR')  # Optional on-disk tier
+app.config['SYMBOL_STATE_CACHE_SIZE'] = int(os.environ.get('SYMBOL_STATE_CACHE_SIZE', 10000))  # Symbols kept for incremental recalculation (0: off)
+app.config['SYMBOL_STATE_CACHE_ROWS'] = int(os.environ.get('SYMBOL_STATE_CACHE_ROWS', 2000000))  # Transaction rows held by all kept symbol states
+app.config['FIFO_WORKERS'] = int(os.environ.get('FIFO_WORKERS', 0))  # Processes matching (or replaying) symbols in parallel (0: serial)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # Uploads calculated in the background at the same time
+app.config['JOB_DB'] = os.environ.get('JOB_DB')  # Optional SQLite file job progress is persisted to
+app.config['JOB_EVENT_KEEPALIVE'] = 15  # Seconds between keepalive comments on a quiet progress stream
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')  # Where X-Profile requests write profiles (unset: off)
+app.config['TRACE_MEMORY'] = os.environ.get('TRACE_MEMORY', '') == '1'  # Record peak memory per stage (slows requests)
+
+# Detail views available for a calculation result, keyed by results element
+DETAIL_ELEMENTS = {
+    'sales_details': 'Sales Details',
+    'opening_balance': 'Opening Balance',
+    'purchases_details': 'Purchases Details',
+    'closing_balance': 'Closing Balance',
+}
+
+# Initialize RBA exchange rates, shared by all requests through the process-wide rate store
+rba_rates = RBAExchangeRates(snapshot_dir=app.config['RATE_SNAPSHOT_DIR'])
+if app.config['RATE_SOURCE']:
+    rba_rates.rate_source = app.config['RATE_SOURCE']
+for history_file in app.config['RATE_HISTORY_FILES']:
+    rba_rates.register_period_file(history_file, max_loaded=app.config['RATE_PERIOD_CACHE_SIZE'])
+rba_rates.fetch_rates()
+
+# Optional process pool that large calculations spread their symbols across
+fifo_executor = ProcessPoolExecutor(app.config['FIFO_WORKERS']) if app.config['FIFO_WORKERS'] > 1 else None
+
+# Results of earlier calculations, returned again when identical files are re-submitted
+calculation_cache = (CalculationCache(app.config['CALCULATION_CACHE_SIZE'], app.config['CALCULATION_CACHE_DIR'])
+                     if app.config['CALCULATION_CACHE_SIZE'] > 0 else None)
 
-# Initialize RBA exchange rates
-rba_rates = RBAExchangeRates()
+# Per-symbol matching state, so re-uploads of an amended file only replay the symbols that changed
+symbol_states = (SymbolStateCache(app.config['SYMBOL_STATE_CACHE_SIZE'], app.config['SYMBOL_STATE_CACHE_ROWS'])
+                 if app.config['SYMBOL_STATE_CACHE_SIZE'] > 0 else None)
+
+# Calculation results are kept server-side so pages only pass a result id around
+result_store = ResultStore(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'],
+                           app.config['RESULT_CACHE_SPILL_DIR'])
+
+# Background calculations of uploads submitted in job mode
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_DB'])
+
+# Compile the result page templates up front rather than on their first request
+for template_name in ('results.html', 'details.html'):
+    app.jinja_env.get_template(template_name)
+
+# Stage timings of every instrumented request, served by /metrics
+stage_metrics = StageMetrics()
+if app.config['TRACE_MEMORY']:
+    tracemalloc.start()
+
+
+def instrumented(view):
+    """
+    Time the stages of a view with g.timer and report them.
+    
+    The response gets a Server-Timing header and the stages are added to
+    /metrics. When PROFILE_DIR is set, a request with an ``X-Profile: cprofile``
+    (or ``1``) or ``X-Profile: pyinstrument`` header is also profiled, and the
+    profile file name comes back in the X-Profile-Dump header.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.timer = StageTimer()
+        profiler = request.headers.get('X-Profile', '').lower()
+        
+        if profiler and current_app.config['PROFILE_DIR']:
+            profiler = 'cprofile' if profiler == '1' else profiler
+            if profiler not in profilers():
+                return jsonify({'success': False, 'error': f'Unknown or unavailable profiler: {profiler}'}), 400
+            with profiled(profiler, current_app.config['PROFILE_DIR'], request.endpoint) as dump:
+                response = make_response(view(*args, **kwargs))
+            response.headers['X-Profile-Dump'] = os.path.basename(dump['path'])
+        else:
+            response = make_response(view(*args, **kwargs))
+        
+        response.headers['Server-Timing'] = server_timing(g.timer)
+        stage_metrics.observe(request.endpoint, g.timer)
+        return response
+    
+    return wrapper
 
 
 @app.route('/')
@@ -29,53 +147,39 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/upload', methods=['POST'])
-def upload_files():
-    """Handle file uploads for opening balance and transactions."""
-    # Check if transaction file was uploaded
-    if 'transactions' not in request.files:
-        return jsonify({'success': False, 'error': 'Transaction file is required'}), 400
+def _calculate_upload(transactions, opening_balance, timer):
+    """
+    Parse uploaded files, calculate the tax and store the results.
     
-    transactions_file = request.files['transactions']
-    
-    # Check if transaction filename is empty
-    if transactions_file.filename == '':
-        return jsonify({'success': False, 'error': 'Transaction file is required'}), 400
+    Args:
+        transactions: Tuple of (path or binary stream, filename, Excel sheet or None) of the trade transactions
+        opening_balance: Tuple of (path or binary stream, filename, Excel sheet or None) of the opening balance, or None
+        timer: StageTimer the parse, fx, fifo and render stages are timed with
     
+    Returns:
+        Tuple of (HTTP status code, response dictionary)
+    """
     try:
-        # Save transaction file to temporary location
-        transactions_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                        f"{uuid.uuid4()}_{transactions_file.filename}")
-        transactions_file.save(transactions_path)
-        
-        # Process transactions file
-        success_tx, error_tx, transactions_df = process_trade_transactions(transactions_path)
+        with timer.stage('parse'):
+            success_tx, error_tx, transactions_df = process_trade_transactions(*transactions)
+            if success_tx:
+                timer.count('parse', len(transactions_df))
         if not success_tx:
-            # Clean up file
-            os.remove(transactions_path)
-            return jsonify({'success': False, 'error': f'Transactions file error: {error_tx}'}), 400
-        
-        # Initialize tax calculator
-        calculator = TaxCalculator()
+            return 400, {'success': False, 'error': f'Transactions file error: {error_tx}'}
         
-        # Check if opening balance file was uploaded (now optional)
-        opening_balance_df = None
-        opening_balance_path = None
+        # Initialize tax calculator with the shared exchange rates
+        calculator = TaxCalculator(rba_rates, fifo_executor, symbol_states, calculation_cache,
+                                   fifo_partitions=app.config['FIFO_WORKERS'])
+        calculator.timer = timer
         
-        if 'opening_balance' in request.files and request.files['opening_balance'].filename != '':
-            opening_balance_file = request.files['opening_balance']
-            opening_balance_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                              f"{uuid.uuid4()}_{opening_balance_file.filename}")
-            opening_balance_file.save(opening_balance_path)
-            
-            # Process opening balance file
-            success_ob, error_ob, opening_balance_df = process_opening_balance(opening_balance_path)
+        # Opening balance is optional
+        if opening_balance is not None:
+            with timer.stage('parse'):
+                success_ob, error_ob, opening_balance_df = process_opening_balance(*opening_balance)
+                if success_ob:
+                    timer.count('parse', len(opening_balance_df))
             if not success_ob:
-                # Clean up files
-                os.remove(transactions_path)
-                if opening_balance_path:
-                    os.remove(opening_balance_path)
-                return jsonify({'success': False, 'error': f'Opening balance file error: {error_ob}'}), 400
+                return 400, {'success': False, 'error': f'Opening balance file error: {error_ob}'}
             
             calculator.set_opening_balance(opening_balance_df)
         
@@ -85,67 +189,370 @@ def upload_files():
         # Calculate tax
         success_calc, error_calc, results = calculator.calculate_tax()
         if not success_calc:
-            # Clean up files
-            os.remove(transactions_path)
-            if opening_balance_path:
-                os.remove(opening_balance_path)
-            return jsonify({'success': False, 'error': f'Calculation error: {error_calc}'}), 400
-        
-        # Clean up files
-        os.remove(transactions_path)
-        if opening_balance_path:
-            os.remove(opening_balance_path)
-        
-        # Render the results template and return it directly
-        rendered_html = render_template('results.html', results=results)
-        return jsonify({'success': True, 'html': rendered_html, 'results': results})
+            return 400, {'success': False, 'error': f'Calculation error: {error_calc}'}
         
+        # Keep the results server-side and send the browser to them by id
+        with timer.stage('render'):
+            result_id = result_store.put(build_detail_tables(results))
+            timer.count('render', len(results.get('sales_details', [])) + len(results.get('purchases_details', [])))
+        return 200, {'success': True, 'result_id': result_id, 'redirect': f'/results/{result_id}',
+                     'reuse': results.get('reuse'), 'fx_lookups': results.get('fx_lookups'),
+                     'cache_hit': results.get('cache_hit', False)}
+    
     except Exception as e:
-        # Clean up files if they exist
-        if 'transactions_path' in locals() and os.path.exists(transactions_path):
-            os.remove(transactions_path)
-        if 'opening_balance_path' in locals() and opening_balance_path and os.path.exists(opening_balance_path):
-            os.remove(opening_balance_path)
+        return 500, {'success': False, 'error': f'Error processing files: {str(e)}'}
+
+
+def _spool_upload(file_storage, sheet_name):
+    """
+    Copy an upload to a temporary file that outlives the request.
+    
+    Returns:
+        Tuple of (path, filename, sheet_name)
+    """
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file_storage.filename)[1],
+                                dir=current_app.config['UPLOAD_FOLDER'])
+    with os.fdopen(fd, 'wb') as spooled, open_upload(file_storage) as stream:
+        shutil.copyfileobj(stream, spooled)
+    return path, file_storage.filename, sheet_name
+
+
+def _run_upload_job(transactions, opening_balance, timer):
+    """Calculate spooled uploads on a job worker, removing the spooled files afterwards."""
+    try:
+        return _calculate_upload(transactions, opening_balance, timer)[1]
+    finally:
+        stage_metrics.observe('upload_job', timer)
+        for spooled in (transactions, opening_balance):
+            if spooled is not None and os.path.exists(spooled[0]):
+                os.remove(spooled[0])
+
+
+@app.route('/upload', methods=['POST'])
+@instrumented
+def upload_files():
+    """
+    Handle file uploads for opening balance and transactions.
+    
+    With ``async=1`` in the query string or form the calculation is queued and
+    the response carries a job id to follow its progress with instead. With
+    ``debug=1`` the response includes the figures recorded for each stage.
+    """
+    # The request body is read, and large files spooled to disk, on first access
+    with g.timer.stage('upload'):
+        files = request.files
+    
+    # Check if transaction file was uploaded
+    if 'transactions' not in files:
+        return jsonify({'success': False, 'error': 'Transaction file is required'}), 400
+    
+    transactions_file = files['transactions']
+    
+    # Check if transaction filename is empty
+    if transactions_file.filename == '':
+        return jsonify({'success': False, 'error': 'Transaction file is required'}), 400
+    
+    opening_balance_file = files.get('opening_balance')
+    if opening_balance_file is not None and opening_balance_file.filename == '':
+        opening_balance_file = None
+    
+    # Excel sheets to read; by default the sheet holding the required columns is found
+    transactions_sheet = request.values.get('transactions_sheet') or None
+    opening_balance_sheet = request.values.get('opening_balance_sheet') or None
+    
+    if request.values.get('async', '').lower() in ('1', 'true', 'yes'):
+        with g.timer.stage('upload'):
+            transactions = _spool_upload(transactions_file, transactions_sheet)
+            opening_balance = (_spool_upload(opening_balance_file, opening_balance_sheet)
+                               if opening_balance_file is not None else None)
+        job_id = job_queue.submit(lambda timer: _run_upload_job(transactions, opening_balance, timer))
+        return jsonify({'success': True, 'job_id': job_id, 'status_url': f'/jobs/{job_id}',
+                        'events_url': f'/jobs/{job_id}/events'}), 202
+    
+    # Parse straight from the upload streams, which are closed once the calculation ends
+    with ExitStack() as uploads:
+        transactions = (uploads.enter_context(open_upload(transactions_file)), transactions_file.filename,
+                        transactions_sheet)
+        opening_balance = None
+        if opening_balance_file is not None:
+            opening_balance = (uploads.enter_context(open_upload(opening_balance_file)), opening_balance_file.filename,
+                               opening_balance_sheet)
         
-        return jsonify({'success': False, 'error': f'Error processing files: {str(e)}'}), 500
+        status, response = _calculate_upload(transactions, opening_balance, g.timer)
+    
+    if request.values.get('debug', '').lower() in ('1', 'true', 'yes'):
+        response['timings'] = g.timer.summary()
+    return jsonify(response), status
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status, current stage and stage timings of a queued calculation."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify(dict(job, success=True))
 
 
-@app.route('/results', methods=['GET', 'POST'])
-def results():
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream the progress of a queued calculation as server-sent events until it finishes."""
+    if job_queue.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    keepalive = current_app.config['JOB_EVENT_KEEPALIVE']
+    
+    def events():
+        version = -1
+        while True:
+            job, changed = job_queue.wait(job_id, version, keepalive)
+            if job is None:
+                return
+            if changed == version:
+                yield ': keepalive\n\n'
+                continue
+            
+            version = changed
+            yield f"data: {json.dumps(job)}\n\n"
+            if job['status'] in FINISHED:
+                return
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/results')
+@app.route('/results/<result_id>')
+@instrumented
+def results(result_id=None):
     """Display tax calculation results."""
-    if request.method == 'POST' and request.is_json:
-        # Get data directly from the AJAX request
-        data = request.get_json()
-        if 'results' in data:
-            # Render the results template with the provided data
-            rendered_html = render_template('results.html', results=data['results'])
-            return jsonify({'success': True, 'html': rendered_html})
-        else:
-            return jsonify({'success': False, 'error': 'Invalid data format'}), 400
-    else:
-        # Direct access without data should show error
-        return render_template('error.html', error='No calculation results found. Please upload files first.')
-
-
-@app.route('/details/<element>', methods=['GET', 'POST'])
-def details(element):
-    """Display detailed breakdown of a specific element."""
-    if request.method == 'POST' and request.is_json:
-        # Get data directly from the AJAX request
-        data = request.get_json()
-        if 'element_data' in data and 'element_name' in data:
-            # Render the details template with the provided data
-            # Also pass the full results data for the "Back to Results" functionality
-            rendered_html = render_template('details.html', 
-                                           element_data=data['element_data'], 
-                                           element_name=data['element_name'],
-                                           full_results=data.get('full_results', {}))
-            return jsonify({'success': True, 'html': rendered_html})
-        else:
-            return jsonify({'success': False, 'error': 'Invalid data format'}), 400
+    stored_results = result_store.get(result_id) if result_id else None
+    if stored_results is None:
+        return render_template('error.html', error='No calculation results found. Please upload files first.'), 404
+    
+    with g.timer.stage('render'):
+        return render_template('results.html', results=stored_results, result_id=result_id)
+
+
+def _detail_query():
+    """
+    Read the sorting and filtering query string of a details request.
+    
+    Returns:
+        Dictionary of DetailTable query arguments, without paging
+    """
+    return {
+        'sort_by': request.args.get('sort') or None,
+        'descending': request.args.get('order') == 'desc',
+        'symbol': request.args.get('symbol') or None,
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+    }
+
+
+def _query_detail_table(stored_results, element):
+    """
+    Run the paging, sorting and filtering query string of a details request.
+    
+    Returns:
+        Tuple of (page DataFrame, total_rows, query_dict)
+    """
+    page_size = request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)
+    query = {
+        'page': max(request.args.get('page', 1, type=int), 1),
+        'page_size': min(max(page_size, 1), MAX_PAGE_SIZE),
+        **_detail_query(),
+    }
+    page_frame, total_rows = stored_results[element].query_frame(**query)
+    return page_frame, total_rows, query
+
+
+def _encoded_response(frame, response_format, envelope):
+    """
+    Stream rows in a compact format, compressed when the client accepts it.
+    
+    Args:
+        frame: Rows to send
+        response_format: 'records', 'columns' or 'arrow'
+        envelope: Fields sent alongside the rows; for Arrow they become X- headers
+    
+    Returns:
+        Streaming Response
+    """
+    headers = {'Vary': 'Accept-Encoding'}
+    if response_format == 'arrow':
+        pieces, mimetype = iter_arrow(frame), ARROW_MIME_TYPE
+        for name, value in envelope.items():
+            headers['X-' + name.replace('_', '-').title()] = str(value)
     else:
-        # Direct access without data should show error
-        return render_template('error.html', error='Please calculate tax liability first and access details from the results page.')
+        pieces, mimetype = iter_json(frame, response_format, envelope), 'application/json'
+    
+    encoding = request.accept_encodings.best_match(content_encodings())
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return Response(compress(pieces, encoding), mimetype=mimetype, headers=headers)
+
+
+@app.route('/details/<element>')
+@app.route('/details/<result_id>/<element>')
+@instrumented
+def details(element, result_id=None):
+    """Display detailed breakdown of a specific element, one page at a time."""
+    stored_results = result_store.get(result_id) if result_id else None
+    if stored_results is None:
+        return render_template('error.html', error='Please calculate tax liability first and access details from the results page.'), 404
+    
+    if element not in DETAIL_ELEMENTS:
+        return render_template('error.html', error=f'Unknown detail type: {element}'), 404
+    
+    try:
+        with g.timer.stage('query'):
+            page_frame, total_rows, query = _query_detail_table(stored_results, element)
+            g.timer.count('query', len(page_frame))
+    except ValueError as e:
+        return render_template('error.html', error=str(e)), 400
+    
+    # Rows are formatted a batch at a time while the page streams out, after
+    # Server-Timing is sent, so the render stage reaches /metrics once the stream ends
+    endpoint, rows = request.endpoint, len(page_frame)
+    
+    def record_render(timer):
+        timer.count('render', rows)
+        stage_metrics.observe(endpoint, timer)
+    
+    page = stream_template('details.html',
+                           element_data=display_rows(page_frame),
+                           element_name=DETAIL_ELEMENTS[element],
+                           element=element,
+                           result_id=result_id,
+                           total_rows=total_rows,
+                           query=query,
+                           args=request.args.to_dict())
+    return timed_stream(page, 'render', record_render)
+
+
+@app.route('/api/details/<result_id>/<element>')
+@instrumented
+def details_data(result_id, element):
+    """
+    Return one page of a detail table for incremental loading.
+    
+    Rows are row objects by default; ``format=columns`` sends one array per
+    column and ``format=arrow`` an Arrow IPC stream instead.
+    """
+    stored_results = result_store.get(result_id)
+    if stored_results is None:
+        return jsonify({'success': False, 'error': 'Calculation results not found or expired'}), 404
+    
+    if element not in DETAIL_ELEMENTS:
+        return jsonify({'success': False, 'error': f'Unknown detail type: {element}'}), 404
+    
+    response_format = request.args.get('format', 'records')
+    if response_format not in response_formats():
+        return jsonify({'success': False, 'error': f'Unknown format: {response_format}'}), 400
+    
+    try:
+        with g.timer.stage('query'):
+            page_frame, total_rows, query = _query_detail_table(stored_results, element)
+            g.timer.count('query', len(page_frame))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if response_format != 'records':
+        return _encoded_response(page_frame, response_format, {
+            'success': True, 'element': element, 'total_rows': total_rows,
+            'page': query['page'], 'page_size': query['page_size'],
+        })
+    
+    with g.timer.stage('render'):
+        return jsonify({
+            'success': True,
+            'element': element,
+            'columns': stored_results[element].columns,
+            'rows': page_frame.to_dict('records'),
+            'total_rows': total_rows,
+            'page': query['page'],
+            'page_size': query['page_size'],
+        })
+
+
+@app.route('/api/export/<result_id>/<element>')
+@instrumented
+def export_details(result_id, element):
+    """Stream every matching row of a detail table in the requested format, unpaged."""
+    stored_results = result_store.get(result_id)
+    if stored_results is None:
+        return jsonify({'success': False, 'error': 'Calculation results not found or expired'}), 404
+    
+    if element not in DETAIL_ELEMENTS:
+        return jsonify({'success': False, 'error': f'Unknown detail type: {element}'}), 404
+    
+    response_format = request.args.get('format', 'records')
+    if response_format not in response_formats():
+        return jsonify({'success': False, 'error': f'Unknown format: {response_format}'}), 400
+    
+    try:
+        with g.timer.stage('query'):
+            frame = stored_results[element].select(**_detail_query())
+            g.timer.count('query', len(frame))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return _encoded_response(frame, response_format, {'success': True, 'element': element, 'total_rows': len(frame)})
+
+
+@app.route('/results/<result_id>/closing_lots')
+def closing_lots(result_id):
+    """Download the lot-level closing balance to upload as next year's opening balance."""
+    stored_results = result_store.get(result_id)
+    if stored_results is None or 'closing_lots' not in stored_results:
+        return jsonify({'success': False, 'error': 'Calculation results not found or expired'}), 404
+    
+    snapshot = io.BytesIO()
+    write_lot_snapshot(snapshot, pd.DataFrame(stored_results['closing_lots'], columns=LOT_COLUMNS))
+    snapshot.seek(0)
+    return send_file(snapshot, mimetype='application/octet-stream', as_attachment=True,
+                     download_name='closing_lots.npz')
+
+
+@app.route('/metrics')
+def metrics():
+    """Expose histograms of request stage timings in the Prometheus text format."""
+    return Response(stage_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache/status')
+def cache_status():
+    """Report hit and miss counters of the calculation and parsed workbook caches."""
+    stats = calculation_cache.stats() if calculation_cache is not None else None
+    return jsonify({'success': True, 'calculations': stats, 'workbooks': get_excel_cache().stats()})
+
+
+@app.route('/rates/status')
+def rates_status():
+    """Report load time, memory size and cache counters for the loaded rate tables, history periods and batch lookups."""
+    periods = rba_rates.periods.stats() if rba_rates.periods is not None else None
+    return jsonify({'success': True, 'tables': get_rate_store().stats(), 'history': periods,
+                    'lookups': rba_rates.lookup_stats()})
+
+
+@app.route('/rates/refresh', methods=['POST'])
+@instrumented
+def rates_refresh():
+    """Append rates published since the last loaded rate date from the configured source."""
+    # The refresh writes to the local rates file, so it is off unless the deployment opts in
+    if not app.config['RATE_REFRESH_ENABLED']:
+        return jsonify({'success': False, 'error': 'Rate refresh is disabled on this server'}), 403
+    
+    with g.timer.stage('rates'):
+        success, error_msg, rows_added = rba_rates.refresh_rates()
+        g.timer.count('rates', rows_added)
+    if not success:
+        return jsonify({'success': False, 'error': error_msg}), 502
+    
+    last_date = rba_rates.rate_table.dates[-1] if len(rba_rates.rate_table.dates) else None
+    return jsonify({'success': True, 'rows_added': rows_added,
+                    'last_rate_date': str(last_date) if last_date is not None else None})
 
 
 @app.route('/clear')
@@ -155,8 +562,5 @@ def clear_session():
 
 
 if __name__ == '__main__':
-    # Fetch RBA rates on startup
-    rba_rates.fetch_rates()
-    
     # Run the app
     app.run(host='0.0.0.0', port=5000, debug=True)
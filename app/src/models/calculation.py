@@ -1,11 +1,25 @@
 """
 Tax calculation logic for Australian foreign investments.
 """
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import Executor
 from typing import Dict, Any, Tuple, List, Optional
 
-from src.utils.rba_rates import RBAExchangeRates
+from src.utils.rba_rates import RBAExchangeRates, lookup_hit_ratio
+from src.utils.file_processor import iter_trade_transaction_chunks
+from src.utils.detail_sink import CsvDetailSink
+from src.utils.lot_snapshot import write_lot_snapshot, LOT_COLUMNS
+from src.utils.calculation_cache import CalculationCache, calculation_key
+from src.utils.stage_timer import StageTimer
+from src.models.lot_ledger import MatchLedger
+from src.models.fifo_engine import FifoEngine, DETAIL_COLUMNS
+from src.models.symbol_state import SymbolStateCache
+
+# Bump whenever a change alters calculation results, so cached results are not reused
+CALCULATION_VERSION = '1'
 
 
 class TaxCalculator:
@@ -13,8 +27,32 @@ class TaxCalculator:
     Class for calculating Australian tax liabilities on foreign share trading.
     """
     
-    def __init__(self):
-        self.rba_rates = RBAExchangeRates()
+    def __init__(self, rba_rates: Optional[RBAExchangeRates] = None, fifo_executor: Optional[Executor] = None,
+                 state_cache: Optional[SymbolStateCache] = None, result_cache: Optional[CalculationCache] = None,
+                 fifo_partitions: Optional[int] = None):
+        """
+        Initialize the tax calculator.
+        
+        Args:
+            rba_rates: Exchange rate provider to use (a new one backed by the shared rate store if omitted)
+            fifo_executor: Executor to match symbols on in parallel (matched serially if omitted)
+            state_cache: Per-symbol state from earlier calculations to recalculate incrementally
+                against (symbols that changed are replayed on fifo_executor)
+            result_cache: Cache of whole results to return for identical inputs and rates
+            fifo_partitions: Symbol partitions to split matching into on fifo_executor, normally
+                its worker count (the CPU count if omitted)
+        """
+        self.rba_rates = rba_rates if rba_rates is not None else RBAExchangeRates()
+        self.fifo_executor = fifo_executor
+        self.fifo_partitions = fifo_partitions
+        self.state_cache = state_cache
+        self.result_cache = result_cache
+        self.reuse = None
+        # Rows converted to AUD and the distinct (date, currency) pairs looked up for them
+        self.fx_lookups = {'rows': 0, 'unique_pairs': 0}
+        self.closing_lots = None
+        # Time spent loading rates ('rates'), converting to AUD ('fx') and matching ('fifo'); callers may add their own stages
+        self.timer = StageTimer()
         self.opening_balance = None
         self.transactions = None
         self.results = {}
@@ -41,6 +79,10 @@ class TaxCalculator:
         """
         Calculate tax liability based on opening balance and transactions.
         
+        Results served from the result cache share their detail lists and rows
+        with the cache entry, so callers must treat those as read-only; the
+        top-level dictionary is the caller's own.
+        
         Returns:
             Tuple of (success, error_message, results_dict)
         """
@@ -49,8 +91,9 @@ class TaxCalculator:
             return False, "Transaction data not provided", {}
         
         try:
-            # Fetch RBA exchange rates
-            success, error_msg = self.rba_rates.fetch_rates()
+            # Fetch RBA exchange rates (served from the shared rate store unless the file changed)
+            with self.timer.stage('rates'):
+                success, error_msg = self.rba_rates.fetch_rates()
             if not success:
                 return False, f"Failed to fetch exchange rates: {error_msg}", {}
             
@@ -58,208 +101,259 @@ class TaxCalculator:
             if self.opening_balance is None:
                 self.opening_balance = pd.DataFrame(columns=['Symbol', 'Quantity', 'Total Cost in AUD'])
             
-            # Process transactions and calculate tax
-            closing_balance, cost_of_shares_sold, sales_aud, sales_details, purchases_details = self._process_transactions()
+            # Identical inputs and rates give identical results
+            cache_key = None
+            if self.result_cache is not None:
+                cache_key = calculation_key(self.transactions, self.opening_balance, self.rba_rates.rates_version(),
+                                            CALCULATION_VERSION)
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    self.closing_lots = pd.DataFrame(cached['closing_lots'], columns=LOT_COLUMNS)
+                    # Reuse and lookup reports describe the run that filled the cache, not this one
+                    self.results = {key: value for key, value in cached.items() if key not in ('reuse', 'fx_lookups')}
+                    self.results.update(cache_hit=True, calculation_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    return True, "", self.results
             
-            # Calculate gross trading income
-            gross_trading_income = sales_aud - cost_of_shares_sold
+            # Load any historical rate periods the transactions need up front
+            if len(self.transactions):
+                with self.timer.stage('fx'):
+                    self.rba_rates.prefetch_rates(self.transactions['Date'].min(), self.transactions['Date'].max())
             
-            # Calculate opening stock value (total cost from opening balance)
-            opening_stock_value = self.opening_balance['Total Cost in AUD'].sum() if not self.opening_balance.empty else 0.0
-            
-            # Calculate closing stock value (total cost from closing balance)
-            closing_stock_value = closing_balance['Total Cost in AUD'].sum() if not closing_balance.empty else 0.0
-            
-            # Calculate purchases value (opening stock + purchases - closing stock = cost of goods sold)
-            purchases_value = cost_of_shares_sold + closing_stock_value - opening_stock_value
+            # Process transactions and calculate tax; conversion inside is timed as its own stage
+            with self.timer.stage('fifo'):
+                closing_balance, cost_of_shares_sold, sales_aud, sales_details, purchases_details, sale_matches = self._process_transactions()
+            self.timer.count('fifo', len(self.transactions))
             
             # Prepare results
-            self.results = {
-                'opening_balance': self.opening_balance.to_dict('records'),
-                'closing_balance': closing_balance.to_dict('records'),
-                'cost_of_shares_sold': cost_of_shares_sold,
-                'sales_aud': sales_aud,
-                'gross_trading_income': gross_trading_income,
+            self.results = self._summarise(closing_balance, cost_of_shares_sold, sales_aud)
+            self.results.update({
                 'sales_details': sales_details,
                 'purchases_details': purchases_details,
-                'opening_stock_value': opening_stock_value,
-                'closing_stock_value': closing_stock_value,
-                'purchases_value': purchases_value,
-                'calculation_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+                'sale_matches': sale_matches.to_dict(),
+                'closing_lots': self.closing_lots.to_dict('records'),
+                'fx_lookups': self._fx_lookup_summary(),
+            })
+            if self.reuse is not None:
+                self.results['reuse'] = self.reuse
+            if cache_key is not None:
+                self.results['cache_hit'] = False
+                self.result_cache.put(cache_key, dict(self.results))
             
             return True, "", self.results
-            
+        
         except Exception as e:
             return False, f"Error calculating tax: {str(e)}", {}
     
-    def _process_transactions(self) -> Tuple[pd.DataFrame, float, float, List[Dict[str, Any]], List[Dict[str, Any]]]:
+    def calculate_tax_streaming(self, transactions_file: Any, output_dir: str, chunk_size: int = 100000,
+                                filename: Optional[str] = None) -> Tuple[bool, str, Dict[str, Any]]:
         """
-        Process all transactions and calculate closing balance, cost of shares sold, and sales in AUD.
+        Calculate tax liability from a date-sorted transactions CSV without loading it whole.
+        
+        The file is read in chunks and fed through the FIFO engine, so memory is
+        bounded by the open lots rather than the number of transactions. Sales,
+        purchases and sale match rows are written to CSV files in output_dir
+        instead of being returned as lists. The headline figures are identical
+        to calculate_tax on the same file.
+        
+        Args:
+            transactions_file: Path to the CSV file, an open binary file-like object, or its bytes
+            output_dir: Directory for the sales, purchases and sale match CSV files
+            chunk_size: Number of transaction rows read per chunk
+            filename: Original file name, used to detect the format when transactions_file is not a path
         
         Returns:
-            Tuple of (closing_balance_df, cost_of_shares_sold, sales_aud, sales_details, purchases_details)
+            Tuple of (success, error_message, results_dict). The results hold
+            'sales_details_path', 'purchases_details_path' and 'sale_matches_path'
+            in place of the detail lists.
         """
-        # Initialize portfolio with opening balance
-        portfolio = {}
-        for _, row in self.opening_balance.iterrows():
-            symbol = row['Symbol']
-            quantity = row['Quantity']
-            cost = row['Total Cost in AUD']
+        try:
+            # Fetch RBA exchange rates (served from the shared rate store unless the file changed)
+            with self.timer.stage('rates'):
+                success, error_msg = self.rba_rates.fetch_rates()
+            if not success:
+                return False, f"Failed to fetch exchange rates: {error_msg}", {}
+            
+            # If no opening balance, create an empty DataFrame
+            if self.opening_balance is None:
+                self.opening_balance = pd.DataFrame(columns=['Symbol', 'Quantity', 'Total Cost in AUD'])
+            
+            os.makedirs(output_dir, exist_ok=True)
+            paths = {
+                'sales_details_path': os.path.join(output_dir, 'sales_details.csv'),
+                'purchases_details_path': os.path.join(output_dir, 'purchases_details.csv'),
+                'sale_matches_path': os.path.join(output_dir, 'sale_matches.csv'),
+            }
             
-            if symbol not in portfolio:
-                portfolio[symbol] = []
+            with CsvDetailSink(paths['sales_details_path'], DETAIL_COLUMNS) as sales_sink, \
+                    CsvDetailSink(paths['purchases_details_path'], DETAIL_COLUMNS) as purchases_sink, \
+                    CsvDetailSink(paths['sale_matches_path'], MatchLedger.COLUMNS) as matches_sink:
+                engine = FifoEngine(sales_sink, purchases_sink)
+                engine.load_opening_balance(self.opening_balance)
+                
+                chunks = iter_trade_transaction_chunks(transactions_file, chunk_size, filename)
+                while True:
+                    with self.timer.stage('parse'):
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    self.timer.count('parse', len(chunk))
+                    
+                    # The file is date-sorted, so each chunk needs at most the next history period
+                    with self.timer.stage('fx'):
+                        self.rba_rates.prefetch_rates(chunk['Date'].iloc[0], chunk['Date'].iloc[-1])
+                    converted = self._convert_to_aud(chunk)
+                    
+                    with self.timer.stage('fifo'):
+                        engine.process(converted)
+                        self.timer.count('fifo', len(converted))
+                        
+                        # Move this chunk's matches to disk
+                        matches_sink.write_columns(engine.matches.to_dict())
+                        engine.matches.clear()
             
-            # Add opening balance as a single lot
-            portfolio[symbol].append({
-                'quantity': quantity,
-                'cost_per_share': cost / quantity if quantity > 0 else 0,
-                'total_cost': cost
+            self.closing_lots = engine.closing_lots()
+            self.results = self._summarise(engine.closing_balance(), engine.cost_of_shares_sold, engine.sales_aud)
+            self.results.update(paths)
+            self.results.update({
+                'sales_count': engine.sale_count,
+                'purchases_count': engine.purchase_count,
+                'closing_lots': self.closing_lots.to_dict('records'),
+                'fx_lookups': self._fx_lookup_summary(),
             })
+            
+            return True, "", self.results
+        
+        except Exception as e:
+            return False, f"Error calculating tax: {str(e)}", {}
+    
+    def save_closing_lots(self, target: Any) -> None:
+        """
+        Save the lot-level closing balance of the last calculation for rolling over.
         
-        # Track cost of shares sold and sales in AUD
-        cost_of_shares_sold = 0.0
-        sales_aud = 0.0
-        sales_details = []
-        purchases_details = []
+        The saved file can be uploaded or passed to process_opening_balance as the
+        next year's opening balance, keeping every lot's FIFO position and cost.
         
-        # Process transactions in chronological order
-        sorted_transactions = self.transactions.sort_values('Date')
+        Args:
+            target: File path or binary file-like object to write the lot snapshot to
         
-        for _, row in sorted_transactions.iterrows():
-            symbol = row['Symbol']
-            quantity = row['Quantity']
-            date = row['Date']
-            
-            # Ensure symbol exists in portfolio
-            if symbol not in portfolio:
-                portfolio[symbol] = []
+        Raises:
+            ValueError: If nothing has been calculated yet
+        """
+        if self.closing_lots is None:
+            raise ValueError("No calculation has been run")
+        write_lot_snapshot(target, self.closing_lots)
+    
+    def _summarise(self, closing_balance: pd.DataFrame, cost_of_shares_sold: float,
+                   sales_aud: float) -> Dict[str, Any]:
+        """
+        Calculate the headline figures of the Gross Trading Income statement.
+        
+        Args:
+            closing_balance: Closing balance per symbol
+            cost_of_shares_sold: Total cost in AUD of the shares sold
+            sales_aud: Total sales in AUD
+        
+        Returns:
+            Results dictionary without the detail lists
+        """
+        # Calculate gross trading income
+        gross_trading_income = sales_aud - cost_of_shares_sold
+        
+        # Calculate opening stock value (total cost from opening balance)
+        opening_stock_value = self.opening_balance['Total Cost in AUD'].sum() if not self.opening_balance.empty else 0.0
+        
+        # Calculate closing stock value (total cost from closing balance)
+        closing_stock_value = closing_balance['Total Cost in AUD'].sum() if not closing_balance.empty else 0.0
+        
+        # Calculate purchases value (opening stock + purchases - closing stock = cost of goods sold)
+        purchases_value = cost_of_shares_sold + closing_stock_value - opening_stock_value
+        
+        # Prepare results
+        return {
+            'opening_balance': self.opening_balance.to_dict('records'),
+            'closing_balance': closing_balance.to_dict('records'),
+            'cost_of_shares_sold': cost_of_shares_sold,
+            'sales_aud': sales_aud,
+            'gross_trading_income': gross_trading_income,
+            'opening_stock_value': opening_stock_value,
+            'closing_stock_value': closing_stock_value,
+            'purchases_value': purchases_value,
+            'calculation_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    def _process_transactions(self) -> Tuple[pd.DataFrame, float, float, List[Dict[str, Any]], List[Dict[str, Any]], MatchLedger]:
+        """
+        Process all transactions and calculate closing balance, cost of shares sold, and sales in AUD.
+        
+        Returns:
+            Tuple of (closing_balance_df, cost_of_shares_sold, sales_aud, sales_details, purchases_details, sale_matches)
+        """
+        # Initialize portfolio with opening balance
+        engine = FifoEngine()
+        engine.load_opening_balance(self.opening_balance)
+        
+        # Process transactions in chronological order (stable, so same-day trades keep file order)
+        sorted_transactions = self.transactions.sort_values('Date', kind='stable')
+        
+        # Only replay the symbols that changed since they were last calculated
+        if self.state_cache is not None:
+            self.reuse = self.state_cache.process(engine, sorted_transactions, self._convert_to_aud,
+                                                  self.rba_rates.rates_version(), self.fifo_executor,
+                                                  self.fifo_partitions)
+            self.closing_lots = engine.closing_lots()
+            return (engine.closing_balance(), engine.cost_of_shares_sold, engine.sales_aud,
+                    engine.sales_details, engine.purchases_details, engine.matches)
+        
+        # Convert every transaction to AUD up front
+        sorted_transactions = self._convert_to_aud(sorted_transactions)
+        
+        # Symbols are matched independently, so they can be spread across the executor
+        if self.fifo_executor is not None:
+            engine.process_partitioned(sorted_transactions, self.fifo_executor, self.fifo_partitions)
+        else:
+            engine.process(sorted_transactions)
+        
+        self.closing_lots = engine.closing_lots()
+        return (engine.closing_balance(), engine.cost_of_shares_sold, engine.sales_aud,
+                engine.sales_details, engine.purchases_details, engine.matches)
+    
+    def _convert_to_aud(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Attach 'Exchange Rate' and 'Value in AUD' columns to a transactions frame.
+        
+        Rows whose currency has no valid RBA rate are kept at their original value
+        with an exchange rate of 1.0.
+        
+        Args:
+            transactions: DataFrame of transactions with Date, Currency and Net Value columns
+        
+        Returns:
+            Copy of the DataFrame with the conversion columns added
+        """
+        with self.timer.stage('fx'):
+            self.timer.count('fx', len(transactions))
+            transactions = transactions.copy()
             
-            # Handle purchases
-            if quantity > 0:
-                # Convert purchase value to AUD
-                if row['Currency'] != 'AUD':
-                    success, _, rate = self.rba_rates.get_rate(date, row['Currency'])
-                    if success:
-                        # FIXED: Corrected currency conversion direction
-                        purchase_value_aud = row['Net Value'] / rate
-                        exchange_rate = rate
-                    else:
-                        purchase_value_aud = row['Net Value']
-                        exchange_rate = 1.0
-                else:
-                    purchase_value_aud = row['Net Value']
-                    exchange_rate = 1.0
-                
-                # Add new lot to portfolio
-                portfolio[symbol].append({
-                    'quantity': quantity,
-                    'cost_per_share': purchase_value_aud / quantity,
-                    'total_cost': purchase_value_aud
-                })
-                
-                # Add to purchases details
-                purchases_details.append({
-                    'Date': date.strftime('%Y-%m-%d'),
-                    'Symbol': symbol,
-                    'Quantity': quantity,
-                    'Unit Price': row['Unit Price'],
-                    'Gross Value': row['Total Gross Value'],
-                    'Commission': abs(row['Commission']),
-                    'Net Value': row['Net Value'],
-                    'Currency': row['Currency'],
-                    'Exchange Rate': exchange_rate,
-                    'Value in AUD': purchase_value_aud
-                })
+            success, error_msg, rates = self.rba_rates.get_rates_batch(transactions['Date'], transactions['Currency'],
+                                                                        self.fx_lookups)
+            if not success:
+                raise ValueError(error_msg)
             
-            # Handle sales
-            elif quantity < 0:
-                quantity_to_sell = abs(quantity)
-                sale_value_aud = 0.0
-                
-                # Convert sale value to AUD for reporting
-                if row['Currency'] != 'AUD':
-                    success, _, rate = self.rba_rates.get_rate(date, row['Currency'])
-                    if success:
-                        # FIXED: Corrected currency conversion direction
-                        sale_value_aud = abs(row['Net Value']) / rate
-                        exchange_rate = rate
-                    else:
-                        sale_value_aud = abs(row['Net Value'])
-                        exchange_rate = 1.0
-                else:
-                    sale_value_aud = abs(row['Net Value'])
-                    exchange_rate = 1.0
-                
-                # Add to total sales
-                sales_aud += sale_value_aud
-                
-                # Add to sales details
-                sales_details.append({
-                    'Date': date.strftime('%Y-%m-%d'),
-                    'Symbol': symbol,
-                    'Quantity': abs(quantity),
-                    'Unit Price': row['Unit Price'],
-                    'Gross Value': abs(row['Total Gross Value']),
-                    'Commission': abs(row['Commission']),
-                    'Net Value': abs(row['Net Value']),
-                    'Currency': row['Currency'],
-                    'Exchange Rate': exchange_rate,
-                    'Value in AUD': sale_value_aud
-                })
-                
-                # FIFO: Sell from oldest lots first
-                lots_cost = 0.0
-                remaining_to_sell = quantity_to_sell
-                
-                # Create a copy of the lots to avoid modifying during iteration
-                lots = portfolio[symbol].copy()
-                portfolio[symbol] = []
-                
-                for lot in lots:
-                    if remaining_to_sell <= 0:
-                        # No more shares to sell, keep the rest of the lot
-                        portfolio[symbol].append(lot)
-                    elif lot['quantity'] <= remaining_to_sell:
-                        # Sell entire lot
-                        lots_cost += lot['total_cost']
-                        remaining_to_sell -= lot['quantity']
-                    else:
-                        # Sell part of the lot
-                        sold_cost = lot['cost_per_share'] * remaining_to_sell
-                        lots_cost += sold_cost
-                        
-                        # Keep the remaining shares in the lot
-                        new_quantity = lot['quantity'] - remaining_to_sell
-                        new_total_cost = lot['total_cost'] - sold_cost
-                        
-                        portfolio[symbol].append({
-                            'quantity': new_quantity,
-                            'cost_per_share': new_total_cost / new_quantity,
-                            'total_cost': new_total_cost
-                        })
-                        
-                        remaining_to_sell = 0
-                
-                # Add to cost of shares sold
-                cost_of_shares_sold += lots_cost
-        
-        # Create closing balance DataFrame
-        closing_balance_data = []
-        for symbol, lots in portfolio.items():
-            total_quantity = sum(lot['quantity'] for lot in lots)
-            total_cost = sum(lot['total_cost'] for lot in lots)
+            # FIXED: Corrected currency conversion direction
+            rates = np.where(np.isnan(rates), 1.0, rates)
+            transactions['Exchange Rate'] = rates
+            transactions['Value in AUD'] = transactions['Net Value'].to_numpy(dtype='float64') / rates
             
-            if total_quantity > 0:
-                closing_balance_data.append({
-                    'Symbol': symbol,
-                    'Quantity': total_quantity,
-                    'Total Cost in AUD': total_cost
-                })
-        
-        closing_balance = pd.DataFrame(closing_balance_data)
+            return transactions
+    
+    def _fx_lookup_summary(self) -> Dict[str, Any]:
+        """
+        Summarise the rate lookups of this calculation.
         
-        return closing_balance, cost_of_shares_sold, sales_aud, sales_details, purchases_details
+        Returns:
+            Dictionary of rows, unique_pairs and hit_ratio
+        """
+        return dict(self.fx_lookups, hit_ratio=lookup_hit_ratio(self.fx_lookups))
     
     def get_results(self) -> Dict[str, Any]:
         """
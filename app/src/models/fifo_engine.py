@@ -0,0 +1,375 @@
+"""
+Incremental FIFO matching engine for share trades.
+"""
+import os
+import numpy as np
+import pandas as pd
+from functools import partial
+from concurrent.futures import Executor
+from typing import Dict, Any, Optional, List, Sequence, Tuple
+
+from src.models.lot_ledger import LotLedger, MatchLedger
+from src.utils.lot_snapshot import LOT_COLUMNS
+
+# Transaction columns the engine reads, in unpacking order
+ENGINE_COLUMNS = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Total Gross Value', 'Commission',
+                  'Net Value', 'Currency', 'Exchange Rate', 'Value in AUD']
+
+# Columns of the sales and purchases detail rows
+DETAIL_COLUMNS = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Gross Value', 'Commission',
+                  'Net Value', 'Currency', 'Exchange Rate', 'Value in AUD']
+
+
+class FifoEngine:
+    """
+    FIFO matching state that transactions can be fed into chunk by chunk.
+    
+    The engine holds the open lots per symbol and the running totals. Detail rows
+    are appended to ``sales_details`` and ``purchases_details``, which are plain
+    lists by default but can be any sink with ``append`` (for example a
+    CsvDetailSink), so memory can be bounded by the open lots alone.
+    """
+    
+    def __init__(self, sales_details: Optional[Any] = None, purchases_details: Optional[Any] = None):
+        """
+        Initialize an empty engine.
+        
+        Args:
+            sales_details: Sink for sale detail rows (defaults to a list)
+            purchases_details: Sink for purchase detail rows (defaults to a list)
+        """
+        self.portfolio: Dict[str, LotLedger] = {}
+        self.cost_of_shares_sold = 0.0
+        self.sales_aud = 0.0
+        self.sales_details = sales_details if sales_details is not None else []
+        self.purchases_details = purchases_details if purchases_details is not None else []
+        self.matches = MatchLedger()
+        self.sale_count = 0
+        self.purchase_count = 0
+    
+    def load_opening_balance(self, opening_balance: pd.DataFrame) -> None:
+        """
+        Add the opening balance rows as the first lots of each symbol.
+        
+        Args:
+            opening_balance: DataFrame with Symbol, Quantity and Total Cost in AUD columns, and
+                optionally an Acquired date per row when it is a lot-level closing balance
+        """
+        portfolio = self.portfolio
+        
+        # A lot-level opening balance carries the acquisition date of each lot
+        if 'Acquired' in opening_balance.columns:
+            acquired = [None if date is pd.NaT else date for date in pd.to_datetime(opening_balance['Acquired']).tolist()]
+        else:
+            acquired = [None] * len(opening_balance)
+        
+        for lot_id, (symbol, quantity, cost, acquired_date) in enumerate(zip(opening_balance['Symbol'].tolist(),
+                                                                             opening_balance['Quantity'].tolist(),
+                                                                             opening_balance['Total Cost in AUD'].tolist(),
+                                                                             acquired)):
+            if symbol not in portfolio:
+                portfolio[symbol] = LotLedger()
+            
+            # Add each opening balance row as a single lot
+            portfolio[symbol].add_lot(quantity, cost / quantity if quantity > 0 else 0, cost,
+                                      'Opening Balance', lot_id, acquired_date)
+    
+    def process(self, transactions: pd.DataFrame, sale_ids: Optional[Sequence[int]] = None,
+                purchase_ids: Optional[Sequence[int]] = None) -> None:
+        """
+        Apply chronologically ordered, AUD-converted transactions.
+        
+        Args:
+            transactions: DataFrame with ENGINE_COLUMNS, already in date order
+            sale_ids: Sale ID of each row, used by sale rows (numbered on from sale_count if omitted)
+            purchase_ids: Lot ID of each row, used by purchase rows (numbered on from purchase_count if omitted)
+        """
+        portfolio = self.portfolio
+        sales_details = self.sales_details
+        purchases_details = self.purchases_details
+        matches = self.matches
+        
+        quantities = transactions['Quantity'].to_numpy(dtype='float64', na_value=np.nan)
+        is_sale = quantities < 0
+        is_purchase = quantities > 0
+        if sale_ids is None:
+            sale_ids = _running_ids(is_sale, self.sale_count)
+        if purchase_ids is None:
+            purchase_ids = _running_ids(is_purchase, self.purchase_count)
+        self.sale_count += int(is_sale.sum())
+        self.purchase_count += int(is_purchase.sum())
+        
+        # Walk plain column lists rather than building a Series per row
+        rows = zip(*(transactions[col].tolist() for col in ENGINE_COLUMNS), sale_ids, purchase_ids)
+        
+        for date, symbol, quantity, unit_price, gross_value, commission, net_value, currency, exchange_rate, value_aud, sale_id, purchase_id in rows:
+            # Ensure symbol exists in portfolio
+            if symbol not in portfolio:
+                portfolio[symbol] = LotLedger()
+            
+            # Handle purchases
+            if quantity > 0:
+                purchase_value_aud = value_aud
+                
+                # Add new lot to portfolio
+                portfolio[symbol].add_lot(quantity, purchase_value_aud / quantity, purchase_value_aud,
+                                          'Purchase', purchase_id, date)
+                
+                # Add to purchases details
+                purchases_details.append({
+                    'Date': date.strftime('%Y-%m-%d'),
+                    'Symbol': symbol,
+                    'Quantity': quantity,
+                    'Unit Price': unit_price,
+                    'Gross Value': gross_value,
+                    'Commission': abs(commission),
+                    'Net Value': net_value,
+                    'Currency': currency,
+                    'Exchange Rate': exchange_rate,
+                    'Value in AUD': purchase_value_aud
+                })
+            
+            # Handle sales
+            elif quantity < 0:
+                quantity_to_sell = abs(quantity)
+                sale_value_aud = abs(value_aud)
+                
+                # Add to total sales
+                self.sales_aud += sale_value_aud
+                
+                # Add to sales details
+                sales_details.append({
+                    'Date': date.strftime('%Y-%m-%d'),
+                    'Symbol': symbol,
+                    'Quantity': abs(quantity),
+                    'Unit Price': unit_price,
+                    'Gross Value': abs(gross_value),
+                    'Commission': abs(commission),
+                    'Net Value': abs(net_value),
+                    'Currency': currency,
+                    'Exchange Rate': exchange_rate,
+                    'Value in AUD': sale_value_aud
+                })
+                
+                # FIFO: Sell from oldest lots first, recording each lot consumed
+                record_match = partial(matches.add, sale_id, symbol, date,
+                                       quantity_to_sell, sale_value_aud)
+                
+                # Add to cost of shares sold
+                ledger = portfolio[symbol]
+                first_match = len(matches)
+                self.cost_of_shares_sold += ledger.sell(quantity_to_sell, record_match)
+                
+                # An oversell empties the ledger; the shares left over are recorded without a lot
+                if not ledger.lots:
+                    unmatched = quantity_to_sell - sum(matches.columns['Quantity'][first_match:])
+                    if unmatched > 0:
+                        matches.add_unmatched(sale_id, symbol, date, quantity_to_sell, sale_value_aud, unmatched)
+    
+    def number_rows(self, transactions: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Assign the Sale IDs and Lot IDs that process would give transactions.
+        
+        The sale and purchase counters are advanced past the rows, as if they
+        had been processed.
+        
+        Args:
+            transactions: DataFrame with a Quantity column, already in date order
+        
+        Returns:
+            Tuple of (sale mask, purchase mask, Sale ID per row, Lot ID per row)
+        """
+        quantities = transactions['Quantity'].to_numpy(dtype='float64', na_value=np.nan)
+        is_sale = quantities < 0
+        is_purchase = quantities > 0
+        sale_ids = np.asarray(_running_ids(is_sale, self.sale_count), dtype='int64')
+        purchase_ids = np.asarray(_running_ids(is_purchase, self.purchase_count), dtype='int64')
+        self.sale_count += int(is_sale.sum())
+        self.purchase_count += int(is_purchase.sum())
+        return is_sale, is_purchase, sale_ids, purchase_ids
+    
+    def process_partitioned(self, transactions: pd.DataFrame, executor: Optional[Executor] = None,
+                            partitions: Optional[int] = None) -> None:
+        """
+        Apply transactions like process, matching groups of symbols independently.
+        
+        FIFO matching never crosses symbols, so the rows are split into
+        partitions of whole symbols balanced by row count and each partition is
+        matched by its own engine, optionally on an executor. The partial
+        results are then merged back in the order process would have produced
+        them: detail rows by sale and lot number, matches by sale, and the
+        totals summed in the same order, so the output is identical to process.
+        
+        Args:
+            transactions: DataFrame with ENGINE_COLUMNS, already in date order
+            executor: Executor to run the partitions on (run one after another if omitted)
+            partitions: Number of partitions, normally the executor's worker count (defaults to the CPU count)
+        """
+        if partitions is None:
+            partitions = os.cpu_count() or 1
+        
+        is_sale, is_purchase, sale_ids, purchase_ids = self.number_rows(transactions)
+        
+        codes, symbols = pd.factorize(transactions['Symbol'], use_na_sentinel=False)
+        symbols = list(symbols)
+        
+        partition_of = assign_partitions(np.bincount(codes, minlength=len(symbols)), partitions)
+        
+        # Symbols enter the portfolio in order of first appearance, as in process
+        for symbol in symbols:
+            if symbol not in self.portfolio:
+                self.portfolio[symbol] = LotLedger()
+        
+        engine_columns = transactions[ENGINE_COLUMNS]
+        row_partition = partition_of[codes]
+        tasks = []
+        numbering = []
+        for index in range(max(1, min(partitions, len(symbols)))):
+            rows = np.flatnonzero(row_partition == index)
+            ledgers = {symbols[code]: self.portfolio[symbols[code]] for code in np.flatnonzero(partition_of == index)}
+            tasks.append((ledgers, engine_columns.iloc[rows], sale_ids[rows].tolist(), purchase_ids[rows].tolist()))
+            numbering.append((sale_ids[rows][is_sale[rows]].tolist(), purchase_ids[rows][is_purchase[rows]].tolist()))
+        
+        mapper = executor.map if executor is not None else map
+        results = list(mapper(_match_partition, *zip(*tasks)))
+        self.merge_partitions(numbering, results)
+    
+    def merge_partitions(self, numbering: List[tuple], results: List['FifoEngine']) -> None:
+        """
+        Merge engines that matched disjoint sets of symbols back into this one in serial order.
+        
+        Every symbol of the partitions must already be in this engine's
+        portfolio, so the portfolio keeps the order process would give it.
+        
+        Args:
+            numbering: Per partition, the (sale IDs, lot IDs) of its sale and purchase rows
+            results: Per partition, the engine that matched it
+        """
+        sales = []
+        purchases = []
+        match_columns = {col: [] for col in MatchLedger.COLUMNS}
+        for (part_sale_ids, part_purchase_ids), result in zip(numbering, results):
+            self.portfolio.update(result.portfolio)
+            sales.extend(zip(part_sale_ids, result.sales_details))
+            purchases.extend(zip(part_purchase_ids, result.purchases_details))
+            for col, values in result.matches.to_dict().items():
+                match_columns[col].extend(values)
+        
+        sales.sort(key=lambda item: item[0])
+        purchases.sort(key=lambda item: item[0])
+        for _, record in sales:
+            self.sales_aud += record['Value in AUD']
+            self.sales_details.append(record)
+        for _, record in purchases:
+            self.purchases_details.append(record)
+        
+        # Each sale's lots are contiguous within its partition, so a stable sort
+        # by sale restores the serial order of the match rows
+        order = np.argsort(np.asarray(match_columns['Sale ID'], dtype='int64'), kind='stable').tolist()
+        ordered = {col: [values[i] for i in order] for col, values in match_columns.items()}
+        for col, values in self.matches.to_dict().items():
+            values.extend(ordered[col])
+        
+        # Re-add the cost of each sale, summed lot by lot, in sale order
+        current_sale = None
+        lots_cost = 0.0
+        for sale_id, cost in zip(ordered['Sale ID'], ordered['Cost in AUD']):
+            if sale_id != current_sale:
+                if current_sale is not None:
+                    self.cost_of_shares_sold += lots_cost
+                current_sale = sale_id
+                lots_cost = 0.0
+            lots_cost += cost
+        if current_sale is not None:
+            self.cost_of_shares_sold += lots_cost
+    
+    def closing_balance(self) -> pd.DataFrame:
+        """
+        Aggregate the open lots into a closing balance per symbol.
+        
+        Returns:
+            DataFrame with Symbol, Quantity and Total Cost in AUD columns
+        """
+        closing_balance_data = []
+        for symbol, ledger in self.portfolio.items():
+            total_quantity = ledger.total_quantity()
+            total_cost = ledger.total_cost()
+            
+            if total_quantity > 0:
+                closing_balance_data.append({
+                    'Symbol': symbol,
+                    'Quantity': total_quantity,
+                    'Total Cost in AUD': total_cost
+                })
+        
+        return pd.DataFrame(closing_balance_data)
+    
+    def closing_lots(self) -> pd.DataFrame:
+        """
+        List the open lots, which can be loaded as the next period's opening balance.
+        
+        Returns:
+            DataFrame with Symbol, Quantity, Total Cost in AUD and Acquired columns,
+            one row per lot in FIFO order
+        """
+        return pd.DataFrame([(symbol, lot.quantity, lot.total_cost,
+                              lot.acquired.strftime('%Y-%m-%d') if lot.acquired is not None else None)
+                             for symbol, ledger in self.portfolio.items() for lot in ledger],
+                            columns=LOT_COLUMNS)
+
+
+def _running_ids(mask: np.ndarray, start: int) -> List[int]:
+    """
+    Number the rows selected by mask consecutively from start.
+    
+    Args:
+        mask: Boolean array selecting the rows to number
+        start: Number of the first selected row
+    
+    Returns:
+        Per row, the number of the row if selected, otherwise of the next selected row
+    """
+    counts = np.cumsum(mask, dtype='int64')
+    return (start + counts - mask).tolist()
+
+
+def assign_partitions(counts: np.ndarray, partitions: int) -> np.ndarray:
+    """
+    Spread groups of rows over partitions balanced by row count.
+    
+    Groups are assigned largest first, each to the least loaded partition.
+    
+    Args:
+        counts: Number of rows in each group
+        partitions: Number of partitions
+    
+    Returns:
+        Partition index of each group, below min(partitions, number of groups)
+    """
+    partition_of = np.zeros(len(counts), dtype='int64')
+    loads = [0] * max(1, min(partitions, len(counts)))
+    for group in np.argsort(-np.asarray(counts), kind='stable'):
+        target = loads.index(min(loads))
+        partition_of[group] = target
+        loads[target] += counts[group]
+    return partition_of
+
+
+def _match_partition(ledgers: Dict[str, LotLedger], transactions: pd.DataFrame, sale_ids: List[int],
+                     purchase_ids: List[int]) -> FifoEngine:
+    """
+    Match one partition of process_partitioned in a fresh engine.
+    
+    Args:
+        ledgers: Open lots of the partition's symbols
+        transactions: The partition's rows, in date order
+        sale_ids: Sale ID of each row
+        purchase_ids: Lot ID of each row
+    
+    Returns:
+        Engine holding the partition's lots, detail rows and matches
+    """
+    engine = FifoEngine()
+    engine.portfolio.update(ledgers)
+    engine.process(transactions, sale_ids, purchase_ids)
+    return engine
@@ -0,0 +1,225 @@
+"""
+FIFO lot ledger for tracking the share parcels held in a single symbol.
+"""
+from collections import deque
+from datetime import datetime
+from typing import Iterator, Optional, Callable, Dict, List, Any
+
+# Lot source of match rows for shares sold beyond the holding
+UNMATCHED_SOURCE = 'Unmatched'
+
+
+class Lot:
+    """
+    A parcel of shares acquired at a single cost.
+    """
+    
+    __slots__ = ('quantity', 'cost_per_share', 'total_cost', 'source', 'lot_id', 'acquired')
+    
+    def __init__(self, quantity: float, cost_per_share: float, total_cost: float,
+                 source: Optional[str] = None, lot_id: Optional[int] = None,
+                 acquired: Optional[datetime] = None):
+        """
+        Initialize a lot.
+        
+        Args:
+            quantity: Number of shares in the lot
+            cost_per_share: Cost of each share in AUD
+            total_cost: Total cost of the lot in AUD
+            source: Where the lot came from ('Opening Balance' or 'Purchase')
+            lot_id: Row index of the lot in its source list
+            acquired: Acquisition date, if known
+        """
+        self.quantity = quantity
+        self.cost_per_share = cost_per_share
+        self.total_cost = total_cost
+        self.source = source
+        self.lot_id = lot_id
+        self.acquired = acquired
+
+
+class LotLedger:
+    """
+    Ordered lots for one symbol, consumed oldest first.
+    
+    Lots are kept in a deque so fully sold lots are popped from the head in O(1)
+    and a partial sale only rewrites the head lot in place. A sale therefore
+    touches only the lots it consumes, not every lot still held.
+    """
+    
+    def __init__(self):
+        """
+        Initialize an empty ledger.
+        """
+        self.lots = deque()
+    
+    def add_lot(self, quantity: float, cost_per_share: float, total_cost: float,
+                source: Optional[str] = None, lot_id: Optional[int] = None,
+                acquired: Optional[datetime] = None) -> None:
+        """
+        Add a newly acquired lot at the tail of the ledger.
+        
+        Args:
+            quantity: Number of shares in the lot
+            cost_per_share: Cost of each share in AUD
+            total_cost: Total cost of the lot in AUD
+            source: Where the lot came from ('Opening Balance' or 'Purchase')
+            lot_id: Row index of the lot in its source list
+            acquired: Acquisition date, if known
+        """
+        self.lots.append(Lot(quantity, cost_per_share, total_cost, source, lot_id, acquired))
+    
+    def sell(self, quantity: float, on_match: Optional[Callable[[Lot, float, float], None]] = None) -> float:
+        """
+        Sell shares FIFO from the oldest lots.
+        
+        Selling more than is held consumes every lot and ignores the excess.
+        
+        Args:
+            quantity: Number of shares to sell
+            on_match: Optional callback invoked as on_match(lot, quantity, cost) for
+                each lot the sale draws from, before the lot is updated
+        
+        Returns:
+            Cost in AUD of the shares sold
+        """
+        lots = self.lots
+        lots_cost = 0.0
+        remaining_to_sell = quantity
+        
+        while remaining_to_sell > 0 and lots:
+            lot = lots[0]
+            if lot.quantity <= remaining_to_sell:
+                # Sell entire lot
+                if on_match is not None:
+                    on_match(lot, lot.quantity, lot.total_cost)
+                lots_cost += lot.total_cost
+                remaining_to_sell -= lot.quantity
+                lots.popleft()
+            else:
+                # Sell part of the lot and keep the remaining shares at the head
+                sold_cost = lot.cost_per_share * remaining_to_sell
+                if on_match is not None:
+                    on_match(lot, remaining_to_sell, sold_cost)
+                lots_cost += sold_cost
+                
+                lot.quantity = lot.quantity - remaining_to_sell
+                lot.total_cost = lot.total_cost - sold_cost
+                lot.cost_per_share = lot.total_cost / lot.quantity
+                
+                remaining_to_sell = 0
+        
+        return lots_cost
+    
+    def total_quantity(self) -> float:
+        """
+        Get the number of shares still held.
+        
+        Returns:
+            Sum of the quantities of all lots
+        """
+        return sum(lot.quantity for lot in self.lots)
+    
+    def total_cost(self) -> float:
+        """
+        Get the cost of the shares still held.
+        
+        Returns:
+            Sum of the total cost of all lots in AUD
+        """
+        return sum(lot.total_cost for lot in self.lots)
+    
+    def __len__(self) -> int:
+        return len(self.lots)
+    
+    def __iter__(self) -> Iterator[Lot]:
+        return iter(self.lots)
+
+
+class MatchLedger:
+    """
+    Columnar record of which lots each sale consumed.
+    
+    One row is appended per (sale, lot) pair while the FIFO pass runs, so drill
+    down views and audits can read the matching instead of re-running it. Shares
+    sold beyond the holding get a row of their own with the 'Unmatched' lot
+    source, no lot and no cost, so the rows' proceeds always add up to the sales.
+    """
+    
+    COLUMNS = ['Sale ID', 'Symbol', 'Sale Date', 'Lot Source', 'Lot ID', 'Lot Date',
+               'Quantity', 'Cost in AUD', 'Proceeds in AUD', 'Gain in AUD', 'Holding Days']
+    
+    def __init__(self):
+        """
+        Initialize an empty match ledger.
+        """
+        self.columns: Dict[str, List[Any]] = {col: [] for col in self.COLUMNS}
+    
+    def add(self, sale_id: int, symbol: str, sale_date: datetime, sale_quantity: float,
+            sale_value: float, lot: Lot, quantity: float, cost: float) -> None:
+        """
+        Record the part of a sale that was matched against one lot.
+        
+        The argument order lets a sale bind its own details with functools.partial
+        and pass the result to LotLedger.sell as the on_match callback.
+        
+        Args:
+            sale_id: Index of the sale in the sales details list
+            symbol: Symbol sold
+            sale_date: Date of the sale
+            sale_quantity: Total number of shares in the sale
+            sale_value: Total sale proceeds in AUD
+            lot: Lot the shares were drawn from
+            quantity: Number of shares drawn from the lot
+            cost: Cost in AUD of the shares drawn
+        """
+        # Proceeds are apportioned by quantity
+        proceeds = sale_value * quantity / sale_quantity
+        
+        columns = self.columns
+        columns['Sale ID'].append(sale_id)
+        columns['Symbol'].append(symbol)
+        columns['Sale Date'].append(sale_date.strftime('%Y-%m-%d'))
+        columns['Lot Source'].append(lot.source)
+        columns['Lot ID'].append(lot.lot_id)
+        columns['Lot Date'].append(lot.acquired.strftime('%Y-%m-%d') if lot.acquired is not None else None)
+        columns['Quantity'].append(quantity)
+        columns['Cost in AUD'].append(cost)
+        columns['Proceeds in AUD'].append(proceeds)
+        columns['Gain in AUD'].append(proceeds - cost)
+        columns['Holding Days'].append((sale_date - lot.acquired).days if lot.acquired is not None else None)
+    
+    def add_unmatched(self, sale_id: int, symbol: str, sale_date: datetime, sale_quantity: float,
+                      sale_value: float, quantity: float) -> None:
+        """
+        Record the part of a sale that no lot was left to match.
+        
+        Args:
+            sale_id: Index of the sale in the sales details list
+            symbol: Symbol sold
+            sale_date: Date of the sale
+            sale_quantity: Total number of shares in the sale
+            sale_value: Total sale proceeds in AUD
+            quantity: Number of shares sold beyond the holding
+        """
+        self.add(sale_id, symbol, sale_date, sale_quantity, sale_value,
+                 Lot(quantity, 0.0, 0.0, UNMATCHED_SOURCE), quantity, 0.0)
+    
+    def to_dict(self) -> Dict[str, List[Any]]:
+        """
+        Get the ledger as a dictionary of column lists.
+        
+        Returns:
+            Dictionary mapping column name to its values
+        """
+        return self.columns
+    
+    def clear(self) -> None:
+        """
+        Remove all recorded rows, e.g. after they have been written to a sink.
+        """
+        for values in self.columns.values():
+            values.clear()
+    
+    def __len__(self) -> int:
+        return len(self.columns['Sale ID'])
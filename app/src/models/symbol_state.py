@@ -0,0 +1,422 @@
+"""
+Per-symbol FIFO state kept between calculations for incremental recalculation.
+
+FIFO matching never crosses symbols, so the outcome for a symbol depends only
+on its opening lots and its own transactions. The cache keeps, per symbol, the
+fingerprint of every transaction row, their AUD conversions, the detail rows
+and matches they produced, and checkpoints of the open lots. When the same
+symbol is calculated again, unchanged symbols are reused as they are and a
+changed symbol is matched again only from the last checkpoint before its first
+changed row.
+
+Sale and lot numbers depend on the rows of every symbol, so the cached state
+numbers rows per symbol and is renumbered when it is merged into a result.
+"""
+import os
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from src.models.lot_ledger import LotLedger, MatchLedger
+from src.models.fifo_engine import FifoEngine, ENGINE_COLUMNS, assign_partitions
+
+# Columns identifying a transaction row; a change in any of them changes its fingerprint
+FINGERPRINT_COLUMNS = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Total Gross Value', 'Commission',
+                       'Net Value', 'Currency']
+
+# Columns added by the AUD conversion
+CONVERSION_COLUMNS = ['Exchange Rate', 'Value in AUD']
+
+# Minimum rows of a symbol between checkpoints of its open lots. Checkpoints are
+# also at least as many rows apart as there are open lots, so copying the lots
+# costs at most one lot per row
+CHECKPOINT_ROWS = 256
+
+
+def fingerprint_rows(transactions: pd.DataFrame) -> np.ndarray:
+    """
+    Hash every transaction row.
+    
+    Args:
+        transactions: DataFrame with FINGERPRINT_COLUMNS
+    
+    Returns:
+        uint64 hash per row
+    """
+    return pd.util.hash_pandas_object(transactions[FINGERPRINT_COLUMNS], index=False).to_numpy()
+
+
+def _lot_tuples(ledger: LotLedger) -> Tuple[tuple, ...]:
+    """
+    Copy the open lots of a ledger as immutable tuples of the LotLedger.add_lot arguments.
+    """
+    return tuple((lot.quantity, lot.cost_per_share, lot.total_cost, lot.source, lot.lot_id, lot.acquired)
+                 for lot in ledger)
+
+
+def _ledger_from(lots: Tuple[tuple, ...]) -> LotLedger:
+    """
+    Build a ledger from lot tuples.
+    """
+    ledger = LotLedger()
+    for lot in lots:
+        ledger.add_lot(*lot)
+    return ledger
+
+
+class SymbolState:
+    """
+    Cached FIFO outcome of one symbol, with rows numbered within the symbol.
+    
+    Sale IDs in the matches and Lot IDs of purchased lots are row indexes
+    within the symbol's transactions; opening balance lots keep their Lot ID.
+    """
+    
+    def __init__(self, opening: Tuple[tuple, ...], row_hashes: np.ndarray, conversions: np.ndarray,
+                 sale_rows: np.ndarray, purchase_rows: np.ndarray, sales: List[Dict[str, Any]],
+                 purchases: List[Dict[str, Any]], matches: Dict[str, List[Any]],
+                 checkpoints: List[Tuple[int, Tuple[tuple, ...]]], lots: Tuple[tuple, ...]):
+        """
+        Initialize a symbol state.
+        
+        Args:
+            opening: Opening balance lots of the symbol
+            row_hashes: Fingerprint of each of the symbol's rows, in processing order
+            conversions: (rows x 2) exchange rate and AUD value of each row
+            sale_rows: Row index of each sale detail row
+            purchase_rows: Row index of each purchase detail row
+            sales: Sale detail rows
+            purchases: Purchase detail rows
+            matches: Match columns as produced by MatchLedger
+            checkpoints: (row index, open lots before that row), in row order
+            lots: Open lots after the last row
+        """
+        self.opening = opening
+        self.row_hashes = row_hashes
+        self.conversions = conversions
+        self.sale_rows = sale_rows
+        self.purchase_rows = purchase_rows
+        self.sales = sales
+        self.purchases = purchases
+        self.matches = matches
+        self.checkpoints = checkpoints
+        self.lots = lots
+    
+    def first_change(self, opening: Tuple[tuple, ...], row_hashes: np.ndarray) -> int:
+        """
+        Find the first row that differs from this state.
+        
+        Args:
+            opening: Current opening balance lots of the symbol
+            row_hashes: Current fingerprint of each row
+        
+        Returns:
+            Index of the first differing row, or the number of rows if none differs
+        """
+        if opening != self.opening:
+            return 0
+        common = min(len(row_hashes), len(self.row_hashes))
+        differs = np.flatnonzero(row_hashes[:common] != self.row_hashes[:common])
+        return int(differs[0]) if len(differs) else common
+    
+    def checkpoint_before(self, row: int) -> Tuple[int, Tuple[tuple, ...]]:
+        """
+        Get the last checkpoint at or before a row.
+        
+        Args:
+            row: Row index
+        
+        Returns:
+            Tuple of (checkpoint row index, open lots before that row)
+        """
+        return self.checkpoints[bisect.bisect_right(self.checkpoints, row, key=lambda checkpoint: checkpoint[0]) - 1]
+
+
+def replay_symbol(symbol: str, opening: Tuple[tuple, ...], transactions: pd.DataFrame,
+                  row_hashes: np.ndarray, conversions: np.ndarray, previous: Optional[SymbolState],
+                  start: int, start_lots: Tuple[tuple, ...]) -> SymbolState:
+    """
+    Match a symbol's rows from a checkpoint onwards, keeping the earlier outcome.
+    
+    Args:
+        symbol: Symbol being matched
+        opening: Opening balance lots of the symbol
+        transactions: The symbol's rows from start onwards, with ENGINE_COLUMNS
+        row_hashes: Fingerprint of every row of the symbol
+        conversions: Exchange rate and AUD value of every row of the symbol
+        previous: State whose rows before start are still valid, or None when start is 0
+        start: Row index to match from, 0 or a checkpoint of previous
+        start_lots: Open lots before row start
+    
+    Returns:
+        The symbol's new state
+    """
+    if previous is not None and start > 0:
+        kept_sales = int(np.searchsorted(previous.sale_rows, start))
+        kept_purchases = int(np.searchsorted(previous.purchase_rows, start))
+        kept_matches = int(np.searchsorted(previous.matches['Sale ID'], start))
+        sale_rows = [previous.sale_rows[:kept_sales]]
+        purchase_rows = [previous.purchase_rows[:kept_purchases]]
+        sales = previous.sales[:kept_sales]
+        purchases = previous.purchases[:kept_purchases]
+        matches = {col: values[:kept_matches] for col, values in previous.matches.items()}
+        checkpoints = [checkpoint for checkpoint in previous.checkpoints if checkpoint[0] < start]
+    else:
+        sale_rows, purchase_rows, sales, purchases, checkpoints = [], [], [], [], []
+        matches = {col: [] for col in MatchLedger.COLUMNS}
+    
+    engine = FifoEngine(sales, purchases)
+    engine.matches.columns = matches
+    ledger = _ledger_from(start_lots)
+    engine.portfolio[symbol] = ledger
+    
+    quantities = transactions['Quantity'].to_numpy(dtype='float64', na_value=np.nan)
+    rows = np.arange(start, start + len(transactions))
+    sale_rows.append(rows[quantities < 0])
+    purchase_rows.append(rows[quantities > 0])
+    
+    # Match the rows between checkpoints at a time, recording the lots before each
+    offset = 0
+    while offset < len(transactions):
+        checkpoints.append((start + offset, _lot_tuples(ledger)))
+        end = offset + max(CHECKPOINT_ROWS, len(ledger))
+        ids = rows[offset:end].tolist()
+        engine.process(transactions.iloc[offset:end], ids, ids)
+        offset = end
+    
+    return SymbolState(opening, row_hashes, conversions, np.concatenate(sale_rows),
+                       np.concatenate(purchase_rows), engine.sales_details, engine.purchases_details,
+                       engine.matches.to_dict(), checkpoints, _lot_tuples(ledger))
+
+
+class SymbolStateCache:
+    """
+    Bounded LRU cache of SymbolState per (rates version, symbol).
+    
+    Different uploads often hold the same symbol, so up to states_per_symbol
+    states are kept for each symbol. A calculation replays from the state
+    sharing the most rows with it and that state is replaced by the result, so
+    uploads taking turns do not evict each other. Entries are only reused after
+    comparing row fingerprints, so two uploads sharing a symbol can never see
+    each other's figures; they only reuse as much work as their rows have in
+    common.
+    
+    The cache is bounded both by the number of symbols and by the rows held
+    across all of their states, the least recently used symbols being evicted
+    first.
+    """
+    
+    def __init__(self, max_symbols: int = 10000, max_rows: Optional[int] = None, states_per_symbol: int = 4):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_symbols: Maximum number of symbols states are kept for
+            max_rows: Maximum number of transaction rows held by all states together (unbounded if omitted)
+            states_per_symbol: Maximum number of states kept for one symbol
+        """
+        self.max_symbols = max_symbols
+        self.max_rows = max_rows
+        self.states_per_symbol = states_per_symbol
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._states: 'OrderedDict[Tuple[str, Any], List[SymbolState]]' = OrderedDict()
+    
+    def get(self, rates_key: str, symbol: Any) -> List[SymbolState]:
+        """
+        Get the cached states of a symbol.
+        
+        Args:
+            rates_key: Identity of the exchange rates the states were converted with
+            symbol: Symbol
+        
+        Returns:
+            The states, most recently used first (empty if none is cached)
+        """
+        with self._lock:
+            states = self._states.get((rates_key, symbol))
+            if states is None:
+                return []
+            self._states.move_to_end((rates_key, symbol))
+            return list(states)
+    
+    def put(self, rates_key: str, symbol: Any, state: SymbolState, replaces: Optional[SymbolState] = None) -> None:
+        """
+        Cache a state of a symbol, evicting the least recently used symbols past the bounds.
+        
+        Args:
+            rates_key: Identity of the exchange rates the state was converted with
+            symbol: Symbol
+            state: State to cache
+            replaces: Cached state the new one was derived from, which it takes the place of
+        """
+        with self._lock:
+            key = (rates_key, symbol)
+            kept = self._states.pop(key, [])
+            self.rows -= sum(len(previous.row_hashes) for previous in kept)
+            states = [state] + [previous for previous in kept
+                                if previous is not replaces and previous is not state][:self.states_per_symbol - 1]
+            self.rows += sum(len(previous.row_hashes) for previous in states)
+            self._states[key] = states
+            while self._states and (len(self._states) > self.max_symbols or
+                                    (self.max_rows is not None and self.rows > self.max_rows)):
+                _, evicted = self._states.popitem(last=False)
+                self.rows -= sum(len(previous.row_hashes) for previous in evicted)
+    
+    def clear(self) -> None:
+        """
+        Remove every cached state.
+        """
+        with self._lock:
+            self._states.clear()
+            self.rows = 0
+    
+    def __len__(self) -> int:
+        return len(self._states)
+    
+    def process(self, engine: FifoEngine, transactions: pd.DataFrame,
+                convert: Callable[[pd.DataFrame], pd.DataFrame], rates_key: str,
+                executor: Optional[Executor] = None, partitions: Optional[int] = None) -> Dict[str, int]:
+        """
+        Apply transactions to an engine like FifoEngine.process, reusing cached symbol states.
+        
+        Args:
+            engine: Engine holding the opening balance
+            transactions: Date-ordered transactions, not yet converted to AUD
+            convert: Function adding CONVERSION_COLUMNS to a transactions frame
+            rates_key: Identity of the exchange rates convert uses
+            executor: Executor to replay changed symbols on, in partitions balanced by row count
+                (replayed one after another if omitted)
+            partitions: Number of partitions, normally the executor's worker count (defaults to the CPU count)
+        
+        Returns:
+            Dictionary with the number of symbols and rows in total, reused and replayed
+        """
+        row_hashes = fingerprint_rows(transactions)
+        is_sale, is_purchase, sale_ids, purchase_ids = engine.number_rows(transactions)
+        
+        codes, symbols = pd.factorize(transactions['Symbol'], use_na_sentinel=False)
+        symbols = list(symbols)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(symbols)))])
+        
+        # Symbols enter the portfolio in order of first appearance, as in FifoEngine.process
+        for symbol in symbols:
+            if symbol not in engine.portfolio:
+                engine.portfolio[symbol] = LotLedger()
+        
+        # Work out where each symbol's rows first differ from the closest of its cached states
+        plans = []
+        for code, symbol in enumerate(symbols):
+            rows = order[bounds[code]:bounds[code + 1]]
+            opening = _lot_tuples(engine.portfolio[symbol])
+            hashes = row_hashes[rows]
+            previous, changed = None, 0
+            for state in self.get(rates_key, symbol):
+                common = state.first_change(opening, hashes)
+                if common == len(hashes) == len(state.row_hashes):
+                    previous, changed = state, None
+                    break
+                if common > changed:
+                    previous, changed = state, common
+            plans.append((symbol, rows, opening, hashes, previous, changed))
+        
+        # Convert only rows not seen before, in one batch
+        converted_rows = np.concatenate([rows[changed:] for _, rows, _, _, _, changed in plans
+                                         if changed is not None] or [np.zeros(0, dtype='int64')])
+        converted_rows.sort()
+        converted = np.zeros((len(transactions), len(CONVERSION_COLUMNS)))
+        if len(converted_rows):
+            converted[converted_rows] = convert(transactions.iloc[converted_rows])[CONVERSION_COLUMNS].to_numpy(dtype='float64')
+        
+        stats = {'symbols': len(symbols), 'symbols_reused': 0, 'symbols_replayed': 0,
+                 'rows': len(transactions), 'rows_reused': 0, 'rows_replayed': 0,
+                 'rows_converted': len(converted_rows)}
+        
+        # Replay each changed symbol from the last checkpoint before its first change
+        replays = {}
+        for index, (symbol, rows, opening, hashes, previous, changed) in enumerate(plans):
+            if changed is None:
+                continue
+            if previous is not None and changed > 0:
+                start, start_lots = previous.checkpoint_before(changed)
+                conversions = np.concatenate([previous.conversions[:changed], converted[rows[changed:]]])
+                base = previous
+            else:
+                start, start_lots, base = 0, opening, None
+                conversions = converted[rows]
+            
+            replayed = transactions.iloc[rows[start:]].copy()
+            replayed[CONVERSION_COLUMNS] = conversions[start:]
+            replays[index] = (symbol, opening, replayed[ENGINE_COLUMNS], hashes, conversions, base, start, start_lots)
+            stats['symbols_replayed'] += 1
+            stats['rows_reused'] += start
+            stats['rows_replayed'] += len(rows) - start
+        
+        # Symbols replay independently, so they can be spread across the executor like FifoEngine.process_partitioned
+        indexes = list(replays)
+        if executor is not None and indexes:
+            if partitions is None:
+                partitions = os.cpu_count() or 1
+            partition_of = assign_partitions([len(replays[index][2]) for index in indexes], partitions)
+            groups = [[index for index, target in zip(indexes, partition_of) if target == partition]
+                      for partition in range(max(1, min(partitions, len(indexes))))]
+            replayed_states = executor.map(_replay_symbols, [[replays[index] for index in group] for group in groups])
+            states = dict(zip((index for group in groups for index in group),
+                              (state for group_states in replayed_states for state in group_states)))
+        else:
+            states = dict(zip(indexes, _replay_symbols(list(replays.values()))))
+        
+        numbering = []
+        results = []
+        for index, (symbol, rows, opening, hashes, previous, changed) in enumerate(plans):
+            if changed is None:
+                state = previous
+                stats['symbols_reused'] += 1
+                stats['rows_reused'] += len(rows)
+            else:
+                state = states[index]
+            self.put(rates_key, symbol, state, previous)
+            
+            numbering.append((sale_ids[rows[state.sale_rows]].tolist(), purchase_ids[rows[state.purchase_rows]].tolist()))
+            results.append(self._renumbered(symbol, state, sale_ids[rows], purchase_ids[rows]))
+        
+        engine.merge_partitions(numbering, results)
+        return stats
+    
+    @staticmethod
+    def _renumbered(symbol: Any, state: SymbolState, sale_ids: np.ndarray, purchase_ids: np.ndarray) -> FifoEngine:
+        """
+        Build an engine holding a symbol's state with the Sale IDs and Lot IDs of this calculation.
+        """
+        lot_ids = purchase_ids.tolist()
+        
+        def lot_id(source, row):
+            return lot_ids[row] if source == 'Purchase' else row
+        
+        result = FifoEngine(state.sales, state.purchases)
+        result.portfolio[symbol] = _ledger_from(tuple(lot[:4] + (lot_id(lot[3], lot[4]),) + lot[5:]
+                                                      for lot in state.lots))
+        
+        columns = dict(state.matches)
+        columns['Sale ID'] = sale_ids[np.asarray(columns['Sale ID'], dtype='int64')].tolist()
+        columns['Lot ID'] = [lot_id(source, row) for source, row in zip(columns['Lot Source'], columns['Lot ID'])]
+        result.matches.columns = columns
+        return result
+
+
+def _replay_symbols(replays: List[tuple]) -> List[SymbolState]:
+    """
+    Replay a partition of symbols of SymbolStateCache.process.
+    
+    Args:
+        replays: replay_symbol arguments of each symbol
+    
+    Returns:
+        The new state of each symbol, in the same order
+    """
+    return [replay_symbol(*replay) for replay in replays]
@@ -1,4 +1,70 @@
 $(document).ready(function() {
+    // Readable names of the calculation stages reported by a job
+    var STAGE_NAMES = {
+        upload: 'Receiving files',
+        parse: 'Reading files',
+        rates: 'Loading exchange rates',
+        fx: 'Converting to AUD',
+        fifo: 'Matching sales to purchases',
+        render: 'Preparing results'
+    };
+    
+    function resetForm() {
+        $('#loadingSpinner').addClass('d-none');
+        $('#calculateBtn').prop('disabled', false);
+        $('#jobProgress').addClass('d-none').text('');
+    }
+    
+    function showError(errorMsg) {
+        alert('Error: ' + errorMsg);
+        resetForm();
+    }
+    
+    // Show a job update and return true once the job has finished
+    function handleJob(job) {
+        if (job.status === 'done') {
+            // Results are stored server-side, navigate to them by id
+            window.location.href = job.result.redirect;
+            return true;
+        }
+        if (job.status === 'failed') {
+            showError(job.error);
+            return true;
+        }
+        
+        var stage = job.stage ? (STAGE_NAMES[job.stage] || job.stage) : 'Waiting to start';
+        $('#jobProgress').removeClass('d-none').text(stage + '...');
+        return false;
+    }
+    
+    // Follow a queued calculation, over server-sent events where available and by polling otherwise
+    function followJob(response) {
+        if (window.EventSource) {
+            var events = new EventSource(response.events_url);
+            events.onmessage = function(e) {
+                if (handleJob(JSON.parse(e.data))) {
+                    events.close();
+                }
+            };
+            events.onerror = function() {
+                events.close();
+                pollJob(response.status_url);
+            };
+        } else {
+            pollJob(response.status_url);
+        }
+    }
+    
+    function pollJob(statusUrl) {
+        $.getJSON(statusUrl, function(job) {
+            if (!handleJob(job)) {
+                setTimeout(function() { pollJob(statusUrl); }, 1000);
+            }
+        }).fail(function() {
+            showError('Lost track of the calculation.');
+        });
+    }
+    
     // Handle form submission
     $('#uploadForm').on('submit', function(e) {
         e.preventDefault();
@@ -10,36 +76,21 @@ $(document).ready(function() {
         // Create FormData object
         var formData = new FormData(this);
         
-        // Send AJAX request
+        // Send AJAX request; the calculation runs in the background and reports its progress
         $.ajax({
-            url: '/upload',
+            url: '/upload?async=1',
             type: 'POST',
             data: formData,
             contentType: false,
             processData: false,
             success: function(response) {
-                if (response.success) {
-                    if (response.html) {
-                        // Replace page content with results HTML
-                        document.open();
-                        document.write(response.html);
-                        document.close();
-                        // Update browser history so back button works correctly
-                        history.pushState({}, "Results", "/results");
-                        
-                        // Add event handler for detail links after page is loaded
-                        $(document).ready(function() {
-                            setupDetailLinks();
-                        });
-                    } else if (response.redirect) {
-                        // Fallback to redirect if html not provided
-                        window.location.href = response.redirect;
-                    }
+                if (response.success && response.job_id) {
+                    followJob(response);
+                } else if (response.success) {
+                    window.location.href = response.redirect;
                 } else {
                     // Show error message
-                    alert('Error: ' + response.error);
-                    $('#loadingSpinner').addClass('d-none');
-                    $('#calculateBtn').prop('disabled', false);
+                    showError(response.error);
                 }
             },
             error: function(xhr) {
@@ -47,79 +98,8 @@ $(document).ready(function() {
                 if (xhr.responseJSON && xhr.responseJSON.error) {
                     errorMsg = xhr.responseJSON.error;
                 }
-                alert('Error: ' + errorMsg);
-                $('#loadingSpinner').addClass('d-none');
-                $('#calculateBtn').prop('disabled', false);
+                showError(errorMsg);
             }
         });
     });
-    
-    // Function to set up detail link click handlers
-    function setupDetailLinks() {
-        $('.detail-link').on('click', function(e) {
-            e.preventDefault();
-            
-            // Get the URL from the link
-            var url = $(this).attr('href');
-            
-            // Extract the element type from the URL
-            var element = url.split('/').pop();
-            
-            // Determine element name and data based on the element type
-            var elementName, elementData;
-            
-            switch(element) {
-                case 'sales_details':
-                    elementName = 'Sales Details';
-                    elementData = window.results.sales_details;
-                    break;
-                case 'opening_balance':
-                    elementName = 'Opening Balance';
-                    elementData = window.results.opening_balance;
-                    break;
-                case 'purchases_details':
-                    elementName = 'Purchases Details';
-                    elementData = window.results.purchases_details;
-                    break;
-                case 'closing_balance':
-                    elementName = 'Closing Balance';
-                    elementData = window.results.closing_balance;
-                    break;
-                default:
-                    alert('Unknown detail type');
-                    return;
-            }
-            
-            // Send AJAX request to get details page with the data
-            $.ajax({
-                url: url,
-                type: 'POST',
-                contentType: 'application/json',
-                data: JSON.stringify({
-                    element_name: elementName,
-                    element_data: elementData,
-                    full_results: window.results // Pass the full results for "Back to Results" functionality
-                }),
-                success: function(response) {
-                    if (response.success && response.html) {
-                        // Replace page content with details HTML
-                        document.open();
-                        document.write(response.html);
-                        document.close();
-                        // Update browser history
-                        history.pushState({}, elementName, url);
-                    } else {
-                        alert('Error: ' + (response.error || 'Failed to load details'));
-                    }
-                },
-                error: function(xhr) {
-                    var errorMsg = 'An error occurred while loading details.';
-                    if (xhr.responseJSON && xhr.responseJSON.error) {
-                        errorMsg = xhr.responseJSON.error;
-                    }
-                    alert('Error: ' + errorMsg);
-                }
-            });
-        });
-    }
 });
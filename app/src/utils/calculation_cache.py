@@ -0,0 +1,214 @@
+"""
+Content-addressed cache of whole calculation results.
+
+A calculation is identified by a hash of the normalised transactions, the
+opening balance, the version of the rate data and the calculation version, so
+re-submitting identical files returns the stored results without converting
+or matching anything, and any change to the inputs or the rates misses.
+"""
+import os
+import pickle
+import hashlib
+import threading
+import pandas as pd
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+
+
+def frame_digest(frame: Optional[pd.DataFrame]) -> str:
+    """
+    Hash the contents of a DataFrame, including its column names and dtypes.
+    
+    Args:
+        frame: DataFrame to hash, or None
+    
+    Returns:
+        Hex digest; equal frames always give the same digest
+    """
+    digest = hashlib.sha256()
+    if frame is None:
+        return digest.hexdigest()
+    
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in frame.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def calculation_key(transactions: pd.DataFrame, opening_balance: Optional[pd.DataFrame], rates_version: str,
+                    calculation_version: str) -> str:
+    """
+    Build the cache key of a calculation.
+    
+    Args:
+        transactions: Processed transactions
+        opening_balance: Processed opening balance, or None
+        rates_version: Version of the rate data the calculation converts with
+        calculation_version: Version of the calculation code
+    
+    Returns:
+        Hex digest identifying the calculation
+    """
+    parts = [frame_digest(transactions), frame_digest(opening_balance), rates_version, calculation_version]
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+class CalculationCache:
+    """
+    Bounded LRU cache of calculation results with an optional disk tier.
+    
+    Results are held in memory up to ``max_entries``. When a cache directory is
+    configured, results evicted from memory are pickled there, up to
+    ``max_disk_entries`` files, and are copied back into memory on their next
+    hit. Keys are content hashes, so the disk tier stays valid across restarts
+    and can be shared by several processes.
+    """
+    
+    def __init__(self, max_entries: int = 64, cache_dir: Optional[str] = None, max_disk_entries: int = 1024):
+        """
+        Initialize the calculation cache.
+        
+        Args:
+            max_entries: Maximum number of results kept in memory
+            cache_dir: Optional directory for results evicted from memory
+            max_disk_entries: Maximum number of results kept in cache_dir
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up the results of a calculation.
+        
+        Args:
+            key: Key built with calculation_key
+        
+        Returns:
+            Results dictionary, or None on a miss; it is the cached entry itself,
+            so callers must copy it before making changes
+        """
+        with self._lock:
+            results = self._entries.get(key)
+            if results is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return results
+            
+            results = self._read_disk(key)
+            if results is None:
+                self._stats['misses'] += 1
+                return None
+            
+            self._stats['hits'] += 1
+            self._stats['disk_hits'] += 1
+            self._entries[key] = results
+            self._evict()
+            return results
+    
+    def put(self, key: str, results: Dict[str, Any]) -> None:
+        """
+        Store the results of a calculation.
+        
+        Args:
+            key: Key built with calculation_key
+            results: Results dictionary produced by TaxCalculator.calculate_tax
+        """
+        with self._lock:
+            self._entries[key] = results
+            self._entries.move_to_end(key)
+            self._evict()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the cache counters.
+        
+        Returns:
+            Dictionary of hits, disk hits, misses, evictions, hit ratio and entry counts
+        """
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            stats = dict(self._stats)
+            stats['hit_ratio'] = self._stats['hits'] / lookups if lookups else 0.0
+            stats['entries'] = len(self._entries)
+            stats['disk_entries'] = len(self._disk_files()) if self.cache_dir else 0
+            return stats
+    
+    def clear(self) -> None:
+        """
+        Remove every cached result from memory and disk.
+        """
+        with self._lock:
+            self._entries.clear()
+            for name in self._disk_files():
+                os.remove(os.path.join(self.cache_dir, name))
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _evict(self) -> None:
+        """
+        Move least recently used results out of memory, to disk if configured.
+        """
+        while len(self._entries) > self.max_entries:
+            key, results = self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+            if self.cache_dir:
+                self._write_disk(key, results)
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+    
+    def _disk_files(self) -> List[str]:
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        return [name for name in os.listdir(self.cache_dir) if name.endswith('.pkl')]
+    
+    def _write_disk(self, key: str, results: Dict[str, Any]) -> None:
+        """
+        Write results to the disk tier, dropping the least recently used files beyond max_disk_entries.
+        """
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            # Same key, same contents: only mark it as recently used
+            os.utime(path)
+            return
+        
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        
+        names = self._disk_files()
+        if len(names) > self.max_disk_entries:
+            paths = sorted((os.path.join(self.cache_dir, name) for name in names), key=_mtime)
+            for old in paths[:len(paths) - self.max_disk_entries]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass  # Already removed by another process sharing the directory
+    
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Read results from the disk tier, leaving the file for other processes sharing the directory.
+        """
+        if not self.cache_dir or not os.path.exists(self._disk_path(key)):
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                results = pickle.load(f)
+            os.utime(self._disk_path(key))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        return results
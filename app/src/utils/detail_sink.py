@@ -0,0 +1,66 @@
+"""
+On-disk sinks for calculation detail rows.
+"""
+import csv
+from typing import Dict, Any, List
+
+
+class CsvDetailSink:
+    """
+    Append-only CSV file of detail rows.
+    
+    Used in place of a list when detail rows should not be kept in memory. Rows
+    are written as they arrive, and len() reports how many have been written.
+    """
+    
+    def __init__(self, path: str, columns: List[str]):
+        """
+        Open the sink and write the header row.
+        
+        Args:
+            path: Path of the CSV file to create
+            columns: Column names, in output order
+        """
+        self.path = path
+        self.columns = columns
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+        self._count = 0
+    
+    def append(self, record: Dict[str, Any]) -> None:
+        """
+        Write one detail row.
+        
+        Args:
+            record: Row dictionary keyed by column name
+        """
+        self._writer.writerow([record[col] for col in self.columns])
+        self._count += 1
+    
+    def write_columns(self, columns: Dict[str, List[Any]]) -> None:
+        """
+        Write rows given as a dictionary of equal-length column lists.
+        
+        Args:
+            columns: Column name to values mapping
+        """
+        rows = list(zip(*(columns[col] for col in self.columns)))
+        self._writer.writerows(rows)
+        self._count += len(rows)
+    
+    def close(self) -> None:
+        """
+        Flush and close the file.
+        """
+        if not self._file.closed:
+            self._file.close()
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def __enter__(self) -> 'CsvDetailSink':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
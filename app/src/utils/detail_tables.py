@@ -0,0 +1,226 @@
+"""
+Columnar storage and paging for the detail views of a calculation result.
+"""
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+# Results elements that are shown as detail tables
+DETAIL_TABLE_ELEMENTS = ['sales_details', 'purchases_details', 'opening_balance', 'closing_balance']
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# printf-style formats of the numeric columns shown on the details page
+DISPLAY_FORMATS = {
+    'Unit Price': '%.2f',
+    'Gross Value': '%.2f',
+    'Commission': '%.2f',
+    'Net Value': '%.2f',
+    'Exchange Rate': '%.4f',
+    'Value in AUD': '%.2f',
+    'Total Cost in AUD': '%.2f',
+    'Average Cost': '%.2f',
+}
+
+# Rows formatted at a time while a details page streams
+DISPLAY_BATCH_ROWS = 500
+
+
+class DetailTable:
+    """
+    Detail rows for one results element, stored as a DataFrame.
+    
+    Sort orders are computed once per column and cached, so paging through an
+    unfiltered table only materialises the rows on the requested page.
+    """
+    
+    def __init__(self, records: List[Dict[str, Any]]):
+        """
+        Initialize a detail table.
+        
+        Args:
+            records: Row dictionaries as produced by TaxCalculator.calculate_tax
+        """
+        self.frame = pd.DataFrame.from_records(records)
+        self._orders: Dict[Tuple[str, bool], np.ndarray] = {}
+    
+    @property
+    def columns(self) -> List[str]:
+        return list(self.frame.columns)
+    
+    def __len__(self) -> int:
+        return len(self.frame)
+    
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Get every row of the table.
+        
+        Returns:
+            List of row dictionaries
+        """
+        return self.frame.to_dict('records')
+    
+    def query(self, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE, sort_by: Optional[str] = None,
+              descending: bool = False, symbol: Optional[str] = None, date_from: Optional[str] = None,
+              date_to: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Get one page of rows, optionally sorted and filtered.
+        
+        Args:
+            page: 1-based page number
+            page_size: Number of rows per page (capped at MAX_PAGE_SIZE)
+            sort_by: Column to sort by, or None to keep calculation order
+            descending: Sort in descending order
+            symbol: Only include these symbols (comma separated)
+            date_from: Only include rows dated on or after this date
+            date_to: Only include rows dated on or before this date
+        
+        Returns:
+            Tuple of (rows on the page, total number of matching rows)
+        
+        Raises:
+            ValueError: If the sort column is unknown or a date cannot be parsed
+        """
+        page_frame, total_rows = self.query_frame(page, page_size, sort_by, descending, symbol, date_from, date_to)
+        return page_frame.to_dict('records'), total_rows
+    
+    def query_frame(self, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE, sort_by: Optional[str] = None,
+                    descending: bool = False, symbol: Optional[str] = None, date_from: Optional[str] = None,
+                    date_to: Optional[str] = None) -> Tuple[pd.DataFrame, int]:
+        """
+        Get one page of rows as a DataFrame; arguments and errors are as for query.
+        
+        Returns:
+            Tuple of (DataFrame of the rows on the page, total number of matching rows)
+        """
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+        
+        order = self._matching_order(sort_by, descending, symbol, date_from, date_to)
+        total_rows = len(order) if order is not None else len(self.frame)
+        start = (page - 1) * page_size
+        end = start + page_size
+        
+        if order is not None:
+            return self.frame.iloc[order[start:end]], total_rows
+        return self.frame.iloc[start:end], total_rows
+    
+    def select(self, sort_by: Optional[str] = None, descending: bool = False, symbol: Optional[str] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None) -> pd.DataFrame:
+        """
+        Get every matching row, for exports; arguments and errors are as for query.
+        
+        Returns:
+            DataFrame of the matching rows in order
+        """
+        order = self._matching_order(sort_by, descending, symbol, date_from, date_to)
+        return self.frame.iloc[order] if order is not None else self.frame
+    
+    def _matching_order(self, sort_by: Optional[str], descending: bool, symbol: Optional[str],
+                        date_from: Optional[str], date_to: Optional[str]) -> Optional[np.ndarray]:
+        """
+        Get the positions of the matching rows in order, or None for every row in calculation order.
+        """
+        order = self._order(sort_by, descending)
+        
+        # Filters narrow the (sorted) row order rather than copying the frame
+        mask = self._filter_mask(symbol, date_from, date_to)
+        if mask is not None:
+            order = order[mask[order]] if order is not None else np.flatnonzero(mask)
+        return order
+    
+    def _order(self, sort_by: Optional[str], descending: bool) -> Optional[np.ndarray]:
+        """
+        Get the cached row order for a sort column.
+        """
+        if sort_by is None:
+            return None
+        
+        if sort_by not in self.frame.columns:
+            raise ValueError(f"Unknown column: {sort_by}")
+        
+        # Ties keep calculation order and missing values sort last in either direction
+        order = self._orders.get((sort_by, descending))
+        if order is None:
+            column = self.frame[sort_by].reset_index(drop=True)
+            try:
+                order = column.sort_values(kind='stable', ascending=not descending,
+                                           na_position='last').index.to_numpy()
+            except TypeError:
+                raise ValueError(f"Column {sort_by} holds values that cannot be compared")
+            self._orders[(sort_by, descending)] = order
+        
+        return order
+    
+    def _filter_mask(self, symbol: Optional[str], date_from: Optional[str],
+                     date_to: Optional[str]) -> Optional[np.ndarray]:
+        """
+        Build a boolean row mask for the symbol and date filters.
+        """
+        mask = None
+        
+        if symbol and 'Symbol' in self.frame.columns:
+            symbols = [s.strip() for s in symbol.split(',') if s.strip()]
+            mask = self.frame['Symbol'].isin(symbols).to_numpy()
+        
+        # Dates are stored as ISO strings, so they compare correctly as text
+        if 'Date' in self.frame.columns:
+            for bound, compare in ((date_from, np.greater_equal), (date_to, np.less_equal)):
+                if bound:
+                    try:
+                        bound = pd.Timestamp(bound).strftime('%Y-%m-%d')
+                    except (ValueError, TypeError):
+                        raise ValueError(f"Invalid date: {bound}")
+                    date_mask = compare(self.frame['Date'].to_numpy(dtype=object), bound)
+                    mask = date_mask if mask is None else mask & date_mask
+        
+        return mask
+
+
+def display_rows(frame: pd.DataFrame, batch_rows: int = DISPLAY_BATCH_ROWS) -> Iterator[Dict[str, Any]]:
+    """
+    Format detail rows for display, a batch at a time.
+    
+    Each numeric column of a batch is formatted with one vectorised call rather
+    than a filter call per cell in the template, and balance rows gain an
+    'Average Cost' column (cost per share).
+    
+    Args:
+        frame: Detail rows, e.g. a page from DetailTable.query_frame
+        batch_rows: Rows formatted per batch
+    
+    Yields:
+        Row dictionaries whose DISPLAY_FORMATS columns are formatted strings
+    """
+    for start in range(0, len(frame), batch_rows):
+        batch = frame.iloc[start:start + batch_rows]
+        columns = {column: batch[column].tolist() for column in batch.columns}
+        
+        if 'Total Cost in AUD' in batch.columns and 'Quantity' in batch.columns:
+            columns['Average Cost'] = (batch['Total Cost in AUD'].to_numpy(dtype='float64')
+                                       / batch['Quantity'].to_numpy(dtype='float64'))
+        
+        for column, display_format in DISPLAY_FORMATS.items():
+            if column in columns:
+                columns[column] = np.char.mod(display_format, np.asarray(columns[column], dtype='float64')).tolist()
+        
+        names = list(columns)
+        for values in zip(*columns.values()):
+            yield dict(zip(names, values))
+
+
+def build_detail_tables(results: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert the detail lists of a results dictionary into DetailTables for storage.
+    
+    Args:
+        results: Results dictionary produced by TaxCalculator.calculate_tax
+    
+    Returns:
+        Shallow copy of the results with each detail element replaced by a DetailTable
+    """
+    stored = dict(results)
+    for element in DETAIL_TABLE_ELEMENTS:
+        stored[element] = DetailTable(results.get(element, []))
+    return stored
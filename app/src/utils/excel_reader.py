@@ -0,0 +1,236 @@
+"""
+Column-pruned reading of Excel uploads.
+
+pd.read_excel loads every cell of the first sheet into Python objects. Broker
+statements often hold several sheets, preamble rows above the header and many
+columns the calculation never uses, so this reader finds the sheet and header
+row that hold the required columns and keeps only those cells while streaming
+the rows. It uses python-calamine when installed, which parses in native code,
+and otherwise openpyxl in read-only mode. Parsed frames are cached by content
+hash, so re-uploading the same workbook skips the parse.
+"""
+import io
+import hashlib
+import threading
+import pandas as pd
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Prefer the native calamine parser; openpyxl is pandas' own .xlsx dependency
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+EXCEL_ENGINE = 'calamine' if python_calamine is not None else 'openpyxl'
+
+# Rows searched for the header at the top of each sheet
+MAX_HEADER_ROWS = 20
+
+
+def _header_positions(row: Sequence[Any], columns: List[str],
+                      optional_columns: Sequence[str] = ()) -> Optional[Dict[str, int]]:
+    """
+    Find the required columns, and any optional ones present, in a candidate header row.
+    
+    Returns:
+        Position in the row of each column found, in the given order, or None if any required one is missing
+    """
+    names = {}
+    for position, cell in enumerate(row):
+        if cell is not None:
+            names.setdefault(str(cell).strip(), position)
+    if not all(column in names for column in columns):
+        return None
+    return {column: names[column] for column in list(columns) + list(optional_columns) if column in names}
+
+
+def _prune_rows(rows: Iterable[Sequence[Any]], columns: List[str],
+                optional_columns: Sequence[str] = ()) -> Optional[pd.DataFrame]:
+    """
+    Locate the header in a sheet's rows and keep only the required columns below it.
+    
+    Args:
+        rows: Rows of cell values, top to bottom
+        columns: Required column names
+        optional_columns: Column names also kept when the header holds them
+    
+    Returns:
+        DataFrame of the required and present optional columns, or None if no header row holds them all
+    """
+    rows = iter(rows)
+    header = None
+    for _, row in zip(range(MAX_HEADER_ROWS), rows):
+        header = _header_positions(row, columns, optional_columns)
+        if header is not None:
+            break
+    if header is None:
+        return None
+    
+    columns = list(header)
+    positions = list(header.values())
+    values: List[List[Any]] = [[] for _ in columns]
+    for row in rows:
+        # calamine gives empty cells as '' where openpyxl gives None
+        cells = [row[position] if position < len(row) and row[position] != '' else None for position in positions]
+        # Blank lines and spacer rows carry none of the required cells
+        if all(cell is None for cell in cells):
+            continue
+        for column_values, cell in zip(values, cells):
+            column_values.append(cell)
+    
+    return pd.DataFrame(dict(zip(columns, values)), columns=columns)
+
+
+def _sheets(data: bytes, sheet_name: Optional[str]) -> Iterator[Iterable[Sequence[Any]]]:
+    """
+    Yield the rows of each candidate sheet, the chosen sheet only if one is named.
+    """
+    if python_calamine is not None:
+        workbook = python_calamine.CalamineWorkbook.from_filelike(io.BytesIO(data))
+        names = [sheet_name] if sheet_name is not None else workbook.sheet_names
+        for name in names:
+            yield workbook.get_sheet_by_name(name).iter_rows()
+        return
+    
+    if openpyxl is None:
+        raise ImportError("Reading Excel files needs openpyxl or python-calamine to be installed")
+    
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        names = [sheet_name] if sheet_name is not None else workbook.sheetnames
+        for name in names:
+            yield workbook[name].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+class ExcelCache:
+    """
+    Bounded LRU cache of pruned workbook frames, keyed by content hash.
+    """
+    
+    def __init__(self, max_entries: int = 16):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_entries: Maximum number of parsed frames kept
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, Optional[str], Tuple[str, ...]], pd.DataFrame]' = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0}
+    
+    def get(self, key: Tuple[str, Optional[str], Tuple[str, ...]]) -> Optional[pd.DataFrame]:
+        """
+        Look up a parsed frame.
+        
+        Args:
+            key: Tuple of (content hash, sheet name, columns)
+        
+        Returns:
+            Copy of the frame, which the caller may modify, or None on a miss
+        """
+        with self._lock:
+            frame = self._entries.get(key)
+            if frame is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        return frame.copy()
+    
+    def put(self, key: Tuple[str, Optional[str], Tuple[str, ...]], frame: pd.DataFrame) -> None:
+        """
+        Store a parsed frame.
+        
+        Args:
+            key: Tuple of (content hash, sheet name, columns)
+            frame: Frame as returned by read_excel_columns
+        """
+        with self._lock:
+            self._entries[key] = frame.copy()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Report the cache counters.
+        
+        Returns:
+            Dictionary of hits, misses and entries
+        """
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+    
+    def clear(self) -> None:
+        """
+        Remove every cached frame.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+_excel_cache = ExcelCache()
+
+
+def get_excel_cache() -> ExcelCache:
+    """
+    Get the process-wide cache of parsed workbooks.
+    
+    Returns:
+        The shared ExcelCache
+    """
+    return _excel_cache
+
+
+def read_excel_columns(source: Union[str, BinaryIO, bytes], columns: List[str],
+                       sheet_name: Optional[str] = None,
+                       optional_columns: Sequence[str] = ()) -> Optional[pd.DataFrame]:
+    """
+    Read only the required columns of an Excel workbook.
+    
+    Without a sheet name, sheets are tried in workbook order and the first one
+    with a header row (within its first MAX_HEADER_ROWS rows) holding every
+    required column is read.
+    
+    Args:
+        source: File path, binary file-like object or file bytes
+        columns: Required column names
+        sheet_name: Sheet to read, or None to detect it
+        optional_columns: Column names also read when the header row holds them
+    
+    Returns:
+        DataFrame of the required columns in the given order, followed by the
+        optional columns present, or None if no sheet holds them all
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            data = f.read()
+    elif isinstance(source, (bytes, bytearray)):
+        data = bytes(source)
+    else:
+        data = source.read()
+    
+    key = (hashlib.sha256(data).hexdigest(), sheet_name, tuple(columns) + tuple(optional_columns))
+    frame = _excel_cache.get(key)
+    if frame is not None:
+        return frame
+    
+    sheets = _sheets(data, sheet_name)
+    try:
+        for rows in sheets:
+            frame = _prune_rows(rows, columns, optional_columns)
+            if frame is not None:
+                _excel_cache.put(key, frame)
+                return frame
+    finally:
+        sheets.close()
+    return None
@@ -1,31 +1,227 @@
 """
 File processing utilities for handling CSV and Excel files.
 """
+import io
+import os
+import csv
 import pandas as pd
-from typing import Tuple, Any
+from contextlib import contextmanager
+from typing import Tuple, Any, Optional, Union, BinaryIO, Iterator, List, Dict
 
+from src.utils.lot_snapshot import read_lot_snapshot, LOT_SNAPSHOT_EXTENSION
+from src.utils.excel_reader import read_excel_columns, EXCEL_ENGINE
 
-def process_opening_balance(file_path: str) -> Tuple[bool, str, Any]:
+# A file path, an open binary file-like object, or the raw file bytes
+FileSource = Union[str, BinaryIO, bytes]
+
+# Use the multithreaded pyarrow CSV parser when it is installed and there is
+# more than one core for it to use; on a single core the C parser is faster
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow' if (os.cpu_count() or 1) > 1 else 'c'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+# Date format expected in upload files; other formats fall back to inference
+DATE_FORMAT = '%Y-%m-%d'
+
+# Declared schemas for the typed parse path. Quantity is left to the parser so
+# whole-share files keep integer quantities and fractional ones become floats.
+OPENING_BALANCE_COLUMNS = ['Symbol', 'Quantity', 'Total Cost in AUD']
+OPENING_BALANCE_DTYPES = {
+    'Symbol': 'category',
+    'Total Cost in AUD': 'float64',
+}
+# Read when present, so a lot-level opening balance (LOT_COLUMNS) keeps each lot's acquisition date
+OPENING_BALANCE_OPTIONAL_COLUMNS = ['Acquired']
+
+TRADE_TRANSACTION_COLUMNS = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Commission', 'Currency']
+TRADE_TRANSACTION_DTYPES = {
+    'Date': 'category',
+    'Symbol': 'category',
+    'Unit Price': 'float64',
+    'Commission': 'float64',
+    'Currency': 'category',
+}
+
+# Low-cardinality text columns stored as categories
+CATEGORY_COLUMNS = ['Symbol', 'Currency']
+
+
+@contextmanager
+def open_upload(file_storage: Any) -> Iterator[BinaryIO]:
+    """
+    Open an uploaded file for parsing straight from the request stream.
+    
+    The stream is closed on exit however parsing ends, which also removes any
+    temporary file the upload was spooled to.
+    
+    Args:
+        file_storage: Uploaded file (werkzeug FileStorage)
+    
+    Yields:
+        Readable binary stream positioned at the start of the upload
+    """
+    stream = file_storage.stream
+    try:
+        stream.seek(0)
+        yield stream
+    finally:
+        file_storage.close()
+
+
+def _csv_options(columns: List[str], dtypes: Dict[str, str], engine: str) -> Dict[str, Any]:
+    """
+    Build read_csv keyword arguments for a declared schema.
+    
+    Args:
+        columns: Columns to read
+        dtypes: Column dtypes
+        engine: read_csv engine name
+    
+    Returns:
+        Keyword arguments for pd.read_csv
+    """
+    # The C engine takes a callable, which tolerates missing columns so the
+    # required-column check can report them. pyarrow only accepts a list.
+    usecols = columns if engine == 'pyarrow' else (lambda col: col in columns)
+    return {'usecols': usecols, 'dtype': dtypes, 'engine': engine}
+
+
+def _csv_header(source: Union[str, BinaryIO]) -> List[str]:
+    """
+    Read the column names of a CSV file, leaving a stream where it was.
+    
+    Args:
+        source: File path or seekable binary file-like object
+    
+    Returns:
+        Column names of the header row
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            line = f.readline()
+    else:
+        start = source.tell()
+        line = source.readline()
+        source.seek(start)
+    return [name.strip() for name in next(csv.reader([line.decode('utf-8-sig', errors='replace')]), [])]
+
+
+def _read_table(source: FileSource, filename: Optional[str], columns: Optional[List[str]] = None,
+                dtypes: Optional[Dict[str, str]] = None, sheet_name: Optional[str] = None,
+                optional_columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """
+    Read a CSV or Excel file into a DataFrame.
+    
+    When a schema is given, CSV files are first parsed with fixed dtypes and only
+    the declared columns, and Excel files are read with only the declared columns
+    from the sheet that holds them. If that fails (bad values or missing columns)
+    the file is re-read in full so validation can report the problem.
+    
+    Args:
+        source: File path, binary file-like object or file bytes
+        filename: Name used to detect the format (defaults to the path or the object's name)
+        columns: Columns to read for the typed CSV and pruned Excel paths
+        dtypes: Column dtypes for the typed CSV path
+        sheet_name: Excel sheet to read, or None to detect the sheet holding the columns
+        optional_columns: Columns also read on the typed CSV and pruned Excel paths when the file has them
+    
+    Returns:
+        DataFrame, or None if the file format is not supported
+    """
+    if filename is None:
+        filename = source if isinstance(source, str) else getattr(source, 'name', '')
+    filename = str(filename).lower()
+    
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    
+    # Determine file type based on extension
+    if filename.endswith('.csv'):
+        if columns is not None:
+            start = source.tell() if hasattr(source, 'tell') else None
+            if optional_columns and (isinstance(source, str) or start is not None):
+                header = _csv_header(source)
+                columns = columns + [col for col in optional_columns if col in header]
+            try:
+                return pd.read_csv(source, **_csv_options(columns, dtypes or {}, CSV_ENGINE))
+            except (ValueError, TypeError, KeyError):
+                if start is not None:
+                    source.seek(start)
+        return pd.read_csv(source)
+    elif filename.endswith('.xlsx') or filename.endswith('.xls'):
+        # openpyxl only reads .xlsx; legacy .xls needs calamine for the pruned path
+        if columns is not None and (filename.endswith('.xlsx') or EXCEL_ENGINE == 'calamine'):
+            start = source.tell() if hasattr(source, 'tell') else None
+            df = read_excel_columns(source, columns, sheet_name, optional_columns or ())
+            if df is not None:
+                return df
+            if start is not None:
+                source.seek(start)
+        return pd.read_excel(source, sheet_name=sheet_name if sheet_name is not None else 0)
+    
+    return None
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """
+    Parse a date column with the declared format, inferring it if that fails.
+    
+    Categorical columns are parsed once per distinct date and expanded by their
+    codes, which is much cheaper than parsing every row of a large file.
+    
+    Args:
+        values: Raw date values
+    
+    Returns:
+        Datetime series
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = pd.DatetimeIndex(_parse_dates(pd.Series(values.cat.categories)))
+        parsed = categories.take(values.cat.codes.to_numpy(), allow_fill=True, fill_value=pd.NaT)
+        return pd.Series(parsed, index=values.index, name=values.name)
+    
+    try:
+        return pd.to_datetime(values, format=DATE_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values)
+
+
+def _to_categories(df: pd.DataFrame) -> None:
+    """
+    Store the low-cardinality text columns of a DataFrame as categories, in place.
     """
-    Process opening balance file (CSV or Excel).
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+
+
+def process_opening_balance(file: FileSource, filename: Optional[str] = None,
+                            sheet_name: Optional[str] = None) -> Tuple[bool, str, Any]:
+    """
+    Process opening balance file (CSV, Excel, or a lot snapshot of the previous year's closing balance).
     
     Args:
-        file_path: Path to the opening balance file
+        file: Path to the opening balance file, an open binary file-like object, or its bytes
+        filename: Original file name, used to detect the format when file is not a path
+        sheet_name: Excel sheet to read, or None to detect it
     
     Returns:
         Tuple of (success, error_message, dataframe)
     """
     try:
-        # Determine file type based on extension
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith('.xlsx') or file_path.endswith('.xls'):
-            df = pd.read_excel(file_path)
+        name = filename if filename is not None else (file if isinstance(file, str) else getattr(file, 'name', ''))
+        if str(name).lower().endswith(LOT_SNAPSHOT_EXTENSION):
+            df = read_lot_snapshot(file)
         else:
+            df = _read_table(file, filename, OPENING_BALANCE_COLUMNS, OPENING_BALANCE_DTYPES, sheet_name,
+                             OPENING_BALANCE_OPTIONAL_COLUMNS)
+        if df is None:
             return False, "Unsupported file format. Please use CSV or Excel.", None
         
         # Validate required columns
-        required_columns = ['Symbol', 'Quantity', 'Total Cost in AUD']
+        required_columns = OPENING_BALANCE_COLUMNS
         missing_columns = [col for col in required_columns if col not in df.columns]
         
         if missing_columns:
@@ -42,57 +238,123 @@ def process_opening_balance(file_path: str) -> Tuple[bool, str, Any]:
         if (df['Quantity'] <= 0).any():
             return False, "Quantity must be positive for opening balance.", None
         
-        return True, "", df
+        _to_categories(df)
         
+        return True, "", df
+    
     except Exception as e:
         return False, f"Error processing opening balance file: {str(e)}", None
 
 
-def process_trade_transactions(file_path: str) -> Tuple[bool, str, Any]:
+def process_trade_transactions(file: FileSource, filename: Optional[str] = None,
+                               sheet_name: Optional[str] = None) -> Tuple[bool, str, Any]:
     """
     Process trade transactions file (CSV or Excel).
     
     Args:
-        file_path: Path to the trade transactions file
+        file: Path to the trade transactions file, an open binary file-like object, or its bytes
+        filename: Original file name, used to detect the format when file is not a path
+        sheet_name: Excel sheet to read, or None to detect it
     
     Returns:
         Tuple of (success, error_message, dataframe)
     """
     try:
-        # Determine file type based on extension
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith('.xlsx') or file_path.endswith('.xls'):
-            df = pd.read_excel(file_path)
-        else:
+        df = _read_table(file, filename, TRADE_TRANSACTION_COLUMNS, TRADE_TRANSACTION_DTYPES, sheet_name)
+        if df is None:
             return False, "Unsupported file format. Please use CSV or Excel.", None
         
-        # Validate required columns
-        required_columns = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Commission', 'Currency']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return False, f"Missing required columns: {', '.join(missing_columns)}", None
-        
-        # Convert date column to datetime
-        try:
-            df['Date'] = pd.to_datetime(df['Date'])
-        except Exception as e:
-            return False, f"Error converting date column: {str(e)}", None
-        
-        # Validate data types
-        try:
-            df['Quantity'] = pd.to_numeric(df['Quantity'])
-            df['Unit Price'] = pd.to_numeric(df['Unit Price'])
-            df['Commission'] = pd.to_numeric(df['Commission'])
-        except Exception as e:
-            return False, f"Error converting numeric columns: {str(e)}", None
-        
-        # Calculate derived columns
-        df['Total Gross Value'] = df['Quantity'] * df['Unit Price']
-        df['Net Value'] = df['Total Gross Value'] - df['Commission']
-        
-        return True, "", df
-        
+        return _prepare_trade_transactions(df)
+    
     except Exception as e:
         return False, f"Error processing trade transactions file: {str(e)}", None
+
+
+def _prepare_trade_transactions(df: pd.DataFrame) -> Tuple[bool, str, Any]:
+    """
+    Validate and type the columns of raw trade transactions.
+    
+    Args:
+        df: Trade transactions as read from the file
+    
+    Returns:
+        Tuple of (success, error_message, dataframe)
+    """
+    # Validate required columns
+    required_columns = TRADE_TRANSACTION_COLUMNS
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    
+    if missing_columns:
+        return False, f"Missing required columns: {', '.join(missing_columns)}", None
+    
+    # Convert date column to datetime
+    try:
+        df['Date'] = _parse_dates(df['Date'])
+    except Exception as e:
+        return False, f"Error converting date column: {str(e)}", None
+    
+    # Validate data types
+    try:
+        df['Quantity'] = pd.to_numeric(df['Quantity'])
+        df['Unit Price'] = pd.to_numeric(df['Unit Price'])
+        df['Commission'] = pd.to_numeric(df['Commission'])
+    except Exception as e:
+        return False, f"Error converting numeric columns: {str(e)}", None
+    
+    # Calculate derived columns
+    df['Total Gross Value'] = df['Quantity'] * df['Unit Price']
+    df['Net Value'] = df['Total Gross Value'] - df['Commission']
+    
+    _to_categories(df)
+    
+    return True, "", df
+
+
+def iter_trade_transaction_chunks(file: FileSource, chunk_size: int = 100000,
+                                  filename: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV trade transactions file in chunks for streaming calculations.
+    
+    The file must already be sorted by date. Each chunk is validated and typed
+    the same way as process_trade_transactions, and the date order is checked
+    within and across chunks.
+    
+    Args:
+        file: Path to the CSV file, an open binary file-like object, or its bytes
+        chunk_size: Number of rows per chunk
+        filename: Original file name, used to detect the format when file is not a path
+    
+    Yields:
+        Processed transaction DataFrames in file order
+    
+    Raises:
+        ValueError: If the file is not a CSV, fails validation, or is not sorted by date
+    """
+    if filename is None:
+        filename = file if isinstance(file, str) else getattr(file, 'name', '')
+    if not str(filename).lower().endswith('.csv'):
+        raise ValueError("Streaming mode requires a CSV transactions file.")
+    
+    if isinstance(file, (bytes, bytearray)):
+        file = io.BytesIO(file)
+    
+    last_date = None
+    rows_read = 0
+    # pyarrow cannot read in chunks, so streaming always uses the C parser
+    options = _csv_options(TRADE_TRANSACTION_COLUMNS, TRADE_TRANSACTION_DTYPES, 'c')
+    with pd.read_csv(file, chunksize=chunk_size, **options) as reader:
+        for chunk in reader:
+            success, error_msg, chunk = _prepare_trade_transactions(chunk)
+            if not success:
+                raise ValueError(error_msg)
+            
+            # Check the chunk is in order and continues on from the previous one
+            dates = chunk['Date']
+            out_of_order = dates.lt(dates.shift(fill_value=dates.iloc[0] if last_date is None else last_date))
+            if out_of_order.any():
+                row = rows_read + int(out_of_order.to_numpy().argmax()) + 1
+                raise ValueError(f"Transactions must be sorted by date for streaming mode (row {row} is out of order)")
+            
+            last_date = dates.iloc[-1]
+            rows_read += len(chunk)
+            yield chunk
@@ -0,0 +1,212 @@
+"""
+Reporting of request stage timings: Server-Timing headers, aggregated
+histograms for a /metrics endpoint, and opt-in per-request profiles.
+"""
+import os
+import time
+import uuid
+import bisect
+import cProfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Iterator, Callable
+
+from src.utils.stage_timer import StageTimer
+
+# pyinstrument is optional; cProfile is always available
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def server_timing(timer: StageTimer) -> str:
+    """
+    Format stage timings as a Server-Timing header value.
+    
+    Args:
+        timer: Timer of the request
+    
+    Returns:
+        One metric per stage with its wall time in milliseconds, and CPU time and rows as the description
+    """
+    metrics = []
+    for name, stage in timer.summary().items():
+        description = f"cpu={stage['cpu_seconds'] * 1000:.1f}ms"
+        if stage['rows'] is not None:
+            description += f" rows={stage['rows']}"
+        metrics.append(f'{name};dur={stage["wall_seconds"] * 1000:.1f};desc="{description}"')
+    return ', '.join(metrics)
+
+
+class StageMetrics:
+    """
+    Process-wide histograms of stage wall times, with CPU time and row totals, per endpoint.
+    """
+    
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Initialize empty metrics.
+        
+        Args:
+            buckets: Sorted upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (endpoint, stage) -> bucket counts (last one is +Inf), count, wall sum, CPU sum, rows sum
+        self._series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    
+    def observe(self, endpoint: str, timer: StageTimer) -> None:
+        """
+        Add the stages of one request.
+        
+        Args:
+            endpoint: Name of the endpoint that handled the request
+            timer: Timer of the request
+        """
+        with self._lock:
+            for name, stage in timer.summary().items():
+                series = self._series.get((endpoint, name))
+                if series is None:
+                    series = {'buckets': [0] * (len(self.buckets) + 1), 'count': 0, 'wall_seconds': 0.0,
+                              'cpu_seconds': 0.0, 'rows': 0}
+                    self._series[(endpoint, name)] = series
+                series['buckets'][bisect.bisect_left(self.buckets, stage['wall_seconds'])] += 1
+                series['count'] += 1
+                series['wall_seconds'] += stage['wall_seconds']
+                series['cpu_seconds'] += stage['cpu_seconds']
+                series['rows'] += stage['rows'] or 0
+    
+    def render(self) -> str:
+        """
+        Format the metrics in the Prometheus text exposition format.
+        
+        Returns:
+            Exposition text with a cumulative wall time histogram and CPU and row counters
+        """
+        lines = [
+            '# HELP stage_wall_seconds Wall-clock seconds spent in a request stage.',
+            '# TYPE stage_wall_seconds histogram',
+        ]
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self._series.items())
+        
+        for (endpoint, stage), values in series:
+            labels = f'endpoint="{endpoint}",stage="{stage}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'stage_wall_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'stage_wall_seconds_sum{{{labels}}} {values["wall_seconds"]}')
+            lines.append(f'stage_wall_seconds_count{{{labels}}} {values["count"]}')
+        
+        for metric, key, help_text in (('stage_cpu_seconds_total', 'cpu_seconds', 'CPU seconds spent in a request stage.'),
+                                       ('stage_rows_total', 'rows', 'Rows handled by a request stage.')):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for (endpoint, stage), values in series:
+                lines.append(f'{metric}{{endpoint="{endpoint}",stage="{stage}"}} {values[key]}')
+        
+        return '\n'.join(lines) + '\n'
+    
+    def clear(self) -> None:
+        """
+        Forget every observation.
+        """
+        with self._lock:
+            self._series.clear()
+
+
+def timed_stream(pieces: Iterable[Any], stage: str, on_close: Callable[[StageTimer], None]) -> Iterator[Any]:
+    """
+    Time the production of a streamed response body as a stage.
+    
+    A streamed body is generated after the view has returned and its headers
+    were sent, so its time cannot go into Server-Timing; it is timed on its own
+    timer, handed to on_close once the stream ends or is closed.
+    
+    Args:
+        pieces: Response body pieces, produced lazily
+        stage: Stage name to time each piece under
+        on_close: Callback receiving the timer when the stream is done
+    
+    Yields:
+        The pieces, unchanged
+    """
+    timer = StageTimer()
+    iterator = iter(pieces)
+    end = object()
+    try:
+        while True:
+            with timer.stage(stage):
+                piece = next(iterator, end)
+            if piece is end:
+                return
+            yield piece
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+        on_close(timer)
+
+
+def profilers() -> List[str]:
+    """
+    Get the profilers available in this installation.
+    
+    Returns:
+        Profiler names accepted by profiled
+    """
+    return ['cprofile', 'pyinstrument'] if pyinstrument is not None else ['cprofile']
+
+
+@contextmanager
+def profiled(profiler: str, directory: str, label: str) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Profile a block of the calling thread and write the profile to a file.
+    
+    cProfile profiles are written as .prof files for pstats or snakeviz;
+    pyinstrument profiles as self-contained .html pages.
+    
+    Args:
+        profiler: 'cprofile' or 'pyinstrument'
+        directory: Directory to write the profile to
+        label: Prefix of the profile file name
+    
+    Yields:
+        Dictionary whose 'path' is set to the written file once the block ends
+    
+    Raises:
+        ValueError: If the profiler is not available
+    """
+    if profiler not in profilers():
+        raise ValueError(f"Unknown or unavailable profiler: {profiler}")
+    
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    dump: Dict[str, Optional[str]] = {'path': None}
+    
+    if profiler == 'pyinstrument':
+        session = pyinstrument.Profiler()
+        session.start()
+        try:
+            yield dump
+        finally:
+            session.stop()
+            dump['path'] = stem + '.html'
+            with open(dump['path'], 'w') as f:
+                f.write(session.output_html())
+        return
+    
+    session = cProfile.Profile()
+    session.enable()
+    try:
+        yield dump
+    finally:
+        session.disable()
+        dump['path'] = stem + '.prof'
+        session.dump_stats(dump['path'])
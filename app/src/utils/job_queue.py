@@ -0,0 +1,228 @@
+"""
+In-process queue of background calculation jobs with progress reporting.
+
+Jobs run on a local thread pool, so no external broker is needed. Each job
+reports the stage it is in and the seconds spent in each finished stage, which
+clients can poll or follow as a stream. Job state can optionally be persisted
+to SQLite so that job ids survive a restart; jobs that were still queued or
+running when the process stopped are then reported as failed.
+"""
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, Tuple
+
+from src.utils.stage_timer import StageTimer
+
+# Job statuses; a job ends as either done or failed
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+class Job:
+    """
+    State of one background job.
+    """
+    
+    def __init__(self, job_id: str):
+        """
+        Initialize a queued job.
+        
+        Args:
+            job_id: Unique id of the job
+        """
+        self.job_id = job_id
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self.result: Optional[Dict[str, Any]] = None
+        self.error = ''
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the job state for clients.
+        
+        Returns:
+            Dictionary of the job id, status, current stage, stage timings, result and error
+        """
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': dict(self.stages),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+
+class JobQueue:
+    """
+    Thread pool of background jobs with progress, optionally persisted to SQLite.
+    
+    A job is a function taking a StageTimer and returning a response
+    dictionary with a 'success' flag; its stage timings are published as the
+    job runs. Finished jobs are kept in memory up to ``max_jobs``, and in the
+    database when one is configured.
+    """
+    
+    def __init__(self, workers: int = 2, db_path: Optional[str] = None, max_jobs: int = 1000):
+        """
+        Initialize the job queue.
+        
+        Args:
+            workers: Number of jobs run at the same time
+            db_path: Optional SQLite database file to persist job state in
+            max_jobs: Maximum number of jobs kept in memory
+        """
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._changed = threading.Condition()
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, state TEXT NOT NULL)")
+            self._fail_interrupted()
+    
+    def submit(self, func: Callable[[StageTimer], Dict[str, Any]]) -> str:
+        """
+        Queue a job.
+        
+        Args:
+            func: Function run as func(timer); it returns a dictionary with 'success'
+                and, on failure, 'error'
+        
+        Returns:
+            Job id to follow the job with
+        """
+        job = Job(uuid.uuid4().hex)
+        with self._changed:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest = next((job_id for job_id, queued in self._jobs.items() if queued.status in FINISHED), None)
+                if oldest is None:
+                    break
+                del self._jobs[oldest]
+            self._save(job)
+        
+        self._executor.submit(self._run, job, func)
+        return job.job_id
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the state of a job.
+        
+        Args:
+            job_id: Id returned by submit
+        
+        Returns:
+            Job state dictionary, or None if the job is unknown
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        return self._load(job_id)
+    
+    def wait(self, job_id: str, version: int, timeout: float) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        Wait until a job changes past a version.
+        
+        Args:
+            job_id: Id returned by submit
+            version: Last version the caller has seen (-1 for none)
+            timeout: Maximum seconds to wait
+        
+        Returns:
+            Tuple of (job state or None if unknown, its version); the version is
+            unchanged if the wait timed out
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                state = self._load(job_id)
+                return state, 0
+            self._changed.wait_for(lambda: job.version != version, timeout)
+            return job.to_dict(), job.version
+    
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop accepting jobs and optionally wait for the running ones.
+        
+        Args:
+            wait: Wait for queued and running jobs to finish
+        """
+        self._executor.shutdown(wait=wait)
+        if self._db is not None:
+            with self._changed:
+                self._db.close()
+                self._db = None
+    
+    def _run(self, job: Job, func: Callable[[StageTimer], Dict[str, Any]]) -> None:
+        """
+        Run a job on a worker thread, publishing its progress.
+        """
+        timer = StageTimer(listener=lambda stage: self._update(job, stage=stage, stages=dict(timer.timings)))
+        self._update(job, status=RUNNING)
+        
+        try:
+            response = func(timer)
+        except Exception as e:
+            response = {'success': False, 'error': f"Unexpected error: {str(e)}"}
+        
+        if response.get('success'):
+            self._update(job, status=DONE, stage=None, stages=dict(timer.timings), result=response)
+        else:
+            self._update(job, status=FAILED, stage=None, stages=dict(timer.timings),
+                         error=response.get('error', 'Job failed'))
+    
+    def _update(self, job: Job, **changes: Any) -> None:
+        """
+        Apply changes to a job and wake everyone waiting on it.
+        """
+        with self._changed:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            job.version += 1
+            self._save(job)
+            self._changed.notify_all()
+    
+    def _save(self, job: Job) -> None:
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO jobs (job_id, state) VALUES (?, ?)",
+                             (job.job_id, json.dumps(job.to_dict())))
+            self._db.commit()
+    
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self._db is None:
+            return None
+        with self._changed:
+            row = self._db.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def _fail_interrupted(self) -> None:
+        """
+        Mark jobs a previous process left queued or running as failed.
+        """
+        rows = self._db.execute("SELECT state FROM jobs").fetchall()
+        for (state,) in rows:
+            job = json.loads(state)
+            if job['status'] not in FINISHED:
+                job.update({'status': FAILED, 'stage': None, 'error': 'Interrupted by a restart',
+                            'updated_at': time.time()})
+                self._db.execute("UPDATE jobs SET state = ? WHERE job_id = ?", (json.dumps(job), job['job_id']))
+        self._db.commit()
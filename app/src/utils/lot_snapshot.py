@@ -0,0 +1,77 @@
+"""
+Lot-level closing balance snapshots for rolling a year over into the next.
+
+The aggregated closing balance keeps one row per symbol, which loses the FIFO
+order and the cost of each lot. A lot snapshot keeps every open lot, in FIFO
+order, with its quantity, remaining cost and acquisition date, in a compressed
+.npz file. Loaded as the next year's opening balance it gives each lot back to
+the FIFO engine unchanged, so years can be chained without replaying the
+trade history from inception.
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+from typing import Union, BinaryIO
+
+# Columns of a lot-level closing balance, also accepted as a multi-lot opening balance
+LOT_COLUMNS = ['Symbol', 'Quantity', 'Total Cost in AUD', 'Acquired']
+
+LOT_SNAPSHOT_VERSION = 1
+LOT_SNAPSHOT_EXTENSION = '.npz'
+
+
+def write_lot_snapshot(target: Union[str, BinaryIO], lots: pd.DataFrame) -> None:
+    """
+    Write a lot-level closing balance snapshot.
+    
+    Args:
+        target: File path (written atomically) or binary file-like object
+        lots: DataFrame with LOT_COLUMNS, one row per open lot in FIFO order
+    """
+    arrays = {
+        'version': np.array(LOT_SNAPSHOT_VERSION),
+        'symbol': np.array([str(symbol) for symbol in lots['Symbol'].tolist()], dtype=str),
+        # Whole-share quantities stay integers so the next year reports them unchanged
+        'quantity': np.asarray(lots['Quantity'].tolist()) if len(lots) else np.zeros(0),
+        'total_cost': lots['Total Cost in AUD'].to_numpy(dtype='float64'),
+        'acquired': pd.to_datetime(lots['Acquired']).to_numpy(dtype='datetime64[D]'),
+    }
+    
+    if not isinstance(target, str):
+        np.savez_compressed(target, **arrays)
+        return
+    
+    with open(target + '.tmp', 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(target + '.tmp', target)
+
+
+def read_lot_snapshot(source: Union[str, BinaryIO, bytes]) -> pd.DataFrame:
+    """
+    Read a lot-level closing balance snapshot as an opening balance.
+    
+    Args:
+        source: File path, binary file-like object or file bytes
+    
+    Returns:
+        DataFrame with LOT_COLUMNS; 'Acquired' is YYYY-MM-DD or None
+    
+    Raises:
+        ValueError: If the file is not a lot snapshot of a supported version
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    
+    with np.load(source) as data:
+        if 'version' not in data.files or int(data['version']) != LOT_SNAPSHOT_VERSION:
+            raise ValueError("Not a lot snapshot of a supported version")
+        
+        acquired = pd.DatetimeIndex(data['acquired'])
+        return pd.DataFrame({
+            'Symbol': data['symbol'].tolist(),
+            'Quantity': data['quantity'],
+            'Total Cost in AUD': data['total_cost'],
+            'Acquired': [None if pd.isna(date) else date.strftime('%Y-%m-%d') for date in acquired],
+        }, columns=LOT_COLUMNS)
+
@@ -0,0 +1,255 @@
+"""
+Binary snapshots of compiled RBA rate tables for fast, shared startup.
+
+A snapshot is a directory holding a sorted epoch-day date array, a dense
+(dates x currencies) float64 rate matrix, both saved as .npy files, and a
+manifest describing the currencies and the source CSV files. Readers map the
+arrays with numpy.memmap, so every worker process shares the same pages and
+nothing is parsed at startup.
+
+Build a snapshot from the app directory with:
+    python -m src.utils.rate_snapshot SNAPSHOT_DIR f11.1-data.csv [older F11 files...]
+
+The files may be listed in any order; where their dates overlap, the rates of
+the file with the latest data win.
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+from datetime import datetime
+from typing import Tuple, Dict, Any, List, Optional
+
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Compute the SHA-256 hash of a file's contents.
+    
+    Args:
+        file_path: Path to the file
+    
+    Returns:
+        Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    """
+    Compute the SHA-256 hash of file contents held in memory.
+    
+    Args:
+        data: File contents
+    
+    Returns:
+        Hex digest, equal to hash_file of a file with these contents
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def _describe_source(file_path: str) -> Dict[str, Any]:
+    """
+    Record the identity of a source file so staleness can be checked later.
+    """
+    stat = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': hash_file(file_path),
+    }
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    """
+    Save an array by writing a new file and renaming it over the old one, so
+    processes that have the old file mapped are never affected.
+    """
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def write_snapshot(snapshot_dir: str, dates: np.ndarray, rates: np.ndarray, currencies: List[str],
+                   source_files: List[str]) -> Dict[str, Any]:
+    """
+    Write a rate snapshot.
+    
+    The arrays are written under names derived from the source hashes and the
+    manifest is replaced last, so a reader sees either the previous snapshot or
+    the new one, never a mix. The arrays of the previous snapshot are kept, so
+    a reader that has just read the previous manifest can still load them; only
+    older generations are removed.
+    
+    Args:
+        snapshot_dir: Directory to write the snapshot into
+        dates: Sorted rate dates (anything convertible to datetime64[D])
+        rates: Rate matrix aligned with dates and currencies
+        currencies: Currency code of each matrix column
+        source_files: CSV files the table was compiled from
+    
+    Returns:
+        The manifest that was written
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    
+    sources = [_describe_source(path) for path in source_files]
+    content_hash = hashlib.sha256(''.join(s['sha256'] for s in sources).encode()).hexdigest()
+    
+    # Dates are stored as int64 days since the epoch, which views as datetime64[D]
+    epoch_days = np.asarray(dates, dtype='datetime64[D]').astype('int64')
+    rate_matrix = np.ascontiguousarray(rates, dtype='float64')
+    
+    dates_file = f"dates-{content_hash[:16]}.npy"
+    rates_file = f"rates-{content_hash[:16]}.npy"
+    _save_array(os.path.join(snapshot_dir, dates_file), epoch_days)
+    _save_array(os.path.join(snapshot_dir, rates_file), rate_matrix)
+    
+    previous = read_manifest(snapshot_dir)
+    
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'built_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'content_hash': content_hash,
+        'rows': int(len(epoch_days)),
+        'currencies': list(currencies),
+        'dates_file': dates_file,
+        'rates_file': rates_file,
+        'sources': sources,
+    }
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    
+    # Keep this and the previous generation; processes that already mapped an
+    # older one keep reading it, as removing a file does not unmap it
+    keep = {dates_file, rates_file}
+    if previous is not None:
+        keep.update(previous.get(key) for key in ('dates_file', 'rates_file'))
+    for name in os.listdir(snapshot_dir):
+        if name.startswith(('dates-', 'rates-')) and name.endswith('.npy') and name not in keep:
+            try:
+                os.remove(os.path.join(snapshot_dir, name))
+            except OSError:
+                pass
+    
+    return manifest
+
+
+def read_manifest(snapshot_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a snapshot manifest.
+    
+    Args:
+        snapshot_dir: Snapshot directory
+    
+    Returns:
+        Manifest dictionary, or None if there is no readable snapshot of this version
+    """
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def source_signature(manifest: Dict[str, Any]) -> Optional[Tuple[Tuple[int, float], ...]]:
+    """
+    Get the current (size, mtime) of every source file of a snapshot.
+    
+    Args:
+        manifest: Snapshot manifest
+    
+    Returns:
+        Tuple of (size, mtime) pairs, or None if a source file is missing
+    """
+    signature = []
+    for source in manifest['sources']:
+        try:
+            stat = os.stat(source['path'])
+        except OSError:
+            return None
+        signature.append((stat.st_size, stat.st_mtime))
+    return tuple(signature)
+
+
+def is_fresh(manifest: Dict[str, Any]) -> bool:
+    """
+    Check whether every source file of a snapshot is unchanged.
+    
+    Sources with the recorded size and mtime are taken as unchanged. Any other
+    source is hashed, so a file that was only touched does not make the
+    snapshot stale.
+    
+    Args:
+        manifest: Snapshot manifest
+    
+    Returns:
+        True if the snapshot still matches its sources
+    """
+    signature = source_signature(manifest)
+    if signature is None:
+        return False
+    
+    for source, (size, mtime) in zip(manifest['sources'], signature):
+        if size == source['size'] and mtime == source['mtime']:
+            continue
+        if size != source['size'] or hash_file(source['path']) != source['sha256']:
+            return False
+    return True
+
+
+def load_arrays(snapshot_dir: str, manifest: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Map the date and rate arrays of a snapshot read-only.
+    
+    Args:
+        snapshot_dir: Snapshot directory
+        manifest: Manifest read from the directory
+    
+    Returns:
+        Tuple of (datetime64[D] dates, rate matrix), both backed by numpy.memmap
+    
+    Raises:
+        ValueError: If the arrays do not match the manifest
+    """
+    epoch_days = np.load(os.path.join(snapshot_dir, manifest['dates_file']), mmap_mode='r')
+    rates = np.load(os.path.join(snapshot_dir, manifest['rates_file']), mmap_mode='r')
+    
+    if rates.shape != (manifest['rows'], len(manifest['currencies'])) or len(epoch_days) != manifest['rows']:
+        raise ValueError(f"Rate snapshot in {snapshot_dir} does not match its manifest")
+    
+    return epoch_days.view('datetime64[D]'), rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile RBA F11 rate files into a binary snapshot.")
+    parser.add_argument('snapshot_dir', help='Directory to write the snapshot into')
+    parser.add_argument('sources', nargs='+', help='F11 CSV files in any order; the newest file wins on overlapping dates')
+    args = parser.parse_args()
+    
+    # Imported here because rba_rates imports this module
+    from src.utils.rba_rates import compile_rate_snapshot
+    
+    manifest = compile_rate_snapshot(args.sources, args.snapshot_dir)
+    print(f"Wrote {manifest['rows']} rate rows x {len(manifest['currencies'])} currencies "
+          f"to {args.snapshot_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,616 @@
 """
 RBA exchange rate fetching and currency conversion utilities.
 """
+import io
 import os
+import csv
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 import requests
 from datetime import datetime, timedelta
-from typing import Tuple, Dict, Any, Optional
+from typing import Tuple, Dict, Any, Optional, Callable, List, Union
+
+from src.utils import rate_snapshot
+from src.utils.rate_snapshot import hash_file, hash_bytes
+
+# Date format used in the RBA F11.1 files, e.g. 03-Jan-2023
+RBA_DATE_FORMAT = '%d-%b-%Y'
+
+
+class RateTable:
+    """
+    Immutable, parsed snapshot of an RBA rates file.
+    
+    A table is shared read-only by every calculator and request thread in the
+    process, so nothing may modify ``rates_data`` after construction.
+    
+    Alongside the dataframe the table keeps a lookup index: a sorted date array
+    and a dense (dates x currencies) float matrix, so "latest rate on or before
+    a date" is a binary search rather than a dataframe filter. Rows with no
+    valid rate in any currency were already dropped by ``_process_rba_data``,
+    so the search falls back to the previous published day on its own.
+    
+    Tables loaded from a binary snapshot only have the index, mapped from disk;
+    their ``rates_data`` dataframe is built from it on first access.
+    """
+    
+    def __init__(self, rates_data: pd.DataFrame, source_file: str, content_hash: str,
+                 load_seconds: float):
+        """
+        Initialize a rate table.
+        
+        Args:
+            rates_data: Processed rates dataframe (Date plus currency columns)
+            source_file: Path of the file the table was parsed from
+            content_hash: SHA-256 of the source file contents
+            load_seconds: Wall time taken to read and process the file
+        """
+        self._rates_data = rates_data
+        self.source_file = source_file
+        self.content_hash = content_hash
+        self.load_seconds = load_seconds
+        self.loaded_at = datetime.now()
+        
+        # Build the as-of lookup index (stable sort keeps the last duplicate date last)
+        ordered = rates_data.sort_values('Date', kind='stable')
+        self.currencies = {col: i for i, col in enumerate(c for c in ordered.columns if c != 'Date')}
+        self.dates = ordered['Date'].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+        self.rates = ordered[list(self.currencies)].to_numpy(dtype='float64', na_value=np.nan)
+        
+        # Zero rates are treated the same as missing ones
+        self.rates[self.rates == 0] = np.nan
+        self.dates.flags.writeable = False
+        self.rates.flags.writeable = False
+        
+        self.memory_bytes = int(rates_data.memory_usage(deep=True).sum()) + self.dates.nbytes + self.rates.nbytes
+    
+    @classmethod
+    def from_arrays(cls, dates: np.ndarray, rates: np.ndarray, currencies: List[str], source_file: str,
+                    content_hash: str, load_seconds: float) -> 'RateTable':
+        """
+        Create a table directly from a prepared index, e.g. a mapped snapshot.
+        
+        Args:
+            dates: Sorted datetime64[D] rate dates
+            rates: Rate matrix with NaN for missing rates, aligned with dates and currencies
+            currencies: Currency code of each matrix column
+            source_file: Path the index was loaded from
+            content_hash: Hash identifying the source contents
+            load_seconds: Wall time taken to load the index
+        
+        Returns:
+            RateTable whose dataframe is built lazily
+        """
+        table = cls.__new__(cls)
+        table._rates_data = None
+        table.source_file = source_file
+        table.content_hash = content_hash
+        table.load_seconds = load_seconds
+        table.loaded_at = datetime.now()
+        table.currencies = {code: i for i, code in enumerate(currencies)}
+        table.dates = dates
+        table.rates = rates
+        table.memory_bytes = dates.nbytes + rates.nbytes
+        return table
+    
+    @property
+    def rates_data(self) -> pd.DataFrame:
+        """
+        Processed rates dataframe (Date plus currency columns).
+        """
+        if self._rates_data is None:
+            rates_data = pd.DataFrame(np.array(self.rates), columns=list(self.currencies))
+            rates_data.insert(0, 'Date', self.dates.astype('datetime64[ns]'))
+            self._rates_data = rates_data
+        return self._rates_data
+    
+    def extended(self, new_rates_data: pd.DataFrame, content_hash: str, load_seconds: float) -> 'RateTable':
+        """
+        Create a new table with rows dated after this table's last date appended.
+        
+        The existing index is copied and extended rather than rebuilt, and this
+        table is left untouched, so readers holding it are unaffected.
+        
+        Args:
+            new_rates_data: Processed rows to append, all dated after the last date
+            content_hash: Hash identifying the new source contents
+            load_seconds: Wall time taken to fetch and parse the new rows
+        
+        Returns:
+            Extended RateTable
+        
+        Raises:
+            ValueError: If the new rows are not after the last date or add a currency
+        """
+        new_rows = RateTable(new_rates_data, self.source_file, content_hash, load_seconds)
+        if len(self.dates) and len(new_rows.dates) and new_rows.dates[0] <= self.dates[-1]:
+            raise ValueError("New rates must be dated after the last loaded rate")
+        
+        unknown = [code for code in new_rows.currencies if code not in self.currencies]
+        if unknown:
+            raise ValueError(f"New rates include unknown currencies: {', '.join(unknown)}")
+        
+        # Align the new rows to this table's currency columns
+        block = np.full((len(new_rows.dates), len(self.currencies)), np.nan)
+        block[:, [self.currencies[code] for code in new_rows.currencies]] = new_rows.rates
+        
+        dates = np.concatenate([self.dates, new_rows.dates])
+        rates = np.concatenate([self.rates, block])
+        dates.flags.writeable = False
+        rates.flags.writeable = False
+        return RateTable.from_arrays(dates, rates, list(self.currencies), self.source_file,
+                                     content_hash, self.load_seconds + load_seconds)
+    
+    def position(self, date: datetime) -> int:
+        """
+        Find the index row of the latest rate date on or before a date.
+        
+        Args:
+            date: Date to look up
+        
+        Returns:
+            Row position in ``dates``/``rates``, or -1 if the date precedes all rates
+        """
+        key = pd.Timestamp(date).to_datetime64().astype('datetime64[D]')
+        return int(np.searchsorted(self.dates, key, side='right')) - 1
+
+
+class RateStore:
+    """
+    Process-wide store of parsed rate tables, keyed by source file.
+    
+    Each file is parsed once and then reused until its mtime changes. A changed
+    mtime triggers a content hash check, and the file is only re-parsed when the
+    contents actually differ. Binary snapshots are kept in the same store,
+    keyed by their directory.
+    """
+    
+    def __init__(self):
+        """
+        Initialize an empty rate store.
+        """
+        self._lock = threading.Lock()
+        self._tables: Dict[str, RateTable] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+        self._signatures: Dict[str, Any] = {}
+    
+    def get_table(self, file_path: str, loader: Callable[[str], pd.DataFrame]) -> RateTable:
+        """
+        Get the rate table for a file, loading it if missing or changed on disk.
+        
+        Args:
+            file_path: Path to the rates file
+            loader: Function that reads and processes the file into a dataframe
+        
+        Returns:
+            Shared RateTable for the file
+        """
+        key = os.path.abspath(file_path)
+        mtime = os.path.getmtime(key)
+        
+        # Fast path: unchanged mtime, no locking needed for a dict read
+        table = self._tables.get(key)
+        if table is not None and self._mtimes.get(key) == mtime:
+            self._stats[key]['hits'] += 1
+            return table
+        
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None and self._mtimes.get(key) == mtime:
+                self._stats[key]['hits'] += 1
+                return table
+            
+            content_hash = hash_file(key)
+            if table is not None and table.content_hash == content_hash:
+                # Touched but not modified, keep the parsed table
+                self._mtimes[key] = mtime
+                self._stats[key]['hits'] += 1
+                return table
+            
+            start = time.perf_counter()
+            rates_data = loader(key)
+            table = RateTable(rates_data, key, content_hash, time.perf_counter() - start)
+            
+            self._tables[key] = table
+            self._mtimes[key] = mtime
+            stats = self._stats.setdefault(key, {'loads': 0, 'hits': 0})
+            stats['loads'] += 1
+            return table
+    
+    def put_table(self, file_path: str, table: RateTable) -> None:
+        """
+        Install a new version of a file's table, e.g. after an incremental refresh.
+        
+        Readers switch to the new table on their next lookup; tables already
+        handed out are not modified.
+        
+        Args:
+            file_path: Path to the rates file the table now reflects
+            table: New rate table
+        """
+        key = os.path.abspath(file_path)
+        with self._lock:
+            self._tables[key] = table
+            self._mtimes[key] = os.path.getmtime(key)
+            self._stats.setdefault(key, {'loads': 0, 'hits': 0})
+    
+    def get_snapshot(self, snapshot_dir: str) -> Optional[RateTable]:
+        """
+        Get the rate table mapped from a binary snapshot, if it is still fresh.
+        
+        The snapshot is mapped once and reused while neither its manifest nor any
+        of its source files change on disk.
+        
+        Args:
+            snapshot_dir: Directory written by compile_rate_snapshot
+        
+        Returns:
+            Shared RateTable for the snapshot, or None if it is missing or stale
+        """
+        key = os.path.abspath(snapshot_dir)
+        manifest_path = os.path.join(key, rate_snapshot.MANIFEST_NAME)
+        try:
+            manifest_mtime = os.path.getmtime(manifest_path)
+        except OSError:
+            return None
+        
+        # Fast path: same manifest and unchanged source files
+        table = self._tables.get(key)
+        if table is not None and self._mtimes.get(key) == manifest_mtime:
+            if rate_snapshot.source_signature(self._manifests[key]) == self._signatures.get(key):
+                self._stats[key]['hits'] += 1
+                return table
+        
+        with self._lock:
+            manifest = rate_snapshot.read_manifest(key)
+            if manifest is None or not rate_snapshot.is_fresh(manifest):
+                return None
+            
+            table = self._tables.get(key)
+            if table is not None and table.content_hash == manifest['content_hash']:
+                self._stats[key]['hits'] += 1
+            else:
+                start = time.perf_counter()
+                try:
+                    dates, rates = rate_snapshot.load_arrays(key, manifest)
+                except FileNotFoundError:
+                    # A writer replaced the snapshot after the manifest was read; read the new one
+                    manifest = rate_snapshot.read_manifest(key)
+                    if manifest is None:
+                        return None
+                    dates, rates = rate_snapshot.load_arrays(key, manifest)
+                table = RateTable.from_arrays(dates, rates, manifest['currencies'], manifest_path,
+                                              manifest['content_hash'], time.perf_counter() - start)
+                self._tables[key] = table
+                stats = self._stats.setdefault(key, {'loads': 0, 'hits': 0})
+                stats['loads'] += 1
+            
+            self._mtimes[key] = manifest_mtime
+            self._manifests[key] = manifest
+            self._signatures[key] = rate_snapshot.source_signature(manifest)
+            return table
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get load statistics for every table in the store.
+        
+        Returns:
+            Dictionary keyed by source file with load time, memory size and counters
+        """
+        result = {}
+        for key, table in list(self._tables.items()):
+            result[key] = {
+                'rows': len(table.dates),
+                'load_seconds': table.load_seconds,
+                'memory_bytes': table.memory_bytes,
+                'content_hash': table.content_hash,
+                'loaded_at': table.loaded_at.strftime('%Y-%m-%d %H:%M:%S'),
+                'loads': self._stats[key]['loads'],
+                'hits': self._stats[key]['hits'],
+            }
+        return result
+    
+    def clear(self) -> None:
+        """
+        Drop all cached tables so the next lookup re-reads from disk.
+        """
+        with self._lock:
+            self._tables.clear()
+            self._mtimes.clear()
+            self._stats.clear()
+            self._manifests.clear()
+            self._signatures.clear()
+
+
+def _parse_rba_dates(raw_dates: pd.Series) -> pd.Series:
+    """
+    Parse RBA dates, inferring the format for any values that do not match the
+    RBA format. Unparseable values become NaT.
+    
+    Args:
+        raw_dates: Raw date values
+    
+    Returns:
+        Datetime series
+    """
+    dates = pd.to_datetime(raw_dates, format=RBA_DATE_FORMAT, errors='coerce')
+    unparsed = dates.isna() & raw_dates.notna()
+    if unparsed.any():
+        dates[unparsed] = pd.to_datetime(raw_dates[unparsed], errors='coerce')
+    return dates
+
+
+# Shared by every RBAExchangeRates instance in the process
+_rate_store = RateStore()
+
+# Serialises incremental refreshes so two cannot extend the same table version
+_refresh_lock = threading.Lock()
+
+
+def get_rate_store() -> RateStore:
+    """
+    Get the process-wide rate store.
+    
+    Returns:
+        The shared RateStore instance
+    """
+    return _rate_store
+
+
+class RatePeriods:
+    """
+    Registry of rate files that each cover one period of history.
+    
+    Registering a file only scans its date column to learn the period it
+    covers. A period is fully parsed the first time a lookup needs it and is
+    then kept in a bounded LRU cache, so calculating one financial year does
+    not hold decades of history in memory.
+    """
+    
+    def __init__(self, loader: Callable[[str], pd.DataFrame], max_loaded: int = 2):
+        """
+        Initialize an empty period registry.
+        
+        Args:
+            loader: Function that reads and processes a rates file into a dataframe
+            max_loaded: Maximum number of parsed periods kept in memory
+        """
+        self.loader = loader
+        self.max_loaded = max_loaded
+        self._lock = threading.Lock()
+        self._files: List[str] = []
+        self._starts = np.array([], dtype='datetime64[D]')
+        self._ends = np.array([], dtype='datetime64[D]')
+        self._loaded: 'OrderedDict[str, RateTable]' = OrderedDict()
+        self._stats = {'loads': 0, 'hits': 0, 'evictions': 0}
+    
+    def register(self, file_path: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> None:
+        """
+        Register a rates file covering a period.
+        
+        Args:
+            file_path: Path to the rates file
+            start: First rate date in the file (scanned from the file if omitted)
+            end: Last rate date in the file (scanned from the file if omitted)
+        """
+        file_path = os.path.abspath(file_path)
+        if start is None or end is None:
+            raw_dates = pd.read_csv(file_path, skiprows=10, usecols=['Series ID'], dtype='str')['Series ID']
+            dates = _parse_rba_dates(raw_dates).dropna()
+            if dates.empty:
+                raise ValueError(f"No rate dates found in {file_path}")
+            start = dates.min() if start is None else start
+            end = dates.max() if end is None else end
+        
+        with self._lock:
+            if file_path in self._files:
+                index = self._files.index(file_path)
+                del self._files[index]
+                self._starts = np.delete(self._starts, index)
+                self._ends = np.delete(self._ends, index)
+                self._loaded.pop(file_path, None)
+            
+            # Keep the periods ordered by start date
+            start_key = np.datetime64(pd.Timestamp(start).date(), 'D')
+            index = int(np.searchsorted(self._starts, start_key, side='right'))
+            self._files.insert(index, file_path)
+            self._starts = np.insert(self._starts, index, start_key)
+            self._ends = np.insert(self._ends, index, np.datetime64(pd.Timestamp(end).date(), 'D'))
+    
+    def __len__(self) -> int:
+        return len(self._files)
+    
+    def signature(self) -> Tuple[Tuple[str, int, float], ...]:
+        """
+        Identify the registered period files by path, size and modification time.
+        
+        Returns:
+            Tuple of (path, size, mtime) per period in start date order
+        """
+        signature = []
+        for file_path in list(self._files):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                signature.append((file_path, -1, 0.0))
+                continue
+            signature.append((file_path, stat.st_size, stat.st_mtime))
+        return tuple(signature)
+    
+    def table(self, index: int) -> RateTable:
+        """
+        Get the parsed table of a registered period, loading it if necessary.
+        
+        Args:
+            index: Position of the period in start date order
+        
+        Returns:
+            RateTable for the period
+        """
+        file_path = self._files[index]
+        with self._lock:
+            table = self._loaded.get(file_path)
+            if table is not None:
+                self._loaded.move_to_end(file_path)
+                self._stats['hits'] += 1
+                return table
+            
+            start = time.perf_counter()
+            rates_data = self.loader(file_path)
+            table = RateTable(rates_data, file_path, hash_file(file_path), time.perf_counter() - start)
+            
+            self._loaded[file_path] = table
+            self._stats['loads'] += 1
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+                self._stats['evictions'] += 1
+            return table
+    
+    def table_for(self, date: datetime) -> Optional[RateTable]:
+        """
+        Get the period table holding the latest rate on or before a date.
+        
+        Args:
+            date: Date to look up
+        
+        Returns:
+            RateTable, or None if the date precedes every registered period
+        """
+        key = pd.Timestamp(date).to_datetime64().astype('datetime64[D]')
+        index = int(np.searchsorted(self._starts, key, side='right')) - 1
+        
+        # A date before a period's first published rate falls back to the previous period
+        while index >= 0:
+            table = self.table(index)
+            if table.position(date) >= 0:
+                return table
+            index -= 1
+        return None
+    
+    def lookup_batch(self, date_keys: np.ndarray, codes: np.ndarray, uniques: Any) -> np.ndarray:
+        """
+        Look up rates for many dates, loading only the periods they fall in.
+        
+        Args:
+            date_keys: datetime64[D] dates
+            codes: Factorized currency code of each date (-1 when missing)
+            uniques: Currency code for each factorized value
+        
+        Returns:
+            Float array of rates aligned with the dates, NaN where there is none
+        """
+        rates = np.full(len(date_keys), np.nan)
+        periods = np.searchsorted(self._starts, date_keys, side='right') - 1
+        pending = periods >= 0
+        
+        while pending.any():
+            for index in np.unique(periods[pending])[::-1]:
+                selected = np.flatnonzero(pending & (periods == index))
+                found_rates, rows = _lookup_batch(self.table(int(index)), date_keys[selected],
+                                                  codes[selected], uniques)
+                resolved = rows >= 0
+                rates[selected[resolved]] = found_rates[resolved]
+                pending[selected[resolved]] = False
+                # Dates before the period's first published rate move to the previous period
+                periods[selected[~resolved]] -= 1
+            pending &= periods >= 0
+        
+        return rates
+    
+    def prefetch(self, start: datetime, end: datetime) -> int:
+        """
+        Load every period needed for lookups between two dates.
+        
+        Args:
+            start: First date that will be looked up
+            end: Last date that will be looked up
+        
+        Returns:
+            Number of periods loaded or already in memory for the span
+        """
+        first = int(np.searchsorted(self._starts, np.datetime64(pd.Timestamp(start).date(), 'D'), side='right')) - 1
+        last = int(np.searchsorted(self._starts, np.datetime64(pd.Timestamp(end).date(), 'D'), side='right')) - 1
+        
+        # Include the previous period too, for dates before a period's first rate
+        indexes = range(max(first - 1, 0), last + 1)
+        for index in indexes:
+            self.table(index)
+        return len(indexes)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the registered periods and cache counters.
+        
+        Returns:
+            Dictionary with one entry per period and the load, hit and eviction counts
+        """
+        return {
+            'periods': [{'file': file_path, 'start': str(start), 'end': str(end),
+                         'loaded': file_path in self._loaded}
+                        for file_path, start, end in zip(self._files, self._starts, self._ends)],
+            'max_loaded': self.max_loaded,
+            **self._stats,
+        }
+
+
+def _series_header(rows: List[List[str]]) -> int:
+    """
+    Find the Series ID header row of a parsed RBA rates file.
+    
+    Raises:
+        ValueError: If the file has no Series ID row
+    """
+    for i, row in enumerate(rows):
+        if row and row[0] == 'Series ID':
+            return i
+    raise ValueError("Rates file has no Series ID row")
+
+
+def lookup_hit_ratio(stats: Dict[str, int]) -> Optional[float]:
+    """
+    Get the share of batch lookup rows that reused an already resolved (date, currency) pair.
+    
+    Args:
+        stats: Dictionary of 'rows' and 'unique_pairs' counts
+    
+    Returns:
+        Ratio between 0 and 1, or None before any row was looked up
+    """
+    rows = stats.get('rows', 0)
+    return 1 - stats.get('unique_pairs', 0) / rows if rows else None
+
+
+def _lookup_batch(table: RateTable, date_keys: np.ndarray, codes: np.ndarray,
+                  uniques: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Look up factorized (date, currency) pairs in one rate table.
+    
+    Args:
+        table: Rate table to search
+        date_keys: datetime64[D] dates
+        codes: Factorized currency code of each date (-1 when missing)
+        uniques: Currency code for each factorized value
+    
+    Returns:
+        Tuple of (rates with NaN where not found, matched index rows with -1
+        for dates before the table's first rate)
+    """
+    # Map each distinct currency to its matrix column (-1 when unknown)
+    unique_columns = np.array([table.currencies.get(c, -1) for c in uniques], dtype='int64')
+    columns = np.where(codes >= 0, unique_columns[codes] if len(uniques) else -1, -1)
+    
+    # One binary search for all rows
+    rows = np.searchsorted(table.dates, date_keys, side='right') - 1
+    
+    rates = np.full(len(date_keys), np.nan)
+    found = (rows >= 0) & (columns >= 0)
+    rates[found] = table.rates[rows[found], columns[found]]
+    return rates, rows
 
 
 class RBAExchangeRates:
@@ -13,21 +618,44 @@ class RBAExchangeRates:
     Class for fetching and processing RBA exchange rates.
     """
     
-    def __init__(self):
+    def __init__(self, rate_store: Optional[RateStore] = None, snapshot_dir: Optional[str] = None):
         """
         Initialize RBA exchange rates.
+        
+        Args:
+            rate_store: Store to load rate tables from (defaults to the shared process store)
+            snapshot_dir: Optional binary rate snapshot to use while it is fresh
         """
-        self.rates_data = None
+        self.rate_store = rate_store if rate_store is not None else _rate_store
+        self.snapshot_dir = snapshot_dir
+        self.periods: Optional[RatePeriods] = None
+        self.rate_table = None
         self.rba_url = "https://www.rba.gov.au/statistics/tables/csv/f11.1-data.csv"
+        # Where refresh_rates fetches from: the RBA URL, a local directory or a file
+        self.rate_source = self.rba_url
         # Corrected path to match actual file location
         self.local_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 
                                       "../sample_data", "f11.1-data.csv")
         self.last_updated = None
+        self._lookup_lock = threading.Lock()
+        self._lookups = {'batches': 0, 'rows': 0, 'unique_pairs': 0}
+    
+    @property
+    def rates_data(self) -> Optional[pd.DataFrame]:
+        """
+        Processed rates dataframe of the current rate table, or None before loading.
+        """
+        return self.rate_table.rates_data if self.rate_table is not None else None
     
     def fetch_rates(self) -> Tuple[bool, str]:
         """
         Fetch exchange rates from local file.
         
+        The parsed table is shared through the rate store, so this only reads
+        the file the first time or after it has changed on disk. When a snapshot
+        directory is set and its snapshot was compiled from the local file, which
+        is unchanged, the snapshot is mapped instead of parsing the CSV.
+        
         Returns:
             Tuple of (success, error_message)
         """
@@ -36,27 +664,271 @@ class RBAExchangeRates:
             if not os.path.exists(self.local_file):
                 return False, f"Local file not found: {self.local_file}"
             
-            # Read the CSV file, skipping to row 11 which contains the header
-            df = pd.read_csv(self.local_file, skiprows=10)
+            table = self._snapshot_table()
+            if table is None:
+                table = self.rate_store.get_table(self.local_file, self._load_rates_file)
             
-            # Process the dataframe to clean up column names and format data
-            df = self._process_rba_data(df)
-            
-            self.rates_data = df
-            self.last_updated = datetime.now()
+            self.rate_table = table
+            self.last_updated = table.loaded_at
             
             return True, ""
         
         except Exception as e:
             return False, f"Error fetching exchange rates: {str(e)}"
     
+    def rates_version(self) -> str:
+        """
+        Identify the rate data lookups currently use, for keying cached calculations.
+        
+        The version changes whenever the local table is reloaded with different
+        contents, extended by a refresh, or a history period file is registered
+        or modified.
+        
+        Returns:
+            Hex digest of the loaded table's content hash and the history period files
+        """
+        if self.rate_table is None:
+            self.fetch_rates()
+        content_hash = self.rate_table.content_hash if self.rate_table is not None else ''
+        periods = self.periods.signature() if self.periods is not None else ()
+        return hash_bytes(repr((content_hash, periods)).encode())
+    
+    def register_period_file(self, file_path: str, start: Optional[datetime] = None,
+                             end: Optional[datetime] = None, max_loaded: int = 2) -> None:
+        """
+        Register an historical F11 file for dates before the local file's first rate.
+        
+        Args:
+            file_path: Path to the historical rates file
+            start: First rate date in the file (scanned from the file if omitted)
+            end: Last rate date in the file (scanned from the file if omitted)
+            max_loaded: Maximum number of parsed periods kept in memory
+        """
+        if self.periods is None:
+            self.periods = RatePeriods(self._load_rates_file, max_loaded)
+        self.periods.register(file_path, start, end)
+    
+    def prefetch_rates(self, start: datetime, end: datetime) -> int:
+        """
+        Load every historical period needed for lookups between two dates.
+        
+        Args:
+            start: First date that will be looked up
+            end: Last date that will be looked up
+        
+        Returns:
+            Number of history periods in memory for the span (0 without history)
+        """
+        if self.rate_table is None:
+            self.fetch_rates()
+        if self.periods is None or self.rate_table is None:
+            return 0
+        
+        # Periods are only consulted for dates before the local file
+        if len(self.rate_table.dates) and pd.Timestamp(start) >= pd.Timestamp(self.rate_table.dates[0]):
+            return 0
+        end = min(pd.Timestamp(end), pd.Timestamp(self.rate_table.dates[0])) if len(self.rate_table.dates) else end
+        return self.periods.prefetch(start, end)
+    
+    def refresh_rates(self, source: Optional[str] = None) -> Tuple[bool, str, int]:
+        """
+        Incrementally add rates published since the last loaded rate date.
+        
+        The source file is fetched and only rows dated after the current table's
+        last date are parsed and appended to the index. The same rows are appended
+        to the local file, which keeps its history even when the source only covers
+        the current period, and the snapshot is rewritten if it is in use, so the
+        next process starts from the same data. Readers switch to the new table
+        atomically through the rate store.
+        
+        Args:
+            source: HTTP(S) URL, local directory or file to fetch from (defaults to rate_source)
+        
+        Returns:
+            Tuple of (success, error_message, number of rows added)
+        """
+        if self.rate_table is None:
+            success, error_msg = self.fetch_rates()
+            if not success:
+                return False, error_msg, 0
+        
+        try:
+            with _refresh_lock:
+                return self._refresh_from(source or self.rate_source)
+        except Exception as e:
+            return False, f"Error refreshing exchange rates: {str(e)}", 0
+    
+    def _refresh_from(self, source: str) -> Tuple[bool, str, int]:
+        """
+        Fetch a rates file and append its new rows; see refresh_rates.
+        """
+        start = time.perf_counter()
+        data = self._read_source(source)
+        
+        table = self.rate_table
+        last_date = table.dates[-1] if len(table.dates) else None
+        new_rows = self._load_rates_file(data, after=last_date)
+        if new_rows.empty:
+            return True, "", 0
+        
+        # Extending validates the new rows before anything is written
+        extended = table.extended(new_rows, hash_bytes(data), time.perf_counter() - start)
+        
+        # Keep the local file in step so restarts and the CSV fallback agree
+        self._append_to_local_file(data, last_date)
+        
+        # The table takes the content hash other processes compute for the same
+        # data (the snapshot's, or the local file's), so rates_version agrees
+        snapshot = self._snapshot_manifest_path()
+        if snapshot is not None and table.source_file == snapshot:
+            manifest = rate_snapshot.read_manifest(self.snapshot_dir)
+            manifest = rate_snapshot.write_snapshot(self.snapshot_dir, extended.dates, extended.rates,
+                                                    list(extended.currencies),
+                                                    [source_file['path'] for source_file in manifest['sources']])
+            content_hash = manifest['content_hash']
+        else:
+            content_hash = hash_file(self.local_file)
+        refreshed = RateTable.from_arrays(extended.dates, extended.rates, list(extended.currencies),
+                                          extended.source_file, content_hash, extended.load_seconds)
+        if snapshot is None or table.source_file != snapshot:
+            self.rate_store.put_table(self.local_file, refreshed)
+        
+        self.rate_table = refreshed
+        self.last_updated = refreshed.loaded_at
+        
+        return True, "", len(new_rows)
+    
+    def _append_to_local_file(self, data: bytes, after: Optional[np.datetime64]) -> None:
+        """
+        Append the rows of a fetched rates file dated after a date to the local file.
+        
+        Values are matched to the local file's series by the Series ID header, and
+        the local rows, header and layout are kept as they are.
+        """
+        # latin-1 maps every byte to a character, so untouched lines are written back unchanged
+        with open(self.local_file, 'rb') as f:
+            local_lines = f.read().decode('latin-1').splitlines(keepends=True)
+        local_rows = [next(csv.reader([line]), []) for line in local_lines]
+        fetched_rows = list(csv.reader(io.StringIO(data.decode('latin-1'))))
+        
+        local_header = _series_header(local_rows)
+        fetched_header = _series_header(fetched_rows)
+        positions = {name: i for i, name in enumerate(fetched_rows[fetched_header])}
+        
+        fetched_data = fetched_rows[fetched_header + 1:]
+        fetched_dates = _parse_rba_dates(pd.Series([row[0] if row else '' for row in fetched_data], dtype='str'))
+        newer = (fetched_dates > after) if after is not None else fetched_dates.notna()
+        
+        new_lines = []
+        for row, keep in zip(fetched_data, newer.to_numpy()):
+            if keep:
+                values = [row[positions[name]] if positions.get(name, len(row)) < len(row) else ''
+                          for name in local_rows[local_header]]
+                new_lines.append(','.join(values))
+        
+        # Insert after the last dated row, ahead of any trailing blank rows
+        local_data = local_rows[local_header + 1:]
+        local_dates = _parse_rba_dates(pd.Series([row[0] if row else '' for row in local_data], dtype='str'))
+        dated = np.flatnonzero(local_dates.notna().to_numpy())
+        insert_at = local_header + 1 + (int(dated[-1]) + 1 if len(dated) else 0)
+        newline = '\r\n' if local_lines and local_lines[0].endswith('\r\n') else '\n'
+        if not local_lines[insert_at - 1].endswith(('\n', '\r')):
+            local_lines[insert_at - 1] += newline
+        local_lines[insert_at:insert_at] = [line + newline for line in new_lines]
+        
+        with open(self.local_file + '.tmp', 'wb') as f:
+            f.write(''.join(local_lines).encode('latin-1'))
+        os.replace(self.local_file + '.tmp', self.local_file)
+    
+    def _read_source(self, source: str) -> bytes:
+        """
+        Read an RBA rates file from a URL, a directory holding it, or a file path.
+        """
+        if source.startswith(('http://', 'https://')):
+            response = requests.get(source, timeout=30)
+            response.raise_for_status()
+            return response.content
+        
+        if os.path.isdir(source):
+            source = os.path.join(source, os.path.basename(self.rba_url))
+        with open(source, 'rb') as f:
+            return f.read()
+    
+    def _snapshot_manifest_path(self) -> Optional[str]:
+        """
+        Get the manifest path of the configured snapshot, if any.
+        """
+        if not self.snapshot_dir:
+            return None
+        return os.path.join(os.path.abspath(self.snapshot_dir), rate_snapshot.MANIFEST_NAME)
+    
+    def _snapshot_table(self) -> Optional[RateTable]:
+        """
+        Get the snapshot table if one is configured, fresh and built from the local file.
+        """
+        if not self.snapshot_dir:
+            return None
+        
+        table = self.rate_store.get_snapshot(self.snapshot_dir)
+        if table is None:
+            return None
+        
+        manifest = rate_snapshot.read_manifest(self.snapshot_dir)
+        sources = [source['path'] for source in manifest['sources']] if manifest else []
+        if os.path.abspath(self.local_file) not in sources:
+            return None
+        return table
+    
+    def _load_rates_file(self, file_path: Union[str, bytes], after: Optional[np.datetime64] = None) -> pd.DataFrame:
+        """
+        Read and process an RBA rates CSV file.
+        
+        Args:
+            file_path: Path to the RBA CSV file, or its contents
+            after: Only parse rows dated after this date
+        
+        Returns:
+            Processed dataframe with date and currency columns
+        """
+        def source():
+            return io.BytesIO(file_path) if isinstance(file_path, bytes) else file_path
+        
+        # Skip to row 11 which contains the header
+        skiprows = 10
+        if after is not None:
+            # Scan just the date column, then skip every data row up to the first new one
+            raw_dates = pd.read_csv(source(), skiprows=10, usecols=['Series ID'], dtype='str')['Series ID']
+            newer = np.flatnonzero((_parse_rba_dates(raw_dates) > after).to_numpy())
+            if len(newer) == 0:
+                return pd.DataFrame(columns=['Date'])
+            skiprows = list(range(10)) + list(range(11, 11 + int(newer[0])))
+        
+        header = pd.read_csv(source(), skiprows=10, nrows=0)
+        rate_columns = [col for col in header.columns if col.startswith('FXR') and col != 'FXR']
+        
+        # Parse only the date and rate columns with fixed dtypes, falling back to an
+        # untyped read if the file does not fit that schema. The C parser is used
+        # because the pyarrow engine does not honour skiprows on these files.
+        dtypes = {col: 'float64' for col in rate_columns}
+        dtypes['Series ID'] = 'str'
+        try:
+            df = pd.read_csv(source(), skiprows=skiprows, usecols=['Series ID'] + rate_columns, dtype=dtypes)
+        except (ValueError, TypeError, KeyError):
+            df = pd.read_csv(source(), skiprows=skiprows)
+        
+        # Process the dataframe to clean up column names and format data
+        df = self._process_rba_data(df)
+        if after is not None:
+            df = df[df['Date'] > after]
+        return df
+    
     def _process_rba_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Process the raw RBA data into a usable format.
         
         Args:
             df: Raw dataframe from RBA CSV
-            
+        
         Returns:
             Processed dataframe with date index and currency columns
         """
@@ -75,7 +947,7 @@ class RBAExchangeRates:
             df = df.rename(columns=new_columns)
             
             # Convert date column to datetime
-            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+            df['Date'] = _parse_rba_dates(df['Date'])
             
             # Drop rows with invalid dates
             df = df.dropna(subset=['Date'])
@@ -89,17 +961,15 @@ class RBAExchangeRates:
             
             df = df[relevant_cols]
             
-            # Check for valid rates (not zero or NaN)
-            for col in df.columns:
-                if col != 'Date':
-                    # Replace zeros with NaN
-                    df[col] = df[col].replace(0, pd.NA)
+            # Check for valid rates (not zero or NaN): replace zeros with NaN
+            rate_columns = [col for col in df.columns if col != 'Date']
+            df[rate_columns] = df[rate_columns].mask(df[rate_columns] == 0)
             
             # Drop rows where all currency rates are NaN
-            df = df.dropna(how='all', subset=[col for col in df.columns if col != 'Date'])
+            df = df.dropna(how='all', subset=rate_columns)
             
             return df
-            
+        
         except Exception as e:
             raise ValueError(f"Error processing RBA data: {str(e)}")
     
@@ -114,7 +984,7 @@ class RBAExchangeRates:
         Returns:
             Tuple of (success, error_message, rate)
         """
-        if self.rates_data is None:
+        if self.rate_table is None:
             success, error_msg = self.fetch_rates()
             if not success:
                 return False, error_msg, 0.0
@@ -122,34 +992,139 @@ class RBAExchangeRates:
         if currency == 'AUD':
             return True, "", 1.0
         
-        if currency not in self.rates_data.columns:
+        table = self.rate_table
+        if self.periods is not None and table.position(date) < 0:
+            # Dates before the current file are served from the history periods
+            table = self.periods.table_for(date) or table
+        
+        column = table.currencies.get(currency)
+        if column is None:
             return False, f"Currency {currency} not found in exchange rates", 0.0
         
         # Find the closest date on or before the requested date
         date_str = date.strftime('%Y-%m-%d')
         
         try:
-            # Convert date to pandas Timestamp for comparison
-            pd_date = pd.Timestamp(date)
+            # Binary search the sorted date index
+            row = table.position(date)
             
-            # Find dates on or before the requested date
-            valid_dates = self.rates_data[self.rates_data['Date'] <= pd_date]
-            
-            if valid_dates.empty:
+            if row < 0:
                 return False, f"No exchange rate data available on or before {date_str}", 0.0
             
-            # Get the most recent date
-            closest_date_row = valid_dates.iloc[-1]
-            rate = closest_date_row[currency]
+            rate = table.rates[row, column]
             
-            # Validate the rate
-            if pd.isna(rate) or rate == 0:
-                return False, f"Invalid exchange rate (0 or NaN) for {currency} on {closest_date_row['Date'].strftime('%Y-%m-%d')}", 0.0
+            # Validate the rate (zeros were stored as NaN when the index was built)
+            if np.isnan(rate):
+                rate_date = pd.Timestamp(table.dates[row]).strftime('%Y-%m-%d')
+                return False, f"Invalid exchange rate (0 or NaN) for {currency} on {rate_date}", 0.0
             
             return True, "", float(rate)
         except Exception as e:
             return False, f"Error retrieving exchange rate: {str(e)}", 0.0
     
+    def get_rates_batch(self, dates: Any, currencies: Any,
+                        stats: Optional[Dict[str, int]] = None) -> Tuple[bool, str, np.ndarray]:
+        """
+        Get exchange rates for many (date, currency) pairs in one vectorised pass.
+        
+        Uploads repeat a few trading days and currencies across many rows, so
+        each distinct (date, currency) pair is resolved once and the rates are
+        gathered back to the rows.
+        
+        Args:
+            dates: Sequence or Series of dates
+            currencies: Sequence or Series of currency codes aligned with dates
+            stats: Optional dictionary whose 'rows' and 'unique_pairs' counts are increased
+        
+        Returns:
+            Tuple of (success, error_message, rates) where rates is a float array
+            aligned with the inputs. AUD rows get 1.0 and rows with no valid rate
+            (unknown currency, missing date, no data on or before the date, or a
+            0/NaN rate) get NaN.
+        """
+        if self.rate_table is None:
+            success, error_msg = self.fetch_rates()
+            if not success:
+                return False, error_msg, np.array([], dtype='float64')
+        
+        table = self.rate_table
+        
+        try:
+            date_keys = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+            codes, uniques = pd.factorize(pd.Series(currencies), use_na_sentinel=True)
+            
+            # Number the distinct (date, currency) pairs; NaT is a date of its own
+            day_codes, days = pd.factorize(date_keys, use_na_sentinel=False)
+            pair_index, pairs = pd.factorize(day_codes.astype('int64') * (len(uniques) + 1) + (codes + 1))
+            
+            # Any row of a pair can stand for it, as they share the date and currency
+            first = np.empty(len(pairs), dtype='int64')
+            first[pair_index] = np.arange(len(pair_index))
+            pair_dates, pair_codes = date_keys[first], codes[first]
+            
+            pair_rates, rows = _lookup_batch(table, pair_dates, pair_codes, uniques)
+            
+            # searchsorted places NaT after every date, so missing dates would match the last rate
+            missing = np.isnat(pair_dates)
+            pair_rates[missing] = np.nan
+            
+            # Dates before the current file are served from the history periods
+            earlier = (rows < 0) & ~missing
+            if self.periods is not None and earlier.any():
+                pair_rates[earlier] = self.periods.lookup_batch(pair_dates[earlier], pair_codes[earlier], uniques)
+            
+            aud_codes = np.array([c == 'AUD' for c in uniques], dtype=bool)
+            if len(uniques):
+                pair_rates[(pair_codes >= 0) & aud_codes[pair_codes]] = 1.0
+            
+            self._count_lookups(len(pair_index), len(pairs))
+            if stats is not None:
+                stats['rows'] = stats.get('rows', 0) + len(pair_index)
+                stats['unique_pairs'] = stats.get('unique_pairs', 0) + len(pairs)
+            
+            return True, "", pair_rates[pair_index]
+        except Exception as e:
+            return False, f"Error retrieving exchange rates: {str(e)}", np.array([], dtype='float64')
+    
+    def lookup_stats(self) -> Dict[str, Any]:
+        """
+        Report how much the batch lookups were saved by repeated (date, currency) pairs.
+        
+        Returns:
+            Dictionary of batches, rows, unique_pairs and hit_ratio, the share of
+            rows served from a pair already resolved in the same batch
+        """
+        with self._lookup_lock:
+            lookups = dict(self._lookups)
+        return dict(lookups, hit_ratio=lookup_hit_ratio(lookups))
+    
+    def _count_lookups(self, rows: int, unique_pairs: int) -> None:
+        with self._lookup_lock:
+            self._lookups['batches'] += 1
+            self._lookups['rows'] += rows
+            self._lookups['unique_pairs'] += unique_pairs
+    
+    def convert_to_aud_batch(self, amounts: Any, dates: Any, currencies: Any) -> Tuple[bool, str, np.ndarray, np.ndarray]:
+        """
+        Convert many foreign currency amounts to AUD in one vectorised pass.
+        
+        Args:
+            amounts: Sequence or Series of amounts in their own currency
+            dates: Sequence or Series of dates aligned with amounts
+            currencies: Sequence or Series of currency codes aligned with amounts
+        
+        Returns:
+            Tuple of (success, error_message, rates, amounts_aud). Rows with no
+            valid rate have NaN in both arrays.
+        """
+        success, error_msg, rates = self.get_rates_batch(dates, currencies)
+        if not success:
+            return False, error_msg, rates, rates
+        
+        # RBA rates are expressed as foreign currency per AUD, so divide
+        amounts_aud = np.asarray(amounts, dtype='float64') / rates
+        return True, "", rates, amounts_aud
+    
     def convert_amount(self, amount: float, from_currency: str, to_currency: str, 
                       date: datetime) -> Tuple[bool, str, float]:
         """
@@ -194,3 +1169,29 @@ class RBAExchangeRates:
             converted_amount = amount_aud
         
         return True, "", converted_amount
+
+
+def compile_rate_snapshot(source_files: List[str], snapshot_dir: str) -> Dict[str, Any]:
+    """
+    Compile one or more RBA F11 CSV files into a binary rate snapshot.
+    
+    Files may be given in any order. They are combined oldest first, by the
+    latest date each one holds, so for a date present in several files the
+    rate from the newest file wins, matching the as-of lookup.
+    
+    Args:
+        source_files: F11 CSV files, e.g. the current file and older history files
+        snapshot_dir: Directory to write the snapshot into
+    
+    Returns:
+        Manifest of the written snapshot
+    """
+    loader = RBAExchangeRates(RateStore())
+    loaded = [(loader._load_rates_file(path), path) for path in source_files]
+    loaded.sort(key=lambda item: item[0]['Date'].max() if len(item[0]) else pd.Timestamp.min)
+    frames = [frame for frame, _ in loaded]
+    rates_data = pd.concat(frames, ignore_index=True, sort=False) if len(frames) > 1 else frames[0]
+    
+    table = RateTable(rates_data, loaded[-1][1], '', 0.0)
+    return rate_snapshot.write_snapshot(snapshot_dir, table.dates, table.rates, list(table.currencies),
+                                        source_files)
@@ -0,0 +1,131 @@
+"""
+Server-side store for calculation results, keyed by result id.
+"""
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+class ResultStore:
+    """
+    Bounded LRU store of calculation results with a time-to-live.
+    
+    Results are held in memory up to ``max_entries``. When a spill directory is
+    configured, results evicted from memory are pickled to disk instead of being
+    dropped, and are promoted back into memory on their next lookup. Entries
+    older than ``ttl_seconds`` expire from both tiers.
+    """
+    
+    def __init__(self, max_entries: int = 32, ttl_seconds: float = 3600,
+                 spill_dir: Optional[str] = None):
+        """
+        Initialize the result store.
+        
+        Args:
+            max_entries: Maximum number of results kept in memory
+            ttl_seconds: Seconds a result stays available after it was stored
+            spill_dir: Optional directory for results evicted from memory
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Any]' = OrderedDict()
+        self._stored_at: Dict[str, float] = {}
+        
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+    
+    def put(self, results: Dict[str, Any]) -> str:
+        """
+        Store a calculation result.
+        
+        Args:
+            results: Results dictionary produced by TaxCalculator.calculate_tax
+        
+        Returns:
+            Result id to retrieve the results with
+        """
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[result_id] = results
+            self._stored_at[result_id] = time.time()
+            self._evict()
+        return result_id
+    
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve a stored calculation result.
+        
+        Args:
+            result_id: Id returned by put
+        
+        Returns:
+            Results dictionary, or None if the id is unknown or expired
+        """
+        with self._lock:
+            stored_at = self._stored_at.get(result_id)
+            if stored_at is None:
+                return None
+            
+            if time.time() - stored_at > self.ttl_seconds:
+                self._remove(result_id)
+                return None
+            
+            if result_id in self._entries:
+                self._entries.move_to_end(result_id)
+                return self._entries[result_id]
+            
+            # Promote a spilled result back into memory
+            results = self._read_spill(result_id)
+            if results is None:
+                self._remove(result_id)
+                return None
+            os.remove(self._spill_path(result_id))
+            self._entries[result_id] = results
+            self._evict()
+            return results
+    
+    def __contains__(self, result_id: str) -> bool:
+        return self.get(result_id) is not None
+    
+    def __len__(self) -> int:
+        return len(self._stored_at)
+    
+    def _evict(self) -> None:
+        """
+        Expire stale entries and move least recently used ones out of memory.
+        """
+        now = time.time()
+        for result_id in [k for k, t in self._stored_at.items() if now - t > self.ttl_seconds]:
+            self._remove(result_id)
+        
+        while len(self._entries) > self.max_entries:
+            result_id, results = self._entries.popitem(last=False)
+            if self.spill_dir:
+                with open(self._spill_path(result_id), 'wb') as f:
+                    pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                del self._stored_at[result_id]
+    
+    def _remove(self, result_id: str) -> None:
+        """
+        Remove a result from memory and disk.
+        """
+        self._entries.pop(result_id, None)
+        self._stored_at.pop(result_id, None)
+        if self.spill_dir and os.path.exists(self._spill_path(result_id)):
+            os.remove(self._spill_path(result_id))
+    
+    def _spill_path(self, result_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{result_id}.pkl")
+    
+    def _read_spill(self, result_id: str) -> Optional[Dict[str, Any]]:
+        if not self.spill_dir or not os.path.exists(self._spill_path(result_id)):
+            return None
+        with open(self._spill_path(result_id), 'rb') as f:
+            return pickle.load(f)
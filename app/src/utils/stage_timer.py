@@ -0,0 +1,105 @@
+"""
+Wall-clock and CPU timing of the named stages of a calculation.
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable, Iterator
+
+
+class StageTimer:
+    """
+    Exclusive wall-clock and CPU seconds, row counts and peak memory per named stage.
+    
+    Stages may nest: while an inner stage runs its parent is paused, so the
+    timings add up to the time spent inside stages and no second is counted
+    twice. Re-entering a stage adds to its total. CPU time is that of the
+    calling thread, so concurrent requests do not inflate each other's figures.
+    Peak memory is only recorded while tracemalloc is tracing, as the highest
+    traced allocation seen during the stage's own time; tracing is process-wide,
+    so concurrent stages see each other's allocations.
+    """
+    
+    def __init__(self, listener: Optional[Callable[[str], None]] = None):
+        """
+        Initialize a timer with no stages.
+        
+        Args:
+            listener: Optional callback invoked with the stage name whenever a stage starts or resumes
+        """
+        self.timings: Dict[str, float] = {}
+        self.cpu_timings: Dict[str, float] = {}
+        self.rows: Dict[str, int] = {}
+        self.peak_memory: Dict[str, int] = {}
+        self.listener = listener
+        self._stack: List[str] = []
+        self._started = 0.0
+        self._started_cpu = 0.0
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a block as a stage.
+        
+        Args:
+            name: Stage name
+        """
+        now, now_cpu = time.perf_counter(), time.thread_time()
+        if self._stack:
+            self._charge(self._stack[-1], now, now_cpu)
+        elif tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._stack.append(name)
+        self._started, self._started_cpu = now, now_cpu
+        if self.listener is not None:
+            self.listener(name)
+        
+        try:
+            yield
+        finally:
+            now, now_cpu = time.perf_counter(), time.thread_time()
+            self._charge(name, now, now_cpu)
+            self._stack.pop()
+            self._started, self._started_cpu = now, now_cpu
+            if self._stack and self.listener is not None:
+                self.listener(self._stack[-1])
+    
+    def count(self, name: str, rows: int) -> None:
+        """
+        Add to the number of rows a stage handled.
+        
+        Args:
+            name: Stage name
+            rows: Rows to add
+        """
+        self.rows[name] = self.rows.get(name, 0) + int(rows)
+    
+    def total(self) -> float:
+        """
+        Get the seconds spent in all stages.
+        
+        Returns:
+            Sum of the stage timings
+        """
+        return sum(self.timings.values())
+    
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get every figure recorded for each stage.
+        
+        Returns:
+            Dictionary of stage name to wall_seconds, cpu_seconds, rows and peak_memory_bytes;
+            rows and peak memory are None when they were not recorded
+        """
+        return {name: {'wall_seconds': seconds,
+                       'cpu_seconds': self.cpu_timings.get(name, 0.0),
+                       'rows': self.rows.get(name),
+                       'peak_memory_bytes': self.peak_memory.get(name)}
+                for name, seconds in self.timings.items()}
+    
+    def _charge(self, name: str, now: float, now_cpu: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + now - self._started
+        self.cpu_timings[name] = self.cpu_timings.get(name, 0.0) + now_cpu - self._started_cpu
+        if tracemalloc.is_tracing():
+            self.peak_memory[name] = max(self.peak_memory.get(name, 0), tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
@@ -0,0 +1,119 @@
+"""
+Benchmark of untyped versus schema-typed parsing of trade and RBA rate CSV files.
+
+Generates a synthetic trade transactions file and an RBA-style rates file, then
+times the previous untyped pd.read_csv path against the typed path used by
+process_trade_transactions and RBAExchangeRates._load_rates_file. Peak memory
+is measured with tracemalloc, which does not see allocations made inside Arrow,
+so pyarrow figures understate its real footprint.
+
+Usage:
+    python benchmarks/bench_csv_parsing.py [--rows 1000000] [--rate-rows 10000]
+"""
+import sys
+import os
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from src.utils.file_processor import process_trade_transactions, CSV_ENGINE
+from src.utils.rba_rates import RBAExchangeRates
+
+
+def write_trades(path, rows):
+    """Write a synthetic trade transactions CSV with rows rows."""
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, rows), unit='D')
+    pd.DataFrame({
+        'Date': dates.strftime('%Y-%m-%d'),
+        'Symbol': rng.choice([f"SYM{i}" for i in range(500)], rows),
+        'Quantity': rng.integers(-100, 100, rows),
+        'Unit Price': rng.uniform(1, 500, rows).round(4),
+        'Commission': rng.uniform(0, 20, rows).round(2),
+        'Currency': rng.choice(['USD', 'EUR', 'AUD'], rows),
+    }).to_csv(path, index=False)
+
+
+def write_rates(path, rows):
+    """Write an RBA F11.1-style rates CSV with ten preamble rows."""
+    rng = np.random.default_rng(1)
+    codes = ['USD', 'TWI', 'CR', 'JY', 'EUR', 'SKW', 'UKPS', 'SD', 'IRE', 'TB', 'NZD', 'NTD',
+             'MR', 'IR', 'VD', 'UAED', 'PNGK', 'HKD', 'CD', 'SARD', 'SF', 'PHP', 'SDR']
+    frame = pd.DataFrame(rng.uniform(0.5, 100, (rows, len(codes))).round(4),
+                         columns=[f"FXR{code}" for code in codes])
+    frame.insert(0, 'Series ID', pd.bdate_range('1990-01-01', periods=rows).strftime('%d-%b-%Y'))
+    with open(path, 'w') as f:
+        for i in range(10):
+            f.write(f"Preamble {i}" + ',' * len(codes) + '\n')
+        frame.to_csv(f, index=False)
+
+
+def measure(func):
+    """Return (seconds, peak traced MB), timing and tracing in separate runs."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def legacy_trades(path):
+    """Untyped trade parsing as previously done by process_trade_transactions."""
+    df = pd.read_csv(path)
+    df['Date'] = pd.to_datetime(df['Date'])
+    for col in ['Quantity', 'Unit Price', 'Commission']:
+        df[col] = pd.to_numeric(df[col])
+    df['Total Gross Value'] = df['Quantity'] * df['Unit Price']
+    df['Net Value'] = df['Total Gross Value'] - df['Commission']
+    return df
+
+
+def legacy_rates(path):
+    """Untyped rates parsing as previously done by RBAExchangeRates._load_rates_file."""
+    df = pd.read_csv(path, skiprows=10).rename(columns={'Series ID': 'Date'})
+    df = df.rename(columns={col: col[3:] for col in df.columns if col.startswith('FXR')})
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    for col in df.columns:
+        if col != 'Date':
+            df[col] = df[col].replace(0, pd.NA)
+    return df.dropna(subset=['Date'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='Trade transaction rows')
+    parser.add_argument('--rate-rows', type=int, default=10000, help='Daily rate rows')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        trades = os.path.join(tmp, 'trades.csv')
+        rates = os.path.join(tmp, 'rates.csv')
+        write_trades(trades, args.rows)
+        write_rates(rates, args.rate_rows)
+        
+        print(f"CSV engine for uploads: {CSV_ENGINE}")
+        print(f"{'file':>8} {'impl':>8} {'rows':>9} {'seconds':>10} {'peak MB':>10}")
+        cases = (
+            ('trades', 'legacy', args.rows, lambda: legacy_trades(trades)),
+            ('trades', 'typed', args.rows, lambda: process_trade_transactions(trades)),
+            ('rates', 'legacy', args.rate_rows, lambda: legacy_rates(rates)),
+            ('rates', 'typed', args.rate_rows, lambda: RBAExchangeRates()._load_rates_file(rates)),
+        )
+        for name, impl, rows, func in cases:
+            elapsed, peak = measure(func)
+            print(f"{name:>8} {impl:>8} {rows:>9} {elapsed:>10.4f} {peak:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
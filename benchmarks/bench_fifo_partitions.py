@@ -0,0 +1,88 @@
+"""
+Benchmark of serial FIFO matching against symbol-partitioned matching on a process pool.
+
+Generates AUD-converted transactions over many symbols and times
+FifoEngine.process against FifoEngine.process_partitioned for each worker
+count, checking that every partitioned run gives exactly the serial totals,
+detail rows and matches. Worker processes are started before timing, so the
+figures include shipping the partitions and results between processes but not
+pool startup. Scaling is bounded by the number of CPUs available.
+
+Usage:
+    python benchmarks/bench_fifo_partitions.py [--rows 1000000] [--symbols 500] [--workers 1 2 4 8]
+"""
+import sys
+import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from src.models.fifo_engine import FifoEngine
+
+
+def make_transactions(rows, symbols):
+    """Build date-ordered, AUD-converted transactions with ENGINE_COLUMNS."""
+    rng = np.random.default_rng(0)
+    quantity = rng.integers(-80, 100, rows)
+    unit_price = rng.uniform(1, 500, rows).round(4)
+    commission = rng.uniform(0, 20, rows).round(2)
+    gross = quantity * unit_price
+    rate = rng.uniform(0.5, 1.5, rows)
+    return pd.DataFrame({
+        'Date': pd.Timestamp('2015-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 3650, rows)), unit='D'),
+        'Symbol': pd.Categorical(rng.choice([f"SYM{i}" for i in range(symbols)], rows)),
+        'Quantity': quantity,
+        'Unit Price': unit_price,
+        'Total Gross Value': gross,
+        'Commission': commission,
+        'Net Value': gross - commission,
+        'Currency': 'USD',
+        'Exchange Rate': rate,
+        'Value in AUD': (gross - commission) / rate,
+    })
+
+
+def outcome(engine):
+    """Everything the engine produced, for comparing runs."""
+    return (engine.cost_of_shares_sold, engine.sales_aud, engine.sales_details, engine.purchases_details,
+            engine.matches.to_dict(), engine.closing_balance().to_dict('records'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='Transaction rows')
+    parser.add_argument('--symbols', type=int, default=500, help='Distinct symbols')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to time')
+    args = parser.parse_args()
+    
+    transactions = make_transactions(args.rows, args.symbols)
+    print(f"{args.rows} rows, {args.symbols} symbols, {os.cpu_count()} CPUs")
+    print(f"{'mode':>12} {'workers':>8} {'seconds':>10} {'speedup':>8} {'identical':>10}")
+    
+    engine = FifoEngine()
+    start = time.perf_counter()
+    engine.process(transactions)
+    serial_seconds = time.perf_counter() - start
+    expected = outcome(engine)
+    print(f"{'serial':>12} {1:>8} {serial_seconds:>10.3f} {1.0:>8.2f} {'-':>10}")
+    
+    for workers in args.workers:
+        with ProcessPoolExecutor(workers) as pool:
+            # Start every worker before timing
+            list(pool.map(abs, range(workers)))
+            engine = FifoEngine()
+            start = time.perf_counter()
+            engine.process_partitioned(transactions, pool, workers)
+            elapsed = time.perf_counter() - start
+        identical = outcome(engine) == expected
+        print(f"{'partitioned':>12} {workers:>8} {elapsed:>10.3f} {serial_seconds / elapsed:>8.2f} {str(identical):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of FIFO sales against the LotLedger and the previous list-copy implementation.
+
+Each run opens N lots of 10 shares in one symbol and then sells 5 shares at a
+time, so every sale is a partial or full sale of the oldest lot. The old
+implementation copies and rebuilds the whole lot list on every sale, so its
+cost per sale grows with the number of lots still held.
+
+Usage:
+    python benchmarks/bench_lot_ledger.py [--sizes 1000 10000 100000] [--legacy-sales 2000]
+"""
+import sys
+import os
+import argparse
+import time
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from src.models.lot_ledger import LotLedger
+
+
+def legacy_sell(lots, quantity_to_sell):
+    """FIFO sale as previously implemented in TaxCalculator._process_transactions."""
+    lots_cost = 0.0
+    remaining_to_sell = quantity_to_sell
+    kept = []
+    
+    for lot in lots.copy():
+        if remaining_to_sell <= 0:
+            kept.append(lot)
+        elif lot['quantity'] <= remaining_to_sell:
+            lots_cost += lot['total_cost']
+            remaining_to_sell -= lot['quantity']
+        else:
+            sold_cost = lot['cost_per_share'] * remaining_to_sell
+            lots_cost += sold_cost
+            new_quantity = lot['quantity'] - remaining_to_sell
+            new_total_cost = lot['total_cost'] - sold_cost
+            kept.append({
+                'quantity': new_quantity,
+                'cost_per_share': new_total_cost / new_quantity,
+                'total_cost': new_total_cost
+            })
+            remaining_to_sell = 0
+    
+    return kept, lots_cost
+
+
+def bench_legacy(num_lots, max_sales):
+    """Time up to max_sales sales against num_lots legacy dict lots."""
+    lots = [{'quantity': 10, 'cost_per_share': 1.5, 'total_cost': 15.0} for _ in range(num_lots)]
+    sales = min(max_sales, num_lots * 2)
+    
+    start = time.perf_counter()
+    total = 0.0
+    for _ in range(sales):
+        lots, cost = legacy_sell(lots, 5)
+        total += cost
+    elapsed = time.perf_counter() - start
+    
+    return sales, elapsed, total
+
+
+def bench_ledger(num_lots):
+    """Time selling every share out of num_lots LotLedger lots."""
+    ledger = LotLedger()
+    for _ in range(num_lots):
+        ledger.add_lot(10, 1.5, 15.0)
+    sales = num_lots * 2
+    
+    start = time.perf_counter()
+    total = 0.0
+    for _ in range(sales):
+        total += ledger.sell(5)
+    elapsed = time.perf_counter() - start
+    
+    return sales, elapsed, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-sales', type=int, default=2000,
+                        help='Cap on sales timed for the legacy implementation (it is quadratic)')
+    args = parser.parse_args()
+    
+    print(f"{'lots':>8} {'impl':>8} {'sales':>8} {'seconds':>10} {'us/sale':>10}")
+    for num_lots in args.sizes:
+        for name, (sales, elapsed, _) in (('legacy', bench_legacy(num_lots, args.legacy_sales)),
+                                          ('ledger', bench_ledger(num_lots))):
+            print(f"{num_lots:>8} {name:>8} {sales:>8} {elapsed:>10.4f} {elapsed / sales * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+End-to-end benchmark suite covering the parse, FX, FIFO and render stages.
+
+Generates a deterministic synthetic portfolio (see synthetic_portfolio.py),
+then times each stage separately:
+
+- parse: process_opening_balance and process_trade_transactions on the written files
+- fx: RBAExchangeRates.fetch_rates cold (fresh rate store) and warm, get_rate
+  for single lookups, get_rates_batch for every trade
+- fifo: TaxCalculator.calculate_tax without any result or symbol caches
+- render: build_detail_tables, then results.html and the first details.html page
+  (--page-size rows)
+
+Each stage runs --repeat times and reports the median and minimum seconds.
+Results can be written as JSON with --output, and compared with a stored
+baseline with --baseline: a stage whose median is more than --tolerance slower
+than the baseline (and slower by more than --min-delta seconds, so tiny stages
+do not flag on noise) is reported as a regression and the exit status is 1.
+Baselines are only comparable on the same machine and options.
+
+Usage:
+    python benchmarks/bench_suite.py [--fills 10000] [--symbols 50] [--repeat 5]
+        [--output results.json] [--baseline benchmarks/baseline.json] [--tolerance 0.25]
+"""
+import sys
+import os
+import json
+import argparse
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from synthetic_portfolio import write_portfolio, add_portfolio_arguments, portfolio_options
+from src.utils.file_processor import process_opening_balance, process_trade_transactions
+from src.utils.rba_rates import RBAExchangeRates, RateStore
+from src.utils.detail_tables import build_detail_tables, display_rows, DEFAULT_PAGE_SIZE
+from src.models.calculation import TaxCalculator
+
+SUITE_VERSION = 1
+
+
+def time_stage(func, repeat):
+    """Run func repeat times, returning its last result and the seconds of each run."""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+
+def checked(outcome):
+    """Unwrap a (success, error_message, value...) tuple, failing the benchmark on errors."""
+    if not outcome[0]:
+        raise RuntimeError(outcome[1])
+    return outcome[2] if len(outcome) > 2 else None
+
+
+def run_suite(opening_path, trades_path, repeat, lookups, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Time every stage on the portfolio files.
+    
+    Returns:
+        Dictionary of stage name to the seconds of each run
+    """
+    from flask import render_template
+    from src.main import app, DETAIL_ELEMENTS
+    
+    timings = {}
+    
+    opening, timings['parse_opening_balance'] = time_stage(
+        lambda: checked(process_opening_balance(opening_path)), repeat)
+    transactions, timings['parse_transactions'] = time_stage(
+        lambda: checked(process_trade_transactions(trades_path)), repeat)
+    
+    _, timings['fetch_rates_cold'] = time_stage(
+        lambda: checked(RBAExchangeRates(rate_store=RateStore()).fetch_rates()), repeat)
+    rba_rates = RBAExchangeRates()
+    _, timings['fetch_rates_warm'] = time_stage(lambda: checked(rba_rates.fetch_rates()), repeat)
+    
+    sample = transactions.iloc[:lookups]
+    pairs = list(zip(sample['Date'].tolist(), sample['Currency'].astype(str).tolist()))
+    _, timings['get_rate'] = time_stage(lambda: [rba_rates.get_rate(date, currency) for date, currency in pairs],
+                                        repeat)
+    _, timings['get_rates_batch'] = time_stage(
+        lambda: checked(rba_rates.get_rates_batch(transactions['Date'], transactions['Currency'])), repeat)
+    
+    def calculate():
+        calculator = TaxCalculator(rba_rates)
+        calculator.set_opening_balance(opening)
+        calculator.set_transactions(transactions)
+        return checked(calculator.calculate_tax())
+    
+    results, timings['calculate_tax'] = time_stage(calculate, repeat)
+    stored, timings['detail_tables'] = time_stage(lambda: build_detail_tables(results), repeat)
+    
+    with app.test_request_context():
+        _, timings['render_results'] = time_stage(
+            lambda: render_template('results.html', results=stored, result_id='bench'), repeat)
+        
+        def render_details():
+            query = {'page': 1, 'page_size': page_size, 'sort_by': None, 'descending': False,
+                     'symbol': None, 'date_from': None, 'date_to': None}
+            page_frame, total_rows = stored['sales_details'].query_frame(**query)
+            return render_template('details.html', element_data=display_rows(page_frame),
+                                   element_name=DETAIL_ELEMENTS['sales_details'],
+                                   element='sales_details', result_id='bench', total_rows=total_rows,
+                                   query=query, args={})
+        
+        _, timings['render_details'] = time_stage(render_details, repeat)
+    
+    return timings
+
+
+def summarise(timings):
+    """Reduce the seconds of each run to median and minimum per stage."""
+    return {stage: {'median': statistics.median(seconds), 'min': min(seconds), 'runs': len(seconds)}
+            for stage, seconds in timings.items()}
+
+
+def compare(stages, baseline, tolerance, min_delta):
+    """
+    Compare stage medians with a baseline.
+    
+    Returns:
+        Dictionary of stage name to (baseline median or None, ratio or None, regressed flag)
+    """
+    comparison = {}
+    for stage, summary in stages.items():
+        before = baseline.get('stages', {}).get(stage)
+        if before is None:
+            comparison[stage] = (None, None, False)
+            continue
+        ratio = summary['median'] / before['median'] if before['median'] else float('inf')
+        regressed = ratio > 1 + tolerance and summary['median'] - before['median'] > min_delta
+        comparison[stage] = (before['median'], ratio, regressed)
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_portfolio_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per stage')
+    parser.add_argument('--lookups', type=int, default=1000, help='Single get_rate lookups per run')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Rows on the rendered details page')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare with results previously written with --output')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown of a stage median')
+    parser.add_argument('--min-delta', type=float, default=0.02, help='Ignore slowdowns below this many seconds')
+    args = parser.parse_args()
+    
+    options = portfolio_options(args)
+    with tempfile.TemporaryDirectory() as directory:
+        opening_path, trades_path = write_portfolio(directory, **options)
+        timings = run_suite(opening_path, trades_path, args.repeat, args.lookups, args.page_size)
+    
+    report = {
+        'suite_version': SUITE_VERSION,
+        'options': dict(options, repeat=args.repeat, lookups=args.lookups, page_size=args.page_size),
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                        'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'stages': summarise(timings),
+    }
+    
+    comparison = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('options') != report['options']:
+            print("warning: baseline was recorded with different options", file=sys.stderr)
+        comparison = compare(report['stages'], baseline, args.tolerance, args.min_delta)
+        report['regressions'] = [stage for stage, (_, _, regressed) in comparison.items() if regressed]
+    
+    print(f"{args.fills} fills, {args.symbols} symbols, {args.repeat} runs per stage")
+    print(f"{'stage':>22} {'median':>10} {'min':>10} {'baseline':>10} {'ratio':>7}")
+    for stage, summary in report['stages'].items():
+        before, ratio, regressed = comparison.get(stage, (None, None, False))
+        before_text = f"{before:>10.4f}" if before is not None else f"{'-':>10}"
+        ratio_text = f"{ratio:>7.2f}" if ratio is not None else f"{'-':>7}"
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{stage:>22} {summary['median']:>10.4f} {summary['min']:>10.4f} {before_text} {ratio_text}{flag}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
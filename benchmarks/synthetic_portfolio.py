@@ -0,0 +1,137 @@
+"""
+Deterministic synthetic portfolio generator for benchmarks.
+
+Writes an opening balance file and a trade transactions file in the column
+layout of sample_data, so they go through process_opening_balance and
+process_trade_transactions like real uploads. The same arguments always give
+the same files. Sales never exceed the quantity held, so the FIFO engine always
+has lots to match; a sale drawn for a symbol with nothing held becomes a
+purchase, which makes the realised sell ratio a little lower than requested.
+
+Usage:
+    python benchmarks/synthetic_portfolio.py OUTPUT_DIR [--symbols 50] [--fills 10000]
+        [--currencies USD EUR] [--start 2023-07-01] [--days 365] [--sell-ratio 0.4] [--seed 0]
+"""
+import os
+import argparse
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+TRADE_COLUMNS = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Total Gross Value', 'Commission', 'Net Value', 'Currency']
+OPENING_BALANCE_COLUMNS = ['Symbol', 'Quantity', 'Total Cost in AUD']
+
+
+def generate_portfolio(symbols: int = 50, fills: int = 10000, currencies: Sequence[str] = ('USD',),
+                       start: str = '2023-07-01', days: int = 365, sell_ratio: float = 0.4,
+                       seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Generate an opening balance and date-ordered trades.
+    
+    Args:
+        symbols: Number of distinct symbols
+        fills: Number of trade rows
+        currencies: Currencies to trade in; each symbol trades in one of them
+        start: First trade date (YYYY-MM-DD)
+        days: Number of days trades are spread over
+        sell_ratio: Fraction of fills drawn as sales
+        seed: Random seed
+    
+    Returns:
+        Tuple of (opening balance DataFrame, trades DataFrame) with the sample_data columns
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"SYM{i:04d}" for i in range(symbols)])
+    currency_of = rng.choice(list(currencies), symbols)
+    base_price = rng.uniform(5, 500, symbols).round(2)
+    
+    # About half of the symbols are already held at the start of the year
+    held = np.where(rng.random(symbols) < 0.5, rng.integers(10, 1000, symbols), 0)
+    opening = pd.DataFrame({
+        'Symbol': names[held > 0],
+        'Quantity': held[held > 0],
+        'Total Cost in AUD': (held * base_price * rng.uniform(1.2, 1.8, symbols))[held > 0].round(2),
+    }, columns=OPENING_BALANCE_COLUMNS)
+    
+    symbol = rng.integers(0, symbols, fills)
+    offsets = np.sort(rng.integers(0, days, fills))
+    wants_sale = rng.random(fills) < sell_ratio
+    drawn = rng.integers(1, 200, fills)
+    
+    quantity = np.empty(fills, dtype=np.int64)
+    holdings = held.astype(np.int64)
+    for row in range(fills):
+        s = symbol[row]
+        if wants_sale[row] and holdings[s] > 0:
+            quantity[row] = -min(drawn[row], holdings[s])
+        else:
+            quantity[row] = drawn[row]
+        holdings[s] += quantity[row]
+    
+    unit_price = (base_price[symbol] * np.exp(rng.normal(0, 0.1, fills))).round(2)
+    gross = (quantity * unit_price).round(2)
+    commission = rng.choice([9.95, 14.95, 19.95], fills)
+    trades = pd.DataFrame({
+        'Date': (pd.Timestamp(start) + pd.to_timedelta(offsets, unit='D')).strftime('%Y-%m-%d'),
+        'Symbol': names[symbol],
+        'Quantity': quantity,
+        'Unit Price': unit_price,
+        'Total Gross Value': gross,
+        'Commission': commission,
+        'Net Value': (gross - commission).round(2),
+        'Currency': currency_of[symbol],
+    }, columns=TRADE_COLUMNS)
+    
+    return opening, trades
+
+
+def write_portfolio(directory: str, **options) -> Tuple[str, str]:
+    """
+    Generate a portfolio and write it as CSV files.
+    
+    Args:
+        directory: Directory to write opening_balance.csv and trade_transactions.csv to
+        **options: Arguments of generate_portfolio
+    
+    Returns:
+        Tuple of (opening balance path, trade transactions path)
+    """
+    opening, trades = generate_portfolio(**options)
+    os.makedirs(directory, exist_ok=True)
+    opening_path = os.path.join(directory, 'opening_balance.csv')
+    trades_path = os.path.join(directory, 'trade_transactions.csv')
+    opening.to_csv(opening_path, index=False)
+    trades.to_csv(trades_path, index=False)
+    return opening_path, trades_path
+
+
+def add_portfolio_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the generate_portfolio options to a command line parser."""
+    parser.add_argument('--symbols', type=int, default=50, help='Distinct symbols')
+    parser.add_argument('--fills', type=int, default=10000, help='Trade rows')
+    parser.add_argument('--currencies', nargs='+', default=['USD'], help='Currencies to trade in')
+    parser.add_argument('--start', default='2023-07-01', help='First trade date (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=365, help='Days trades are spread over')
+    parser.add_argument('--sell-ratio', type=float, default=0.4, help='Fraction of fills drawn as sales')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+
+def portfolio_options(args: argparse.Namespace) -> dict:
+    """Collect the generate_portfolio options from parsed arguments."""
+    return {'symbols': args.symbols, 'fills': args.fills, 'currencies': list(args.currencies),
+            'start': args.start, 'days': args.days, 'sell_ratio': args.sell_ratio, 'seed': args.seed}
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output_dir', help='Directory to write the files to')
+    add_portfolio_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    for path in write_portfolio(args.output_dir, **portfolio_options(args)):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
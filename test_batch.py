@@ -0,0 +1,79 @@
+"""
+Tests for the batch command-line calculation of many entities.
+"""
+import sys
+import os
+import shutil
+import tempfile
+import pandas as pd
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from src.batch import find_entities, run_batch
+from src.models.calculation import TaxCalculator
+from src.utils.file_processor import process_opening_balance, process_trade_transactions
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_data')
+
+
+def test_batch_isolates_failures_and_matches_single_calculation():
+    """Entities run in a process pool; a bad entity is reported without affecting the rest."""
+    with tempfile.TemporaryDirectory() as directory:
+        entities_dir = os.path.join(directory, 'entities')
+        for name in ('alpha', 'beta'):
+            os.makedirs(os.path.join(entities_dir, name))
+            shutil.copyfile(os.path.join(SAMPLE_DIR, 'trade_transactions.csv'),
+                            os.path.join(entities_dir, name, 'trade_transactions.csv'))
+        shutil.copyfile(os.path.join(SAMPLE_DIR, 'opening_balance.csv'),
+                        os.path.join(entities_dir, 'alpha', 'opening_balance.csv'))
+        os.makedirs(os.path.join(entities_dir, 'broken'))
+        with open(os.path.join(entities_dir, 'broken', 'transactions.csv'), 'w') as f:
+            f.write("Symbol,Quantity\nABC,1\n")
+        
+        output_dir = os.path.join(directory, 'out')
+        progress = []
+        rows, totals = run_batch(find_entities(entities_dir), output_dir, workers=2,
+                                 progress=lambda done, total, row: progress.append((done, total)))
+        
+        assert [row['entity'] for row in rows] == ['alpha', 'beta', 'broken']
+        assert [row['status'] for row in rows] == ['ok', 'ok', 'error']
+        assert rows[2]['error'].startswith("Transactions file error: Missing required columns")
+        assert totals['succeeded'] == 2 and totals['failed'] == 1
+        assert totals['entities_per_second'] > 0
+        assert sorted(progress) == [(1, 3), (2, 3), (3, 3)]
+        
+        # The pooled result equals a direct calculation
+        calculator = TaxCalculator()
+        calculator.set_opening_balance(process_opening_balance(os.path.join(SAMPLE_DIR, 'opening_balance.csv'))[2])
+        calculator.set_transactions(process_trade_transactions(os.path.join(SAMPLE_DIR, 'trade_transactions.csv'))[2])
+        _, _, expected = calculator.calculate_tax()
+        assert rows[0]['gross_trading_income'] == expected['gross_trading_income']
+        
+        summary = pd.read_csv(os.path.join(output_dir, 'summary.csv'))
+        assert list(summary['status']) == ['ok', 'ok', 'error']
+        sales = pd.read_csv(os.path.join(output_dir, 'alpha', 'sales_details.csv'))
+        assert len(sales) == len(expected['sales_details'])
+
+
+def test_streamed_batch_writes_the_same_results():
+    """--stream reads each transactions CSV in chunks and writes the same files and figures."""
+    with tempfile.TemporaryDirectory() as directory:
+        entities_dir = os.path.join(directory, 'entities')
+        os.makedirs(os.path.join(entities_dir, 'alpha'))
+        shutil.copyfile(os.path.join(SAMPLE_DIR, 'trade_transactions.csv'),
+                        os.path.join(entities_dir, 'alpha', 'trade_transactions.csv'))
+        shutil.copyfile(os.path.join(SAMPLE_DIR, 'opening_balance.csv'),
+                        os.path.join(entities_dir, 'alpha', 'opening_balance.csv'))
+        
+        loaded, _ = run_batch(find_entities(entities_dir), os.path.join(directory, 'loaded'), workers=1)
+        streamed, _ = run_batch(find_entities(entities_dir), os.path.join(directory, 'streamed'), workers=1,
+                                stream=True)
+        
+        assert streamed[0]['status'] == 'ok', streamed[0]['error']
+        assert streamed[0]['transactions'] == loaded[0]['transactions']
+        assert streamed[0]['gross_trading_income'] == loaded[0]['gross_trading_income']
+        for name in ('sales_details.csv', 'sale_matches.csv', 'closing_balance.csv', 'closing_lots.npz'):
+            assert os.path.exists(os.path.join(directory, 'streamed', 'alpha', name))
+        assert len(pd.read_csv(os.path.join(directory, 'streamed', 'alpha', 'sales_details.csv'))) == \
+            len(pd.read_csv(os.path.join(directory, 'loaded', 'alpha', 'sales_details.csv')))
@@ -0,0 +1,386 @@
+"""
+Tests for the FIFO lot ledger and the tax calculation engine.
+"""
+import sys
+import os
+import io
+import tempfile
+import time
+import tracemalloc
+import pytest
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from src.models.lot_ledger import LotLedger
+from src.models.calculation import TaxCalculator
+from src.models.symbol_state import SymbolStateCache
+from src.utils.calculation_cache import CalculationCache
+from src.utils.rba_rates import RBAExchangeRates, RateStore
+from src.utils.file_processor import process_opening_balance, process_trade_transactions
+from src.utils.instrumentation import StageMetrics, server_timing, timed_stream
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_data')
+
+
+def _sample_calculator():
+    """Build a calculator loaded with the sample opening balance and trades."""
+    _, _, transactions = process_trade_transactions(os.path.join(SAMPLE_DIR, 'trade_transactions.csv'))
+    _, _, opening_balance = process_opening_balance(os.path.join(SAMPLE_DIR, 'opening_balance.csv'))
+    calculator = TaxCalculator()
+    calculator.set_opening_balance(opening_balance)
+    calculator.set_transactions(transactions)
+    return calculator
+
+
+def test_calculation_stages_are_timed_and_aggregated():
+    """Calculation stages record time, rows and traced memory, and feed the metrics histograms."""
+    calculator = _sample_calculator()
+    tracemalloc.start()
+    try:
+        with calculator.timer.stage('total'):
+            success, error_msg, _ = calculator.calculate_tax()
+    finally:
+        tracemalloc.stop()
+    assert success, error_msg
+    
+    summary = calculator.timer.summary()
+    assert {'total', 'rates', 'fx', 'fifo'} <= set(summary)
+    assert summary['fifo']['rows'] == summary['fx']['rows'] == 10
+    assert all(stage['peak_memory_bytes'] > 0 for stage in summary.values())
+    # Nested stages are exclusive, so the parts add up to the whole
+    assert calculator.timer.total() == pytest.approx(sum(stage['wall_seconds'] for stage in summary.values()))
+    assert 'fifo;dur=' in server_timing(calculator.timer) and 'rows=10' in server_timing(calculator.timer)
+    
+    metrics = StageMetrics(buckets=(0.001, 1000.0))
+    metrics.observe('upload_files', calculator.timer)
+    metrics.observe('upload_files', calculator.timer)
+    exposition = metrics.render()
+    assert 'stage_wall_seconds_bucket{endpoint="upload_files",stage="fifo",le="1000.0"} 2' in exposition
+    assert 'stage_wall_seconds_count{endpoint="upload_files",stage="fifo"} 2' in exposition
+    assert 'stage_rows_total{endpoint="upload_files",stage="fifo"} 20' in exposition
+
+
+def test_timed_stream_reports_once_the_stream_ends():
+    """A streamed body is timed while it is produced and reported when it ends or is closed."""
+    def pieces():
+        for piece in ('a', '', 'b'):
+            time.sleep(0.01)
+            yield piece
+    
+    timers = []
+    stream = timed_stream(pieces(), 'render', timers.append)
+    assert next(stream) == 'a'
+    assert timers == []
+    assert list(stream) == ['', 'b']
+    assert len(timers) == 1 and timers[0].timings['render'] >= 0.03
+    
+    stream = timed_stream(pieces(), 'render', timers.append)
+    next(stream)
+    stream.close()
+    assert len(timers) == 2 and timers[1].timings['render'] >= 0.01
+
+
+def test_lot_ledger_sells_oldest_lots_first():
+    """Sales consume whole lots from the head and split the last one."""
+    ledger = LotLedger()
+    ledger.add_lot(10, 2.0, 20.0)
+    ledger.add_lot(10, 3.0, 30.0)
+    
+    assert ledger.sell(15) == 20.0 + 15.0
+    assert len(ledger) == 1
+    assert ledger.total_quantity() == 5
+    assert ledger.total_cost() == 15.0
+    
+    # Overselling empties the ledger and ignores the excess
+    assert ledger.sell(50) == 15.0
+    assert len(ledger) == 0
+
+
+def test_sample_calculation_totals():
+    """The sample files produce the expected headline figures."""
+    success, error_msg, results = _sample_calculator().calculate_tax()
+    assert success, error_msg
+    
+    assert results['cost_of_shares_sold'] == pytest.approx(57250.525)
+    assert results['opening_stock_value'] == pytest.approx(131251.5)
+    assert results['closing_stock_value'] == pytest.approx(137647.56427033033)
+    assert results['gross_trading_income'] == pytest.approx(results['sales_aud'] - results['cost_of_shares_sold'])
+    assert [row['Symbol'] for row in results['closing_balance']] == ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'TSLA', 'NVDA']
+
+
+def test_sale_matches_reconcile_with_totals():
+    """The per-parcel match ledger adds up to the headline figures."""
+    success, error_msg, results = _sample_calculator().calculate_tax()
+    assert success, error_msg
+    matches = results['sale_matches']
+    
+    assert sum(matches['Cost in AUD']) == pytest.approx(results['cost_of_shares_sold'])
+    assert sum(matches['Proceeds in AUD']) == pytest.approx(results['sales_aud'])
+    
+    # Every match points back at a sale and a lot from the right source list
+    for sale_id, source, lot_id, symbol in zip(matches['Sale ID'], matches['Lot Source'],
+                                               matches['Lot ID'], matches['Symbol']):
+        assert results['sales_details'][sale_id]['Symbol'] == symbol
+        lots = results['opening_balance'] if source == 'Opening Balance' else results['purchases_details']
+        assert lots[lot_id]['Symbol'] == symbol
+    
+    # Opening balance lots have no acquisition date, purchases do
+    for source, days in zip(matches['Lot Source'], matches['Holding Days']):
+        assert (days is None) == (source == 'Opening Balance')
+
+
+def test_oversold_shares_are_recorded_without_a_lot():
+    """Shares sold beyond the holding get an unmatched row, so the match ledger still reconciles."""
+    trades = pd.DataFrame({
+        'Date': ['2024-01-02', '2024-02-01', '2024-03-01'],
+        'Symbol': ['AAPL', 'AAPL', 'AAPL'],
+        'Quantity': [10, -15, -5],
+        'Unit Price': [100.0, 120.0, 130.0],
+        'Total Gross Value': [1000.0, -1800.0, -650.0],
+        'Commission': [0.0, 0.0, 0.0],
+        'Net Value': [1000.0, -1800.0, -650.0],
+        'Currency': ['AUD', 'AUD', 'AUD'],
+    })
+    _, _, tx = process_trade_transactions(trades.to_csv(index=False).encode(), 'trades.csv')
+    calculator = TaxCalculator()
+    calculator.set_transactions(tx)
+    success, error_msg, results = calculator.calculate_tax()
+    assert success, error_msg
+    
+    matches = results['sale_matches']
+    assert matches['Lot Source'] == ['Purchase', 'Unmatched', 'Unmatched']
+    assert matches['Quantity'] == [10, 5, 5]
+    assert sum(matches['Proceeds in AUD']) == pytest.approx(results['sales_aud'])
+    assert sum(matches['Gain in AUD']) == pytest.approx(results['gross_trading_income'])
+
+
+def test_streaming_matches_in_memory_calculation():
+    """Chunked streaming gives the same headline figures and detail rows as calculate_tax."""
+    success, error_msg, expected = _sample_calculator().calculate_tax()
+    assert success, error_msg
+    
+    _, _, opening_balance = process_opening_balance(os.path.join(SAMPLE_DIR, 'opening_balance.csv'))
+    calculator = TaxCalculator()
+    calculator.set_opening_balance(opening_balance)
+    with tempfile.TemporaryDirectory() as output_dir:
+        success, error_msg, results = calculator.calculate_tax_streaming(
+            os.path.join(SAMPLE_DIR, 'trade_transactions.csv'), output_dir, chunk_size=3)
+        assert success, error_msg
+        
+        for key in ['cost_of_shares_sold', 'sales_aud', 'gross_trading_income', 'opening_stock_value',
+                    'closing_stock_value', 'purchases_value', 'closing_balance']:
+            assert results[key] == expected[key]
+        
+        sales = pd.read_csv(results['sales_details_path'], float_precision='round_trip')
+        assert sales.to_dict('records') == expected['sales_details']
+        matches = pd.read_csv(results['sale_matches_path'], float_precision='round_trip')
+        assert matches['Cost in AUD'].tolist() == expected['sale_matches']['Cost in AUD']
+
+
+def test_streaming_rejects_unsorted_files():
+    """Streaming mode needs the transactions file in date order."""
+    unsorted = b"Date,Symbol,Quantity,Unit Price,Commission,Currency\n2024-02-01,AAPL,1,1,0,USD\n2024-01-01,AAPL,-1,1,0,USD\n"
+    with tempfile.TemporaryDirectory() as output_dir:
+        success, error_msg, _ = TaxCalculator().calculate_tax_streaming(unsorted, output_dir, filename='trades.csv')
+    
+    assert not success
+    assert "sorted by date" in error_msg
+
+
+def _random_trades(rows, symbols=25, seed=3):
+    """Random trades over many symbols as a transactions DataFrame, and an opening balance CSV."""
+    rng = np.random.default_rng(seed)
+    transactions = pd.DataFrame({
+        'Date': (pd.Timestamp('2023-07-01') + pd.to_timedelta(rng.integers(0, 300, rows), unit='D')).strftime('%Y-%m-%d'),
+        'Symbol': rng.choice([f"SYM{i}" for i in range(symbols)], rows),
+        'Quantity': rng.integers(-60, 100, rows),
+        'Unit Price': rng.uniform(1, 300, rows).round(3),
+        'Commission': rng.uniform(0, 15, rows).round(2),
+        'Currency': rng.choice(['USD', 'EUR', 'AUD'], rows),
+    })
+    opening = pd.DataFrame({
+        'Symbol': ['SYM7', 'OLD', 'SYM2'],
+        'Quantity': [500, 10, 40],
+        'Total Cost in AUD': [12345.67, 99.5, 4000.25],
+    }).to_csv(index=False).encode()
+    return transactions, opening
+
+
+def _calculate_random(transactions, opening, **calculator_args):
+    """Calculate random trades, returning (repr of results, reuse figures)."""
+    _, _, tx = process_trade_transactions(transactions.to_csv(index=False).encode(), 'trades.csv')
+    _, _, ob = process_opening_balance(opening, 'opening.csv')
+    calculator = TaxCalculator(**calculator_args)
+    calculator.set_opening_balance(ob)
+    calculator.set_transactions(tx)
+    success, error_msg, results = calculator.calculate_tax()
+    assert success, error_msg
+    results.pop('calculation_date')
+    # Lookup counts depend on how many rows were converted, not on the results
+    results.pop('fx_lookups')
+    reuse = results.pop('reuse', None)
+    return repr(results), reuse
+
+
+def test_partitioned_matching_is_identical_to_serial():
+    """Matching symbols in parallel partitions gives exactly the serial results."""
+    transactions, opening = _random_trades(2000)
+    
+    with ProcessPoolExecutor(3) as executor:
+        assert _calculate_random(transactions, opening, fifo_executor=executor, fifo_partitions=3) == _calculate_random(transactions, opening)
+
+
+def test_incremental_recalculation_replays_only_changed_symbols():
+    """An amended file reuses unchanged symbols and still gives exactly the full results."""
+    transactions, opening = _random_trades(3000)
+    cache = SymbolStateCache()
+    
+    results, reuse = _calculate_random(transactions, opening, state_cache=cache)
+    assert results == _calculate_random(transactions, opening)[0]
+    assert reuse['rows_replayed'] == 3000
+    
+    # Amend one row late in the year, drop another and add a late trade in an existing symbol
+    amended = transactions.copy()
+    amended.loc[2500, 'Quantity'] = 7
+    amended = pd.concat([amended.drop(index=[40]), amended.iloc[[9]].assign(Date='2024-04-20')])
+    changed = set(amended.loc[[2500, 9], 'Symbol']) | {transactions.loc[40, 'Symbol']}
+    
+    results, reuse = _calculate_random(amended, opening, state_cache=cache)
+    assert results == _calculate_random(amended, opening)[0]
+    assert reuse['symbols_replayed'] == len(changed)
+    assert reuse['symbols_reused'] == reuse['symbols'] - len(changed)
+    assert reuse['rows_reused'] + reuse['rows_replayed'] == len(amended)
+    assert reuse['rows_converted'] < reuse['rows_replayed']
+
+
+
+class _CountingExecutor(ProcessPoolExecutor):
+    """Process pool counting the partitions mapped onto it."""
+    
+    mapped = 0
+    
+    def map(self, fn, *iterables, **kwargs):
+        items = list(iterables[0])
+        self.mapped += len(items)
+        return super().map(fn, items, *iterables[1:], **kwargs)
+
+
+def test_incremental_recalculation_replays_on_the_executor():
+    """Changed symbols are replayed across the executor and give exactly the serial results."""
+    transactions, opening = _random_trades(2000)
+    amended = transactions.copy()
+    amended.loc[1500, 'Quantity'] = 7
+    
+    with _CountingExecutor(3) as executor:
+        cache = SymbolStateCache()
+        results, reuse = _calculate_random(transactions, opening, state_cache=cache, fifo_executor=executor,
+                                           fifo_partitions=3)
+        assert results == _calculate_random(transactions, opening)[0]
+        assert executor.mapped == 3
+        
+        results, reuse = _calculate_random(amended, opening, state_cache=cache, fifo_executor=executor,
+                                           fifo_partitions=3)
+        assert results == _calculate_random(amended, opening)[0]
+        assert reuse['symbols_replayed'] == 1
+        assert executor.mapped == 4
+
+
+def test_uploads_sharing_symbols_keep_their_own_states():
+    """Two uploads of the same symbols taking turns both keep reusing their own states, within the row bound."""
+    first, opening = _random_trades(2000, seed=1)
+    second, _ = _random_trades(2000, seed=2)
+    cache = SymbolStateCache()
+    
+    _calculate_random(first, opening, state_cache=cache)
+    _calculate_random(second, opening, state_cache=cache)
+    assert cache.rows == 4000
+    for transactions in (first, second):
+        results, reuse = _calculate_random(transactions, opening, state_cache=cache)
+        assert results == _calculate_random(transactions, opening)[0]
+        assert reuse['symbols_reused'] == reuse['symbols']
+    assert cache.rows == 4000
+    
+    # Bounded by rows, the least recently used symbols are evicted
+    bounded = SymbolStateCache(max_rows=2500)
+    _calculate_random(first, opening, state_cache=bounded)
+    _calculate_random(second, opening, state_cache=bounded)
+    assert 0 < bounded.rows <= 2500
+    results, reuse = _calculate_random(second, opening, state_cache=bounded)
+    assert results == _calculate_random(second, opening)[0]
+    assert 0 < reuse['symbols_reused'] < reuse['symbols']
+
+def test_rollover_lots_match_full_history():
+    """Chaining years through a lot snapshot gives the same second year as replaying both years."""
+    transactions, opening = _random_trades(3000)
+    transactions['Date'] = (pd.Timestamp('2022-07-01') + pd.to_timedelta(np.random.default_rng(5).integers(0, 730, len(transactions)), unit='D')).strftime('%Y-%m-%d')
+    first_year = transactions[transactions['Date'] < '2023-07-01']
+    second_year = transactions[transactions['Date'] >= '2023-07-01']
+    
+    def calculate(trades, opening_file, filename):
+        _, _, tx = process_trade_transactions(trades.to_csv(index=False).encode(), 'trades.csv')
+        success, error_msg, ob = process_opening_balance(opening_file, filename)
+        assert success, error_msg
+        calculator = TaxCalculator()
+        calculator.set_opening_balance(ob)
+        calculator.set_transactions(tx)
+        success, error_msg, results = calculator.calculate_tax()
+        assert success, error_msg
+        return calculator, results
+    
+    _, full = calculate(transactions, opening, 'opening.csv')
+    first, _ = calculate(first_year, opening, 'opening.csv')
+    snapshot = io.BytesIO()
+    first.save_closing_lots(snapshot)
+    _, chained = calculate(second_year, snapshot.getvalue(), 'closing_lots.npz')
+    
+    assert chained['closing_balance'] == full['closing_balance']
+    assert chained['closing_lots'] == full['closing_lots']
+    
+    second_sales = len(full['sales_details']) - len(chained['sales_details'])
+    assert chained['sales_details'] == full['sales_details'][second_sales:]
+    full_matches = pd.DataFrame(full['sale_matches'])
+    full_matches = full_matches[full_matches['Sale ID'] >= second_sales]
+    chained_matches = pd.DataFrame(chained['sale_matches'])
+    for col in ['Symbol', 'Sale Date', 'Lot Date', 'Quantity', 'Cost in AUD', 'Gain in AUD', 'Holding Days']:
+        assert chained_matches[col].tolist() == full_matches[col].tolist()
+
+
+def test_repeated_calculation_is_served_from_cache_until_rates_change():
+    """Identical inputs hit the calculation cache; changed rate data misses it."""
+    cache = CalculationCache()
+    with tempfile.TemporaryDirectory() as directory:
+        rates = RBAExchangeRates(RateStore())
+        rates.local_file = os.path.join(directory, 'f11.1-data.csv')
+        with open(os.path.join(SAMPLE_DIR, 'f11.1-data.csv')) as f:
+            lines = f.readlines()
+        with open(rates.local_file, 'w') as f:
+            f.writelines(lines)
+        
+        def calculate():
+            calculator = _sample_calculator()
+            calculator.rba_rates = rates
+            calculator.result_cache = cache
+            success, error_msg, results = calculator.calculate_tax()
+            assert success, error_msg
+            return results
+        
+        # Changing the returned dictionary must not reach the cached entry
+        first = calculate()
+        first['reuse'] = {'rows_replayed': 1}
+        second = calculate()
+        assert (first['cache_hit'], second['cache_hit']) == (False, True)
+        assert second['sales_details'] == first['sales_details']
+        assert 'reuse' not in second and 'fx_lookups' not in second
+        assert second['calculation_date'] >= first['calculation_date']
+        
+        # Drop the last rate row so the rate data has a new version
+        data_end = max(i for i, line in enumerate(lines) if line[:2].isdigit())
+        with open(rates.local_file, 'w') as f:
+            f.writelines(lines[:data_end] + lines[data_end + 1:])
+        
+        assert calculate()['cache_hit'] is False
+        assert cache.stats()['misses'] == 2
@@ -0,0 +1,151 @@
+"""
+Tests for parsing opening balance and trade transaction files.
+"""
+import sys
+import os
+import io
+import pytest
+import pandas as pd
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from src.utils.file_processor import process_opening_balance, process_trade_transactions, TRADE_TRANSACTION_COLUMNS
+from src.utils.excel_reader import _prune_rows, get_excel_cache
+from src.models.fifo_engine import FifoEngine
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_data')
+SAMPLE_TRANSACTIONS = os.path.join(SAMPLE_DIR, 'trade_transactions.csv')
+SAMPLE_OPENING_BALANCE = os.path.join(SAMPLE_DIR, 'opening_balance.csv')
+
+
+def test_uploads_parse_from_streams_and_bytes():
+    """Paths, file-like objects and raw bytes all parse to the same frame."""
+    _, _, from_path = process_trade_transactions(SAMPLE_TRANSACTIONS)
+    
+    with open(SAMPLE_TRANSACTIONS, 'rb') as f:
+        data = f.read()
+    success, error_msg, from_stream = process_trade_transactions(io.BytesIO(data), 'Trades.CSV')
+    assert success, error_msg
+    success, error_msg, from_bytes = process_trade_transactions(data, 'trades.csv')
+    assert success, error_msg
+    
+    assert from_stream.equals(from_path)
+    assert from_bytes.equals(from_path)
+
+
+def test_unsupported_format_and_missing_columns_are_reported():
+    """Bad uploads return an error message rather than raising."""
+    with open(SAMPLE_OPENING_BALANCE, 'rb') as f:
+        data = f.read()
+    
+    assert process_opening_balance(data, 'balance.txt') == (False, "Unsupported file format. Please use CSV or Excel.", None)
+    
+    success, error_msg, _ = process_trade_transactions(data, 'balance.csv')
+    assert not success
+    assert error_msg == "Missing required columns: Date, Unit Price, Commission, Currency"
+
+
+def test_typed_parse_matches_declared_schema():
+    """Text columns become categories, integer quantities stay integers and
+    dates in other formats or with gaps still parse."""
+    _, _, df = process_trade_transactions(SAMPLE_TRANSACTIONS)
+    assert df['Symbol'].dtype == 'category'
+    assert df['Currency'].dtype == 'category'
+    assert df['Unit Price'].dtype == 'float64'
+    assert df['Quantity'].dtype == 'int64'
+    
+    data = (b"Date,Symbol,Quantity,Unit Price,Commission,Currency\n"
+            b"2024/01/15,ABC,10,1.5,1,USD\n"
+            b",ABC,-5,2.0,1,USD\n")
+    success, error_msg, df = process_trade_transactions(data, 'trades.csv')
+    assert success, error_msg
+    assert str(df['Date'].iloc[0].date()) == '2024-01-15'
+    assert df['Date'].isna().iloc[1]
+
+
+def test_excel_rows_are_pruned_to_required_columns():
+    """The header is found below preamble rows and only required cells are kept."""
+    rows = [
+        ('Broker statement', None),
+        ('Account', 'U123'),
+        (),
+        ('Notes', 'Currency', 'Commission', 'Unit Price', 'Quantity', 'Symbol', 'Date', 'Exchange'),
+        ('x', 'USD', 1.0, 10.5, 5, 'ABC', '2024-01-15', 'NYSE'),
+        (None, None, None, None, None, None, None, 'spacer'),
+        ('y', 'EUR', 2.0, 20.0, -5, 'DEF', '2024-02-01'),
+    ]
+    df = _prune_rows(rows, TRADE_TRANSACTION_COLUMNS)
+    assert list(df.columns) == TRADE_TRANSACTION_COLUMNS
+    assert df.to_dict('records') == [
+        {'Date': '2024-01-15', 'Symbol': 'ABC', 'Quantity': 5, 'Unit Price': 10.5, 'Commission': 1.0, 'Currency': 'USD'},
+        {'Date': '2024-02-01', 'Symbol': 'DEF', 'Quantity': -5, 'Unit Price': 20.0, 'Commission': 2.0, 'Currency': 'EUR'},
+    ]
+    assert _prune_rows(rows[:3], TRADE_TRANSACTION_COLUMNS) is None
+    
+    # calamine reads empty cells as '', which parse like openpyxl's None
+    calamine_rows = [tuple('' if cell is None else cell for cell in row) for row in rows]
+    assert _prune_rows(calamine_rows, TRADE_TRANSACTION_COLUMNS).equals(df)
+    sparse = _prune_rows(calamine_rows[:4] + [('z', 'USD', '', 10.5, 5, 'ABC', '2024-01-15')], TRADE_TRANSACTION_COLUMNS)
+    assert sparse['Commission'].tolist() == [None]
+
+
+def test_excel_upload_detects_sheet_and_caches_parse():
+    """Workbooks are read from the sheet holding the columns and match the CSV parse."""
+    openpyxl = pytest.importorskip('openpyxl')
+    _, _, from_csv = process_trade_transactions(SAMPLE_TRANSACTIONS)
+    
+    with open(SAMPLE_TRANSACTIONS) as f:
+        lines = [line.strip().split(',') for line in f if line.strip()]
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'Summary'
+    workbook.active.append(['Statement period', '2023-24'])
+    trades = workbook.create_sheet('Trades')
+    trades.append(['Generated by broker'])
+    trades.append(lines[0] + ['Exchange'])
+    for line in lines[1:]:
+        trades.append([line[0], line[1], int(line[2]), float(line[3]), float(line[4]), float(line[5]),
+                       float(line[6]), line[7], 'NASDAQ'])
+    data = io.BytesIO()
+    workbook.save(data)
+    
+    get_excel_cache().clear()
+    success, error_msg, from_excel = process_trade_transactions(data.getvalue(), 'statement.xlsx')
+    assert success, error_msg
+    pd_columns = ['Date', 'Symbol', 'Quantity', 'Unit Price', 'Commission', 'Currency', 'Net Value']
+    assert from_excel[pd_columns].astype(str).equals(from_csv[pd_columns].astype(str))
+    
+    # A named sheet is its own cache entry; the second identical upload skips the parse
+    process_trade_transactions(data.getvalue(), 'statement.xlsx', sheet_name='Trades')
+    success, _, _ = process_trade_transactions(data.getvalue(), 'statement.xlsx', sheet_name='Trades')
+    assert success and get_excel_cache().stats()['hits'] == 1
+
+
+def test_lot_level_opening_balance_keeps_acquired_dates():
+    """CSV and Excel opening balances with an Acquired column give each lot its date back."""
+    openpyxl = pytest.importorskip('openpyxl')
+    lots = pd.DataFrame({
+        'Symbol': ['ABC', 'ABC', 'DEF'],
+        'Quantity': [10, 5, 3],
+        'Total Cost in AUD': [150.0, 80.5, 42.25],
+        'Acquired': ['2022-03-01', '2023-01-15', None],
+    })
+    workbook = openpyxl.Workbook()
+    workbook.active.append(list(lots.columns) + ['Notes'])
+    for row in lots.itertuples(index=False):
+        workbook.active.append(list(row) + ['carried over'])
+    data = io.BytesIO()
+    workbook.save(data)
+    
+    get_excel_cache().clear()
+    for file, filename in ((lots.to_csv(index=False).encode(), 'lots.csv'), (data.getvalue(), 'lots.xlsx')):
+        success, error_msg, df = process_opening_balance(file, filename)
+        assert success, error_msg
+        assert 'Notes' not in df.columns
+        engine = FifoEngine()
+        engine.load_opening_balance(df)
+        assert engine.closing_lots().to_dict('records') == lots.to_dict('records')
+    
+    # Aggregated opening balances without the column parse as before
+    success, _, df = process_opening_balance(lots.drop(columns='Acquired').to_csv(index=False).encode(), 'opening.csv')
+    assert success and 'Acquired' not in df.columns
@@ -0,0 +1,386 @@
+"""
+Tests for the shared RBA rate store and exchange rate lookups.
+"""
+import sys
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from datetime import datetime
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from src.utils import rate_snapshot
+from src.utils.rba_rates import RBAExchangeRates, RateStore, compile_rate_snapshot
+
+SAMPLE_RATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_data', 'f11.1-data.csv')
+
+
+def _copy_rates(directory):
+    """Copy the sample rates file into a scratch directory."""
+    path = os.path.join(directory, 'f11.1-data.csv')
+    shutil.copyfile(SAMPLE_RATES, path)
+    return path
+
+
+def test_rates_loaded_once_and_shared():
+    """Two rate providers on the same store share one parsed table."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = RateStore()
+        first = RBAExchangeRates(store)
+        first.local_file = _copy_rates(directory)
+        second = RBAExchangeRates(store)
+        second.local_file = first.local_file
+        
+        assert first.fetch_rates() == (True, "")
+        assert second.fetch_rates() == (True, "")
+        assert first.rates_data is second.rates_data
+        
+        stats = store.stats()[os.path.abspath(first.local_file)]
+        assert stats['loads'] == 1
+        assert stats['hits'] == 1
+        assert stats['memory_bytes'] > 0
+
+
+def test_rates_reloaded_only_when_content_changes():
+    """A touched file is kept, a modified file is re-parsed."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = RateStore()
+        rates = RBAExchangeRates(store)
+        rates.local_file = _copy_rates(directory)
+        rates.fetch_rates()
+        original = rates.rates_data
+        
+        # Touch without changing contents
+        future = time.time() + 10
+        os.utime(rates.local_file, (future, future))
+        rates.fetch_rates()
+        assert rates.rates_data is original
+        
+        # Drop the last rate row
+        with open(rates.local_file) as f:
+            lines = f.readlines()
+        data_end = max(i for i, line in enumerate(lines) if line[:2].isdigit())
+        del lines[data_end]
+        with open(rates.local_file, 'w') as f:
+            f.writelines(lines)
+        os.utime(rates.local_file, (future + 10, future + 10))
+        
+        rates.fetch_rates()
+        assert rates.rates_data is not original
+        assert len(rates.rates_data) == len(original) - 1
+        assert store.stats()[os.path.abspath(rates.local_file)]['loads'] == 2
+
+
+def test_get_rate_as_of_lookup():
+    """The binary search index returns the latest valid rate on or before a date."""
+    rates = RBAExchangeRates(RateStore())
+    rates.local_file = SAMPLE_RATES
+    rates.fetch_rates()
+    data = rates.rates_data
+    
+    # Weekend falls back to the preceding Friday
+    friday = data[data['Date'] == '2024-01-12'].iloc[0]
+    assert rates.get_rate(datetime(2024, 1, 14), 'USD') == (True, "", float(friday['USD']))
+    
+    assert rates.get_rate(datetime(2000, 1, 3), 'USD') == (False, "No exchange rate data available on or before 2000-01-03", 0.0)
+    assert rates.get_rate(datetime(2024, 1, 15), 'XYZ') == (False, "Currency XYZ not found in exchange rates", 0.0)
+    
+    # A currency with no published rate on the matched day reports that day
+    success, error_msg, _ = rates.get_rate(datetime(2024, 1, 14), 'UAED')
+    assert not success
+    assert error_msg == "Invalid exchange rate (0 or NaN) for UAED on 2024-01-12"
+
+
+def test_batch_rates_match_single_lookups():
+    """The vectorised batch lookup agrees with get_rate row by row."""
+    rates = RBAExchangeRates(RateStore())
+    rates.local_file = SAMPLE_RATES
+    
+    dates = [datetime(2024, 1, 14), datetime(2024, 3, 1), datetime(2000, 1, 3), datetime(2024, 3, 1), datetime(2024, 3, 1)]
+    currencies = ['USD', 'EUR', 'USD', 'AUD', 'UAED']
+    success, _, batch, amounts_aud = rates.convert_to_aud_batch([100.0] * 5, dates, currencies)
+    assert success
+    
+    for i, (date, currency) in enumerate(zip(dates, currencies)):
+        ok, _, rate = rates.get_rate(date, currency)
+        if ok:
+            assert batch[i] == rate
+            assert amounts_aud[i] == 100.0 / rate
+        else:
+            assert np.isnan(batch[i])
+
+
+def test_batch_rates_give_missing_dates_no_rate():
+    """Missing dates get NaN like dates before the data, rather than the latest rate."""
+    rates = RBAExchangeRates(RateStore())
+    rates.local_file = SAMPLE_RATES
+    
+    success, _, batch = rates.get_rates_batch([None, datetime(2024, 1, 2), datetime(2000, 1, 3), None],
+                                              ['USD', 'USD', 'USD', 'AUD'])
+    assert success
+    assert np.isnan(batch[0]) and np.isnan(batch[2])
+    assert batch[1] == rates.get_rate(datetime(2024, 1, 2), 'USD')[2]
+    assert batch[3] == 1.0
+
+
+def test_batch_rates_resolve_each_pair_once():
+    """Repeated (date, currency) pairs are looked up once and gathered back to every row."""
+    rates = RBAExchangeRates(RateStore())
+    rates.local_file = SAMPLE_RATES
+    
+    pairs = [(datetime(2024, 1, 14), 'USD'), (datetime(2024, 3, 1), 'EUR'), (datetime(2024, 3, 1), 'USD'),
+             (datetime(2024, 3, 1), 'AUD'), (None, 'USD'), (datetime(2024, 3, 1), None)]
+    order = [0, 1, 2, 0, 3, 1, 4, 2, 5, 0, 4, 5]
+    dates = [pairs[i][0] for i in order]
+    currencies = [pairs[i][1] for i in order]
+    
+    stats = {}
+    success, _, batch = rates.get_rates_batch(dates, currencies, stats)
+    assert success
+    assert stats == {'rows': 12, 'unique_pairs': 6}
+    
+    for row, i in enumerate(order):
+        _, _, expected = rates.get_rates_batch([pairs[i][0]], [pairs[i][1]])
+        np.testing.assert_array_equal(batch[row:row + 1], expected)
+    assert batch[order.index(3)] == 1.0
+    assert np.isnan(batch[order.index(4)]) and np.isnan(batch[order.index(5)])
+    
+    lookups = rates.lookup_stats()
+    assert lookups['rows'] == 12 + len(order)
+    assert lookups['unique_pairs'] == 6 + len(order)
+    assert lookups['hit_ratio'] == 1 - lookups['unique_pairs'] / lookups['rows']
+
+
+def test_snapshot_matches_csv_and_falls_back_when_stale():
+    """A compiled snapshot is mapped instead of parsing the CSV until the CSV changes."""
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = _copy_rates(directory)
+        snapshot_dir = os.path.join(directory, 'snapshot')
+        compile_rate_snapshot([csv_path], snapshot_dir)
+        
+        store = RateStore()
+        mapped = RBAExchangeRates(store, snapshot_dir)
+        mapped.local_file = csv_path
+        assert mapped.fetch_rates() == (True, "")
+        assert isinstance(mapped.rate_table.rates, np.memmap)
+        
+        parsed = RBAExchangeRates(RateStore())
+        parsed.local_file = csv_path
+        parsed.fetch_rates()
+        assert np.array_equal(mapped.rate_table.rates, parsed.rate_table.rates, equal_nan=True)
+        assert np.array_equal(mapped.rate_table.dates, parsed.rate_table.dates)
+        assert mapped.get_rate(datetime(2024, 1, 14), 'USD') == parsed.get_rate(datetime(2024, 1, 14), 'USD')
+        assert os.path.abspath(csv_path) not in store.stats()
+        
+        # Touching the CSV keeps the snapshot, editing it falls back to the CSV
+        future = time.time() + 10
+        os.utime(csv_path, (future, future))
+        mapped.fetch_rates()
+        assert isinstance(mapped.rate_table.rates, np.memmap)
+        
+        with open(csv_path, 'a') as f:
+            f.write('\n')
+        mapped.fetch_rates()
+        assert not isinstance(mapped.rate_table.rates, np.memmap)
+        assert store.stats()[os.path.abspath(csv_path)]['loads'] == 1
+
+
+def _write_truncated(source_path, target_path, drop_rows):
+    """Write a copy of a rates file without its last drop_rows data rows."""
+    with open(source_path) as f:
+        lines = f.readlines()
+    data_rows = [i for i, line in enumerate(lines) if line[:2].isdigit()]
+    dropped = set(data_rows[-drop_rows:])
+    with open(target_path, 'w') as f:
+        f.writelines(line for i, line in enumerate(lines) if i not in dropped)
+
+
+def test_snapshot_newest_file_wins_in_any_order():
+    """Overlapping dates take the rates of the file with the latest data, whatever the argument order."""
+    with tempfile.TemporaryDirectory() as directory:
+        older = os.path.join(directory, 'older.csv')
+        _write_truncated(SAMPLE_RATES, older, 5)
+        
+        # Give the older file a different rate on a date the current file also holds
+        with open(older) as f:
+            lines = f.readlines()
+        last = max(i for i, line in enumerate(lines) if line[:2].isdigit())
+        fields = lines[last].split(',')
+        altered = datetime.strptime(fields[0], '%d-%b-%Y')
+        fields[1] = '9.9999'
+        lines[last] = ','.join(fields)
+        with open(older, 'w') as f:
+            f.writelines(lines)
+        
+        tables = []
+        for name, sources in (('current', [SAMPLE_RATES]), ('forward', [SAMPLE_RATES, older]),
+                              ('reverse', [older, SAMPLE_RATES])):
+            snapshot_dir = os.path.join(directory, name)
+            compile_rate_snapshot(sources, snapshot_dir)
+            rates = RBAExchangeRates(RateStore(), snapshot_dir)
+            rates.local_file = SAMPLE_RATES
+            rates.fetch_rates()
+            tables.append(rates.rate_table)
+        
+        current, forward, reverse = tables
+        assert np.array_equal(forward.dates, reverse.dates)
+        assert np.array_equal(forward.rates, reverse.rates, equal_nan=True)
+        for table in (forward, reverse):
+            row = np.searchsorted(table.dates, np.datetime64(altered, 'D'), side='right') - 1
+            expected = np.searchsorted(current.dates, np.datetime64(altered, 'D'), side='right') - 1
+            assert table.rates[row, table.currencies['USD']] == current.rates[expected, current.currencies['USD']]
+
+
+def test_snapshot_rewrite_keeps_the_previous_generation():
+    """Rewriting a snapshot keeps the arrays a reader of the previous manifest may still load."""
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'f11.1-data.csv')
+        snapshot_dir = os.path.join(directory, 'snapshot')
+        manifests = []
+        for drop_rows in (3, 2, 1):
+            _write_truncated(SAMPLE_RATES, csv_path, drop_rows)
+            manifests.append(compile_rate_snapshot([csv_path], snapshot_dir))
+        
+        arrays = {name for name in os.listdir(snapshot_dir) if name.endswith('.npy')}
+        assert arrays == {manifest[key] for manifest in manifests[1:] for key in ('dates_file', 'rates_file')}
+        
+        # A reader holding a manifest whose arrays are gone retries with the current one
+        store = RateStore()
+        load_arrays = rate_snapshot.load_arrays
+        calls = []
+        
+        def stale_once(snapshot, manifest):
+            calls.append(manifest['content_hash'])
+            if len(calls) == 1:
+                return load_arrays(snapshot, manifests[0])
+            return load_arrays(snapshot, manifest)
+        
+        rate_snapshot.load_arrays = stale_once
+        try:
+            table = store.get_snapshot(snapshot_dir)
+        finally:
+            rate_snapshot.load_arrays = load_arrays
+        assert table is not None and table.content_hash == manifests[2]['content_hash']
+        assert len(calls) == 2
+
+
+def test_refresh_appends_only_new_rows():
+    """An incremental refresh from a local source matches a full parse of the new file."""
+    with tempfile.TemporaryDirectory() as directory:
+        source_dir = os.path.join(directory, 'source')
+        os.makedirs(source_dir)
+        shutil.copyfile(SAMPLE_RATES, os.path.join(source_dir, 'f11.1-data.csv'))
+        
+        local_file = os.path.join(directory, 'f11.1-data.csv')
+        snapshot_dir = os.path.join(directory, 'snapshot')
+        
+        for snapshot in (None, snapshot_dir):
+            _write_truncated(SAMPLE_RATES, local_file, 5)
+            if snapshot:
+                compile_rate_snapshot([local_file], snapshot_dir)
+            store = RateStore()
+            rates = RBAExchangeRates(store, snapshot)
+            rates.local_file = local_file
+            rates.rate_source = source_dir
+            rates.fetch_rates()
+            before = rates.rate_table
+            
+            assert rates.refresh_rates() == (True, "", 5)
+            assert rates.refresh_rates() == (True, "", 0)
+            assert len(before.dates) == len(rates.rate_table.dates) - 5
+            
+            full = RBAExchangeRates(RateStore())
+            full.local_file = SAMPLE_RATES
+            full.fetch_rates()
+            assert np.array_equal(rates.rate_table.rates, full.rate_table.rates, equal_nan=True)
+            assert np.array_equal(rates.rate_table.dates, full.rate_table.dates)
+            
+            # Other readers of the store pick up the refreshed rates without re-parsing
+            reader = RBAExchangeRates(store, snapshot)
+            reader.local_file = local_file
+            reader.fetch_rates()
+            assert np.array_equal(reader.rate_table.dates, full.rate_table.dates)
+            if snapshot is None:
+                assert reader.rate_table is rates.rate_table
+                assert store.stats()[os.path.abspath(local_file)]['loads'] == 1
+            else:
+                assert isinstance(reader.rate_table.rates, np.memmap)
+            
+            # A restarted worker computes the same rates version for the refreshed data
+            restarted = RBAExchangeRates(RateStore(), snapshot)
+            restarted.local_file = local_file
+            restarted.fetch_rates()
+            assert restarted.rates_version() == rates.rates_version()
+
+
+def _write_period(source_path, target_path, years):
+    """Write a copy of a rates file keeping only data rows from the given years."""
+    with open(source_path) as f:
+        lines = f.readlines()
+    with open(target_path, 'w') as f:
+        f.writelines(line for line in lines
+                     if not line[:2].isdigit() or int(line.split(',')[0][-4:]) in years)
+
+
+def test_refresh_from_current_period_keeps_local_history():
+    """Refreshing from a file holding only recent rows appends them and keeps the older local rows."""
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'current.csv')
+        _write_period(SAMPLE_RATES, source, {2025})
+        local_file = os.path.join(directory, 'f11.1-data.csv')
+        _write_truncated(SAMPLE_RATES, local_file, 5)
+        
+        rates = RBAExchangeRates(RateStore())
+        rates.local_file = local_file
+        rates.rate_source = source
+        rates.fetch_rates()
+        assert rates.refresh_rates() == (True, "", 5)
+        
+        # A fresh parse of the local file gives the whole history including the new rows
+        restarted = RBAExchangeRates(RateStore())
+        restarted.local_file = local_file
+        restarted.fetch_rates()
+        full = RBAExchangeRates(RateStore())
+        full.local_file = SAMPLE_RATES
+        full.fetch_rates()
+        assert np.array_equal(restarted.rate_table.dates, full.rate_table.dates)
+        assert np.array_equal(restarted.rate_table.rates, full.rate_table.rates, equal_nan=True)
+        assert np.array_equal(rates.rate_table.rates, full.rate_table.rates, equal_nan=True)
+
+
+def test_history_periods_load_lazily_and_match_full_file():
+    """Dates before the local file are served from registered periods, parsed on demand."""
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {}
+        for name, years in (('2023', {2023}), ('2024', {2024}), ('current', {2025})):
+            paths[name] = os.path.join(directory, f'f11.1-{name}.csv')
+            _write_period(SAMPLE_RATES, paths[name], years)
+        
+        rates = RBAExchangeRates(RateStore())
+        rates.local_file = paths['current']
+        rates.register_period_file(paths['2023'], max_loaded=1)
+        rates.register_period_file(paths['2024'], max_loaded=1)
+        assert rates.periods.stats()['loads'] == 0
+        
+        full = RBAExchangeRates(RateStore())
+        full.local_file = SAMPLE_RATES
+        
+        # 2024-01-01 precedes the 2024 file's first rate, so only the 2023 period is parsed
+        assert rates.get_rate(datetime(2024, 1, 1), 'USD') == full.get_rate(datetime(2024, 1, 1), 'USD')
+        assert rates.periods.stats()['loads'] == 1
+        assert rates.periods.stats()['periods'][0]['loaded']
+        
+        dates = [datetime(2025, 3, 1), datetime(2024, 6, 30), datetime(2024, 1, 1), datetime(2023, 2, 1), datetime(2022, 6, 1)]
+        _, _, batch = rates.get_rates_batch(dates, ['USD'] * len(dates))
+        _, _, expected = full.get_rates_batch(dates, ['USD'] * len(dates))
+        assert np.array_equal(batch, expected, equal_nan=True)
+        
+        # Only one parsed period is kept; prefetching a 2024 span loads it and its predecessor
+        stats = rates.periods.stats()
+        assert sum(period['loaded'] for period in stats['periods']) == 1
+        assert stats['evictions'] > 0
+        assert rates.prefetch_rates(datetime(2024, 7, 1), datetime(2025, 2, 1)) == 2
+        assert rates.prefetch_rates(datetime(2025, 2, 1), datetime(2025, 3, 1)) == 0
@@ -0,0 +1,200 @@
+"""
+Tests for the server-side calculation result store and detail tables.
+"""
+import sys
+import os
+import tempfile
+import time
+import json
+import gzip
+import threading
+import pytest
+
+# Add the app directory to the path so the src package resolves as it does in the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+from src.utils.result_store import ResultStore
+from src.utils.detail_tables import DetailTable, display_rows
+from src.utils.calculation_cache import CalculationCache
+from src.utils.job_queue import JobQueue, DONE, FAILED
+from src.utils.response_encoding import iter_json, iter_arrow, compress, response_formats
+
+
+def test_least_recently_used_result_is_evicted():
+    """Without a spill directory the oldest unused result is dropped."""
+    store = ResultStore(max_entries=2)
+    first = store.put({'n': 1})
+    second = store.put({'n': 2})
+    
+    # Touch the first so the second becomes least recently used
+    assert store.get(first) == {'n': 1}
+    store.put({'n': 3})
+    
+    assert store.get(second) is None
+    assert store.get(first) == {'n': 1}
+    assert len(store) == 2
+
+
+def test_evicted_results_spill_to_disk():
+    """With a spill directory evicted results are reloaded from disk."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = ResultStore(max_entries=1, spill_dir=directory)
+        first = store.put({'n': 1})
+        store.put({'n': 2})
+        
+        assert os.path.exists(os.path.join(directory, f"{first}.pkl"))
+        assert store.get(first) == {'n': 1}
+        assert len(store) == 2
+
+
+def test_results_expire_after_ttl():
+    """Results older than the TTL are no longer returned."""
+    store = ResultStore(ttl_seconds=0.01)
+    result_id = store.put({'n': 1})
+    time.sleep(0.02)
+    
+    assert store.get(result_id) is None
+    assert store.get('unknown') is None
+
+
+def test_detail_table_paging_sorting_and_filtering():
+    """Detail tables return one page of the sorted, filtered rows."""
+    records = [
+        {'Date': '2024-01-0%d' % day, 'Symbol': symbol, 'Value in AUD': float(day * 10)}
+        for day, symbol in zip(range(1, 10), ['AAPL', 'MSFT', 'AAPL'] * 3)
+    ]
+    table = DetailTable(records)
+    
+    rows, total_rows = table.query(page=2, page_size=4)
+    assert total_rows == 9
+    assert [row['Date'] for row in rows] == ['2024-01-05', '2024-01-06', '2024-01-07', '2024-01-08']
+    
+    rows, total_rows = table.query(page_size=2, sort_by='Value in AUD', descending=True, symbol='AAPL',
+                                   date_to='2024-01-07')
+    assert total_rows == 5
+    assert [row['Value in AUD'] for row in rows] == [70.0, 60.0]
+    
+    with pytest.raises(ValueError):
+        table.query(sort_by='Unknown')
+
+
+def test_detail_table_sorts_missing_values_last_and_keeps_ties_stable():
+    """Sorting puts missing values last in both directions and keeps ties in calculation order."""
+    table = DetailTable([{'Lot': i, 'Acquired': acquired}
+                         for i, acquired in enumerate([None, '2023-01-01', '2022-06-30', '2023-01-01'])])
+    
+    rows, _ = table.query(sort_by='Acquired')
+    assert [row['Lot'] for row in rows] == [2, 1, 3, 0]
+    rows, _ = table.query(sort_by='Acquired', descending=True)
+    assert [row['Lot'] for row in rows] == [1, 3, 2, 0]
+    
+    with pytest.raises(ValueError):
+        DetailTable([{'Acquired': 1.5}, {'Acquired': '2023-01-01'}]).query(sort_by='Acquired')
+
+
+def test_calculation_cache_counts_and_spills_to_disk():
+    """The calculation cache evicts to its disk tier and counts hits and misses."""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CalculationCache(max_entries=1, cache_dir=directory)
+        cache.put('a', {'n': 1})
+        cache.put('b', {'n': 2})
+        
+        assert len(cache) == 1
+        assert cache.get('a') == {'n': 1}
+        assert cache.get('missing') is None
+        
+        # A new cache on the same directory finds results written by the first
+        assert CalculationCache(cache_dir=directory).get('a') == {'n': 1}
+        
+        stats = cache.stats()
+        assert (stats['hits'], stats['disk_hits'], stats['misses'], stats['evictions']) == (1, 1, 1, 2)
+        assert stats['hit_ratio'] == 0.5
+
+
+def test_job_queue_reports_stages_and_persists_outcome():
+    """Jobs publish their stage timings while running and outcomes survive a restart."""
+    parsing = threading.Event()
+    
+    def job(timer):
+        with timer.stage('parse'):
+            time.sleep(0.01)
+            parsing.wait(5)
+        with timer.stage('fifo'):
+            with timer.stage('fx'):
+                pass
+        return {'success': True, 'result_id': 'abc'}
+    
+    with tempfile.TemporaryDirectory() as db_dir:
+        db_path = os.path.join(db_dir, 'jobs.sqlite')
+        queue = JobQueue(workers=1, db_path=db_path)
+        done_id = queue.submit(job)
+        failed_id = queue.submit(lambda timer: {'success': False, 'error': 'bad file'})
+        
+        # Follow the first job the way the progress stream does
+        seen, version = [], -1
+        while True:
+            state, version = queue.wait(done_id, version, timeout=5)
+            seen.append(state['stage'])
+            if state['stage'] == 'parse':
+                parsing.set()
+            if state['status'] == DONE:
+                break
+        
+        assert 'parse' in seen and seen[-1] is None
+        assert set(state['stages']) == {'parse', 'fifo', 'fx'}
+        assert state['stages']['parse'] >= 0.01
+        assert state['result']['result_id'] == 'abc'
+        queue.shutdown()
+        assert queue.get(failed_id)['status'] == FAILED
+        assert queue.get(failed_id)['error'] == 'bad file'
+        
+        # A new process sees finished jobs; a job left running is reported as interrupted
+        reopened = JobQueue(workers=1, db_path=db_path)
+        assert reopened.get(done_id)['status'] == DONE
+        assert reopened.get('unknown') is None
+        reopened._db.execute("UPDATE jobs SET state = ? WHERE job_id = ?",
+                             ('{"job_id": "%s", "status": "running", "stage": "fifo"}' % failed_id, failed_id))
+        reopened._db.commit()
+        reopened.shutdown()
+        assert JobQueue(workers=1, db_path=db_path).get(failed_id)['status'] == FAILED
+
+
+def test_compact_formats_carry_the_same_rows_as_records():
+    """Columnar JSON and Arrow streams decode to the record rows, in small batches and compressed."""
+    table = DetailTable([{'Date': f'2024-01-{day:02d}', 'Symbol': 'S' + str(day % 3), 'Quantity': day,
+                          'Value in AUD': day * 1.5} for day in range(1, 29)])
+    frame = table.select(sort_by='Symbol')
+    records = frame.to_dict('records')
+    
+    as_records = json.loads(b''.join(iter_json(frame, 'records', {'total_rows': 28}, batch_rows=5)))
+    assert as_records['rows'] == records and as_records['total_rows'] == 28
+    
+    as_columns = json.loads(gzip.decompress(b''.join(compress(iter_json(frame, 'columns', {}), 'gzip'))))
+    assert as_columns['columns'] == table.columns
+    assert [dict(zip(as_columns['columns'], row)) for row in zip(*as_columns['data'])] == records
+    
+    empty = json.loads(b''.join(iter_json(frame.iloc[:0], 'records', {})))
+    assert empty['rows'] == [] and empty['columns'] == table.columns
+    
+    if 'arrow' in response_formats():
+        import pyarrow.ipc
+        stream = b''.join(iter_arrow(frame, batch_rows=10))
+        assert pyarrow.ipc.open_stream(stream).read_all().to_pylist() == records
+
+
+def test_display_rows_format_like_the_template_filters():
+    """Vectorised formatting gives the strings the per-cell template filters produced."""
+    records = [{'Symbol': 'ABC', 'Quantity': 3, 'Total Cost in AUD': 100.0, 'Exchange Rate': 0.65432,
+                'Value in AUD': 1234.5678},
+               {'Symbol': 'DEF', 'Quantity': 7, 'Total Cost in AUD': 20.125, 'Exchange Rate': 1.0,
+                'Value in AUD': -0.005}]
+    table = DetailTable(records)
+    
+    rows = list(display_rows(table.frame, batch_rows=1))
+    assert [row['Symbol'] for row in rows] == ['ABC', 'DEF']
+    assert [row['Quantity'] for row in rows] == [3, 7]
+    for row, record in zip(rows, records):
+        assert row['Total Cost in AUD'] == "%.2f" % record['Total Cost in AUD']
+        assert row['Average Cost'] == "%.2f" % (record['Total Cost in AUD'] / record['Quantity'])
+        assert row['Exchange Rate'] == "%.4f" % record['Exchange Rate']
+        assert row['Value in AUD'] == "%.2f" % record['Value in AUD']